@@ -0,0 +1,104 @@
+"""Load test for the excavator control path against a fake excavator.
+
+Drives nuxhash's Excavator miner, backed by tests/fake_excavator.py instead of
+the real excavator, with simulated rigs of many GPUs and reports command
+throughput and switching latency. Run from the repository root:
+
+    python -m benchmarks.excavator_load [--devices 64 256] [--delay 0.0005]
+"""
+import argparse
+import os
+import time
+from copy import deepcopy
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import nuxhash.settings
+from nuxhash.devices.nvidia import NvidiaDevice
+from nuxhash.miners.excavator import Excavator
+from nuxhash.miners.miner import run_transition
+from tests.fake_excavator import fake_devices
+
+
+FAKE_EXCAVATOR = Path(__file__).parent.parent.resolve()/'tests'/'fake_excavator.py'
+COMMANDS = 1000
+
+
+def make_excavator(config_dir, n_devices, delay):
+    os.mkdir(config_dir/'excavator')
+    os.symlink(FAKE_EXCAVATOR, config_dir/'excavator'/'excavator')
+    settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+    settings['excavator_miner']['args'] = f'--devices {n_devices} --delay {delay}'
+    excavator = Excavator(config_dir)
+    excavator.settings = settings
+    devices = [NvidiaDevice(pci_bus, uuid, name)
+               for pci_bus, uuid, name in fake_devices(n_devices)]
+    return excavator, devices
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p*len(values)))]
+
+
+def run(n_devices, delay):
+    config_dir = Path(mkdtemp())
+    excavator, devices = make_excavator(config_dir, n_devices, delay)
+    try:
+        secs, _ = timed(excavator.load)
+        print(f'{n_devices} devices: started in {secs*1e3:.1f} ms')
+        server = excavator.server
+
+        secs, _ = timed(lambda: [server.send_command('info', [])
+                                 for i in range(COMMANDS)])
+        print(f'  sequential commands: {COMMANDS/secs:10.0f} /s')
+        secs, _ = timed(lambda: server.send_commands([('info', [])]*COMMANDS))
+        print(f'  pipelined commands:  {COMMANDS/secs:10.0f} /s')
+
+        algorithms = excavator.algorithms
+        a, b = algorithms[0], algorithms[1]
+        idle = {}
+        all_a = {device: a for device in devices}
+        half_b = {device: (b if i % 2 == 0 else a)
+                  for i, device in enumerate(devices)}
+        for name, old, new in [('assign all', idle, all_a),
+                               ('switch half', all_a, half_b),
+                               ('stop all', half_b, idle)]:
+            secs, started = timed(lambda: run_transition(old, new))
+            if len(started) > 0:
+                latencies = list(started.values())
+                print(f'  {name + ":":13} {secs*1e3:8.1f} ms, '
+                      + f'worker.add latency p50 {percentile(latencies, 0.5)*1e3:.1f} ms, '
+                      + f'p99 {percentile(latencies, 0.99)*1e3:.1f} ms')
+            else:
+                print(f'  {name + ":":13} {secs*1e3:8.1f} ms')
+
+        run_transition(idle, all_a)
+        secs, _ = timed(lambda: [a.current_speeds() for i in range(100)])
+        print(f'  speed poll:    {secs*1e3/100:8.2f} ms per rig-wide poll')
+    finally:
+        excavator.unload()
+        rmtree(config_dir)
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description='Measure excavator control throughput against a fake rig.')
+    argp.add_argument('--devices', type=int, nargs='+', default=[64, 256],
+                      help='rig sizes to simulate')
+    argp.add_argument('--delay', type=float, default=0.0,
+                      help='simulated excavator response time, in seconds')
+    args = argp.parse_args()
+    for n_devices in args.devices:
+        run(n_devices, args.delay)
+
+
+if __name__ == '__main__':
+    main()
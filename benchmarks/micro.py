@@ -0,0 +1,283 @@
+"""Micro-benchmarks for nuxhash's own hot paths.
+
+Times the profit switchers, the revenue calculation, benchmark file I/O, wallet
+address checks, speed formatting and excavator RPC framing on simulated rigs of
+1 to 256 devices. Results can be saved as JSON and compared between commits.
+Run from the repository root:
+
+    python -m benchmarks.micro [--devices 1 16 256] [--output new.json]
+    python -m benchmarks.micro --compare old.json new.json
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+from collections import defaultdict
+from contextlib import contextmanager
+from copy import deepcopy
+from pathlib import Path
+
+import nuxhash.settings
+from nuxhash import utils
+from nuxhash.benchmarking import Benchmark
+from nuxhash.bitcoin import check_bc
+from nuxhash.daemon import DONATE_ADDRESS
+from nuxhash.devices.nvidia import NvidiaDevice
+from nuxhash.miners.excavator import Excavator, ExcavatorConnection
+from nuxhash.switching.forecast import ForecastSwitcher
+from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.switching.optimizer import OptimizingSwitcher
+from nuxhash.switching.revenue import RevenueMatrix
+from nuxhash.switching.switchcost import SwitchCostSwitcher
+from tests.fake_excavator import fake_devices, FakeExcavator
+
+
+RIG_SIZES = [1, 4, 16, 64, 256]
+REPEAT = 5
+# slowdown, as a ratio of new to old time, reported as a regression
+REGRESSION = 1.1
+
+# list of (name, case) in the order they run
+CASES = []
+
+
+def case(function):
+    """Register a benchmark case.
+
+    A case is a generator function that takes a Rig, sets up, yields the
+    function to time and then cleans up.
+    """
+    CASES.append((function.__name__, contextmanager(function)))
+    return function
+
+
+class Rig(object):
+    """Simulated rig: devices, excavator's algorithms, benchmarks and payrates."""
+
+    def __init__(self, n_devices, seed=0):
+        rand = random.Random(seed)
+        self.devices = [NvidiaDevice(pci_bus, uuid, name)
+                        for pci_bus, uuid, name in fake_devices(n_devices)]
+        # Constructing the miner starts nothing, so any path will do.
+        self.algorithms = Excavator(Path('.')).algorithms
+        self.benchmarks = defaultdict(lambda: {})
+        for device in self.devices:
+            for algorithm in self.algorithms:
+                speeds = [rand.uniform(1e6, 1e9) for _ in algorithm.algorithms]
+                self.benchmarks[device][algorithm.name] = Benchmark(
+                    speeds, stddev=[speed*0.01 for speed in speeds], error=0.01,
+                    warmup=30, timestamp=int(time.time()))
+        sub_algos = set(sum([algorithm.algorithms
+                             for algorithm in self.algorithms], []))
+        self.payrates = {sub_algo: rand.uniform(1e-12, 1e-9)
+                         for sub_algo in sorted(sub_algos)}
+
+
+@case
+def naive_decide(rig):
+    settings = nuxhash.settings.DEFAULT_SETTINGS
+    revenues = RevenueMatrix(rig.devices, rig.algorithms,
+                             rig.benchmarks).revenues(rig.payrates)
+    switcher = NaiveSwitcher(settings)
+    switcher.decide(revenues, None)
+    yield lambda: switcher.decide(revenues, None)
+
+
+@case
+def switchcost_decide(rig):
+    settings = nuxhash.settings.DEFAULT_SETTINGS
+    revenues = RevenueMatrix(rig.devices, rig.algorithms,
+                             rig.benchmarks).revenues(rig.payrates)
+    switcher = SwitchCostSwitcher(settings, benchmarks=rig.benchmarks)
+    switcher.decide(revenues, 0)
+    yield lambda: switcher.decide(revenues, 0)
+
+
+@case
+def optimizer_decide(rig):
+    settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+    limits = settings['constraints']
+    limits['power_cap'] = 100*len(rig.devices)
+    limits['max_devices_per_algorithm'] = max(1, len(rig.devices)//4)
+    limits['cpu_budget'] = 2
+    limits['grouping'] = 0.05
+    revenues = RevenueMatrix(rig.devices, rig.algorithms,
+                             rig.benchmarks).revenues(rig.payrates)
+    switcher = OptimizingSwitcher(settings)
+    switcher.decide(revenues, None)
+    yield lambda: switcher.decide(revenues, None)
+
+
+@case
+def forecast_decide(rig):
+    settings = nuxhash.settings.DEFAULT_SETTINGS
+    revenues = RevenueMatrix(rig.devices, rig.algorithms,
+                             rig.benchmarks).revenues(rig.payrates)
+    switcher = ForecastSwitcher(settings)
+    for i in range(settings['switching']['window']):
+        switcher.decide(revenues, None)
+    yield lambda: switcher.decide(revenues, None)
+
+
+@case
+def revenues(rig):
+    matrix = RevenueMatrix(rig.devices, rig.algorithms, rig.benchmarks)
+    yield lambda: matrix.revenues(rig.payrates)
+
+
+@case
+def revenue_matrix(rig):
+    yield lambda: RevenueMatrix(rig.devices, rig.algorithms, rig.benchmarks)
+
+
+@case
+def write_benchmarks(rig):
+    def write():
+        nuxhash.settings.write_benchmarks_to_file(io.StringIO(), rig.benchmarks)
+    yield write
+
+
+@case
+def read_benchmarks(rig):
+    fd = io.StringIO()
+    nuxhash.settings.write_benchmarks_to_file(fd, rig.benchmarks)
+    data = fd.getvalue()
+    yield lambda: nuxhash.settings.read_benchmarks_from_file(
+        io.StringIO(data), rig.devices)
+
+
+@case
+def check_bc_per_device(rig):
+    # One wallet check is independent of rig size; do one per device so the
+    # sizes stay comparable.
+    addresses = [DONATE_ADDRESS]*len(rig.devices)
+    yield lambda: [check_bc(address) for address in addresses]
+
+
+@case
+def format_speeds(rig):
+    samples = [rig.benchmarks[device][rig.algorithms[-1].name]
+               for device in rig.devices]
+    yield lambda: [utils.format_speeds(sample) for sample in samples]
+
+
+@case
+def excavator_worker_list(rig):
+    fake = FakeExcavator(devices=rig.devices)
+    fake.start()
+    connection = ExcavatorConnection(fake.address)
+    try:
+        connection.send('algorithm.add', ['equihash'])
+        for device_id in range(len(rig.devices)):
+            connection.send('worker.add', ['equihash', device_id])
+        yield lambda: connection.send('worker.list', [])
+    finally:
+        connection.close()
+        fake.stop()
+
+
+def measure(function):
+    """Return the best seconds per call of function."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEAT, number=number))/number
+
+
+def run(rig_sizes, names=None):
+    """Return dict of case name -> rig size -> seconds per call."""
+    results = defaultdict(dict)
+    rigs = {n_devices: Rig(n_devices) for n_devices in rig_sizes}
+    for name, make_case in CASES:
+        if names is not None and name not in names:
+            continue
+        for n_devices in rig_sizes:
+            with make_case(rigs[n_devices]) as function:
+                secs = measure(function)
+            results[name][str(n_devices)] = secs
+            print(f'{name:24} {n_devices:4} devices {format_secs(secs)}')
+    return results
+
+
+def format_secs(secs):
+    if secs >= 1.0:
+        return '%8.2f s ' % secs
+    elif secs >= 1e-3:
+        return '%8.2f ms' % (secs*1e3)
+    else:
+        return '%8.2f us' % (secs*1e6)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Print the change in each result between two saved runs.
+
+    Returns True if any case got slower by more than REGRESSION.
+    """
+    regressed = False
+    print(f'{"":34} {old["commit"] or "old":>11} {new["commit"] or "new":>11}')
+    for name, sizes in new['results'].items():
+        for n_devices, secs in sizes.items():
+            old_secs = old['results'].get(name, {}).get(n_devices, None)
+            if old_secs is None:
+                print(f'{name:24} {n_devices:>4} devices {"":11} '
+                      + format_secs(secs))
+                continue
+            ratio = secs/old_secs
+            flag = ''
+            if ratio > REGRESSION:
+                flag = '  slower'
+                regressed = True
+            elif ratio < 1/REGRESSION:
+                flag = '  faster'
+            print(f'{name:24} {n_devices:>4} devices {format_secs(old_secs)} '
+                  + f'{format_secs(secs)} {ratio:6.2f}x{flag}')
+    return regressed
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="Time nuxhash's hot paths on simulated rigs.")
+    argp.add_argument('--devices', type=int, nargs='+', default=RIG_SIZES,
+                      help='rig sizes to simulate')
+    argp.add_argument('--case', nargs='+', dest='cases',
+                      choices=[name for name, _ in CASES],
+                      help='only run these cases')
+    argp.add_argument('--output', type=Path,
+                      help='save results to this JSON file')
+    argp.add_argument('--compare', type=Path, nargs=2, metavar=('OLD', 'NEW'),
+                      help='compare two saved results instead of running')
+    args = argp.parse_args()
+
+    if args.compare:
+        old_path, new_path = args.compare
+        with open(old_path, 'r') as fd:
+            old = json.load(fd)
+        with open(new_path, 'r') as fd:
+            new = json.load(fd)
+        return 1 if compare(old, new) else 0
+
+    results = run(args.devices, args.cases)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump({'commit': git_commit(),
+                       'python': platform.python_version(),
+                       'timestamp': int(time.time()),
+                       'results': results}, fd, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,3 +5,7 @@ def nuxhashd():
 def nuxhash_gui():
     from nuxhash.gui.main import main
     main()
+
+def nuxhash_backtest():
+    from nuxhash.backtest import main
+    main()
@@ -0,0 +1,417 @@
+"""Replay recorded NiceHash payrates through profit switchers, offline.
+
+Payrates are recorded to payrates.jsonl in the configuration directory while
+mining with switching.record_payrates enabled. nuxhash-backtest replays them
+against a benchmarks file under any number of settings, e.g.
+
+    nuxhash-backtest --set switching.method=naive,switchcost \\
+                     --set switching.threshold=0.02,0.05,0.1,0.2
+
+and reports the revenue, switch count and idle time of each combination.
+"""
+import argparse
+import itertools
+import json
+import time
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from copy import deepcopy
+from pathlib import Path
+
+from nuxhash import settings
+from nuxhash.miners import all_miners
+from nuxhash.switching import make_switcher
+from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.switching.revenue import RevenueMatrix
+
+
+SECS_PER_DAY = 24*60*60
+# seconds for a miner to start an algorithm, before warmup
+DEFAULT_LATENCY = 1.0
+
+
+class RecordedDevice(object):
+    """Device known only by its name in a benchmarks file.
+
+    Each name gets one instance, so the default identity comparison and hash
+    serve, and are much cheaper in the replay loop than comparing names.
+    """
+    def __init__(self, name):
+        self.name = name
+    def __str__(self):
+        return self.name
+    def __repr__(self):
+        return f'<recorded device {self.name}>'
+
+
+class PayrateHistory(object):
+    """Recorded payrates, each snapshot holding until the next.
+
+    Running integrals of every sub-algorithm's payrate are kept alongside, so
+    earnings over any stretch of time take two lookups, however many snapshots
+    the stretch spans.
+    """
+
+    def __init__(self, records):
+        """
+        records -- list of (Unix time, dict of sub-algorithm -> payrate)
+        """
+        self.times = array('d', [timestamp for timestamp, _ in records])
+        self.snapshots = [payrates for _, payrates in records]
+        self.sub_algos = sorted(set().union(*self.snapshots))
+        # dict of sub-algorithm -> integral of payrate up to each snapshot
+        self._integrals = {}
+        for sub_algo in self.sub_algos:
+            integral = array('d', [0.0])*len(records)
+            for i in range(1, len(records)):
+                payrate = self.snapshots[i - 1].get(sub_algo, 0.0)
+                integral[i] = (integral[i - 1]
+                               + payrate*(self.times[i] - self.times[i - 1]))
+            self._integrals[sub_algo] = integral
+
+    @property
+    def start(self):
+        return self.times[0]
+
+    @property
+    def end(self):
+        return self.times[-1]
+
+    def _index(self, timestamp):
+        return max(0, bisect_right(self.times, timestamp) - 1)
+
+    def payrates(self, timestamp):
+        """Return the payrates in effect at timestamp."""
+        return self.snapshots[self._index(timestamp)]
+
+    def integrals(self, timestamp):
+        """Return dict of sub-algorithm -> integral of its payrate to timestamp."""
+        i = self._index(timestamp)
+        secs = timestamp - self.times[i]
+        snapshot = self.snapshots[i]
+        return {sub_algo: integral[i] + snapshot.get(sub_algo, 0.0)*secs
+                for sub_algo, integral in self._integrals.items()}
+
+
+class Simulation(object):
+    """One profit switcher mining through the history, and its tally."""
+
+    def __init__(self, nx_settings, benchmarks, latency=DEFAULT_LATENCY):
+        self.settings = nx_settings
+        self.switcher = make_switcher(nx_settings, benchmarks)
+        self.switcher.reset()
+        self._benchmarks = benchmarks
+        self._latency = latency
+        # dict of device -> algorithm
+        self._assignments = {}
+        # dict of device -> time it starts hashing on its algorithm
+        self._hashing_from = {}
+        # set of devices that have run an algorithm
+        self._started = set()
+        # BTC earned
+        self.revenue = 0.0
+        # times a device changed algorithms, or went back to work after idling
+        self.switches = 0
+        # seconds summed over devices, spent not hashing
+        self.idle_secs = 0.0
+        # seconds summed over devices, spent in all
+        self.total_secs = 0.0
+
+    def downtime(self, device, algorithm):
+        """Seconds from switching device to algorithm until it hashes."""
+        benchmark = self._benchmarks.get(device, {}).get(algorithm.name, None)
+        warmup = getattr(benchmark, 'warmup', None)
+        if warmup is None:
+            warmup = algorithm.warmup_secs
+        return self._latency + warmup
+
+    def step(self, history, revenues, start, end, start_integrals,
+             end_integrals):
+        """Decide on revenues at start, then mine until end."""
+        decision = self.switcher.decide(revenues, start)
+        started = {}
+        for device in revenues:
+            self.total_secs += end - start
+            algorithm = decision.get(device, None)
+            if algorithm != self._assignments.get(device, None):
+                if algorithm is not None:
+                    self._hashing_from[device] = (
+                        start + self.downtime(device, algorithm))
+                    started[device] = self._latency
+                    if device in self._started:
+                        self.switches += 1
+                    self._started.add(device)
+            if algorithm is None:
+                self.idle_secs += end - start
+                continue
+
+            hashing_from = self._hashing_from[device]
+            if hashing_from >= end:
+                self.idle_secs += end - start
+                continue
+            elif hashing_from > start:
+                self.idle_secs += hashing_from - start
+                from_integrals = history.integrals(hashing_from)
+            else:
+                from_integrals = start_integrals
+            speeds = self._benchmarks.get(device, {}).get(algorithm.name, [])
+            self.revenue += sum(
+                [speed*(end_integrals.get(sub_algo, 0.0)
+                        - from_integrals.get(sub_algo, 0.0))
+                 for sub_algo, speed in zip(algorithm.algorithms, speeds)]
+                )/SECS_PER_DAY
+        self._assignments = decision
+        self.switcher.switched(started)
+
+
+class NaiveBatch(object):
+    """Many simulations of NaiveSwitcher, differing only in threshold, at once.
+
+    NaiveSwitcher decides for each device on its own, and remembers only the
+    algorithm each device runs. So for each device, the simulations are
+    grouped by that algorithm, with their switching factors (1 + threshold)
+    kept sorted. Each decision finds the best algorithm once for all of them,
+    and the simulations in a group that switch to it are a prefix of the
+    group, found with one bisect. A simulation's earnings are settled only
+    when it leaves an algorithm, from the payrate integrals at either end, so
+    the cost of a decision does not grow with the number of simulations.
+    """
+
+    def __init__(self, simulations, benchmarks):
+        self.simulations = simulations
+        self._benchmarks = benchmarks
+        self._factors = [1.0 + simulation.settings['switching']['threshold']
+                         for simulation in simulations]
+        # dict of device -> algorithm -> (factors, simulation indices),
+        # ordered by factor
+        self._groups = defaultdict(dict)
+        # dict of device -> simulation index -> (time it switched, time it
+        # starts hashing, what its algorithm would have earned by then)
+        self._stints = defaultdict(dict)
+        # dict of (device, algorithm) -> list of (sub-algorithm, speed)
+        self._speeds = {}
+
+    def step(self, history, revenues, start, start_integrals):
+        """Decide on revenues at start for every simulation."""
+        for device, device_revenues in revenues.items():
+            switch_algo = max(device_revenues, key=device_revenues.get)
+            switch_revenue = device_revenues[switch_algo]
+            groups = self._groups[device]
+            if len(groups) == 0:
+                self._enter(history, device, switch_algo, start,
+                            list(zip(self._factors,
+                                     range(len(self.simulations)))),
+                            switching=False)
+                continue
+            moving = []
+            for stay_algo, (factors, indices) in list(groups.items()):
+                stay_revenue = device_revenues[stay_algo]
+                if stay_algo == switch_algo or stay_revenue == 0.0:
+                    continue
+                n = bisect_right(factors, switch_revenue/stay_revenue)
+                if n == 0:
+                    continue
+                self._leave(device, stay_algo, indices[:n], start,
+                            start_integrals)
+                moving += zip(factors[:n], indices[:n])
+                if n == len(factors):
+                    del groups[stay_algo]
+                else:
+                    del factors[:n], indices[:n]
+            if len(moving) > 0:
+                self._enter(history, device, switch_algo, start, moving,
+                            switching=True)
+
+    def finish(self, history):
+        """Settle every simulation's earnings at the end of history."""
+        end_integrals = history.integrals(history.end)
+        for device, groups in self._groups.items():
+            for algorithm, (_, indices) in groups.items():
+                self._leave(device, algorithm, indices, history.end,
+                            end_integrals)
+        for simulation in self.simulations:
+            simulation.total_secs += (
+                (history.end - history.start)*len(self._groups))
+
+    def _earnings(self, device, algorithm, integrals):
+        """Return BTC earned by device mining algorithm up to the integrals."""
+        key = (device, algorithm)
+        if key not in self._speeds:
+            speeds = self._benchmarks.get(device, {}).get(algorithm.name, [])
+            self._speeds[key] = list(zip(algorithm.algorithms, speeds))
+        return sum([speed*integrals.get(sub_algo, 0.0)
+                    for sub_algo, speed in self._speeds[key]])/SECS_PER_DAY
+
+    def _enter(self, history, device, algorithm, start, moving, switching):
+        hashing_from = start + self.simulations[0].downtime(device, algorithm)
+        stint = (start, hashing_from,
+                 self._earnings(device, algorithm,
+                                history.integrals(hashing_from)))
+        stints = self._stints[device]
+        for _, i in moving:
+            stints[i] = stint
+            if switching:
+                self.simulations[i].switches += 1
+        groups = self._groups[device]
+        if algorithm in groups:
+            moving = itertools.chain(zip(*groups[algorithm]), moving)
+        moving = sorted(moving)
+        groups[algorithm] = ([factor for factor, _ in moving],
+                             [i for _, i in moving])
+
+    def _leave(self, device, algorithm, indices, end, end_integrals):
+        earned = self._earnings(device, algorithm, end_integrals)
+        stints = self._stints[device]
+        for i in indices:
+            simulation = self.simulations[i]
+            start, hashing_from, earned_before = stints[i]
+            if hashing_from >= end:
+                simulation.idle_secs += end - start
+            else:
+                simulation.idle_secs += hashing_from - start
+                simulation.revenue += earned - earned_before
+
+
+def backtest(history, benchmarks, devices, algorithms, all_settings,
+             latency=DEFAULT_LATENCY, batch_naive=True):
+    """Replay history once for each of a list of settings.
+
+    Simulations that switch at the same interval run in lockstep, so revenues
+    and payrate integrals are worked out once per decision for all of them.
+    Those using NaiveSwitcher are run together in a NaiveBatch, so sweeping
+    its threshold costs little more than a single simulation.
+
+    benchmarks -- dict of device -> algorithm name -> speeds
+    batch_naive -- if False, step NaiveSwitcher simulations one by one too
+
+    Returns list of Simulation, in the order of all_settings.
+    """
+    matrix = RevenueMatrix(devices, algorithms, benchmarks)
+    simulations = [Simulation(nx_settings, benchmarks, latency)
+                   for nx_settings in all_settings]
+    by_interval = defaultdict(list)
+    for simulation in simulations:
+        interval = simulation.settings['switching']['interval']
+        by_interval[interval].append(simulation)
+    for interval, group in by_interval.items():
+        naive = [simulation for simulation in group
+                 if batch_naive and type(simulation.switcher) is NaiveSwitcher]
+        batch = NaiveBatch(naive, benchmarks)
+        batched = set(naive)
+        group = [simulation for simulation in group
+                 if simulation not in batched]
+        start = history.start
+        start_integrals = history.integrals(start)
+        while start < history.end:
+            end = min(start + interval, history.end)
+            end_integrals = history.integrals(end)
+            revenues = matrix.revenues(history.payrates(start))
+            if len(naive) > 0:
+                batch.step(history, revenues, start, start_integrals)
+            for simulation in group:
+                simulation.step(history, revenues, start, end,
+                                start_integrals, end_integrals)
+            start, start_integrals = end, end_integrals
+        if len(naive) > 0:
+            batch.finish(history)
+    return simulations
+
+
+def sweep(base_settings, options):
+    """Return list of (dict of option -> value, settings) for every combination.
+
+    options -- list of (section, option, list of values)
+    """
+    combinations = []
+    for values in itertools.product(*[values for _, _, values in options]):
+        nx_settings = deepcopy(base_settings)
+        chosen = {}
+        for (section, option, _), value in zip(options, values):
+            nx_settings[section][option] = value
+            chosen[f'{section}.{option}'] = value
+        combinations.append((chosen, nx_settings))
+    return combinations
+
+
+def parse_option(text):
+    """Read "section.option=value,value,..." into (section, option, values)."""
+    name, _, values = text.partition('=')
+    section, _, option = name.partition('.')
+    try:
+        default = settings.DEFAULT_SETTINGS[section][option]
+    except KeyError:
+        raise ValueError(f'unknown setting {name}')
+    def convert(value):
+        if isinstance(default, bool):
+            return value.lower() in ['1', 'yes', 'true', 'on']
+        else:
+            return type(default)(value)
+    return section, option, [convert(value) for value in values.split(',')]
+
+
+def load_recorded_benchmarks(path):
+    """Return (list of RecordedDevice, benchmarks) from a benchmarks file."""
+    with open(path, 'r') as benchmarks_fd:
+        names = list(json.load(benchmarks_fd).keys())
+    devices = [RecordedDevice(name) for name in names]
+    with open(path, 'r') as benchmarks_fd:
+        benchmarks = settings.read_benchmarks_from_file(benchmarks_fd, devices)
+    return devices, benchmarks
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description='Replay recorded NiceHash payrates through profit switchers.')
+    argp.add_argument(
+        '-c', '--configdir', nargs=1, default=[settings.DEFAULT_CONFIGDIR],
+        help=('directory for configuration, benchmark and payrate files'
+              + ' (default: ~/.config/nuxhash/)'))
+    argp.add_argument('--payrates', type=Path,
+                      help='payrate log to replay (default: payrates.jsonl)')
+    argp.add_argument('--benchmarks', type=Path,
+                      help='benchmarks to mine with (default: benchmarks.json)')
+    argp.add_argument(
+        '--set', action='append', default=[], metavar='OPTION=VALUES',
+        help=('try each of a comma-separated list of values for a setting,'
+              + ' e.g. switching.threshold=0.05,0.1; may be repeated'))
+    argp.add_argument('--latency', type=float, default=DEFAULT_LATENCY,
+                      help='seconds for a miner to start an algorithm')
+    argp.add_argument('--top', type=int, default=20,
+                      help='number of best combinations to show')
+    args = argp.parse_args()
+    config_dir = Path(args.configdir[0])
+
+    try:
+        options = [parse_option(text) for text in args.set]
+    except ValueError as err:
+        argp.error(str(err))
+    with open(args.payrates or config_dir/settings.PAYRATES_FILENAME,
+              'r') as payrates_fd:
+        records = settings.read_payrates(payrates_fd)
+    if len(records) < 2:
+        argp.error('need at least two recorded payrate snapshots')
+    history = PayrateHistory(records)
+    devices, benchmarks = load_recorded_benchmarks(
+        args.benchmarks or config_dir/settings.BENCHMARKS_FILENAME)
+    algorithms = sum([miner(config_dir).algorithms for miner in all_miners], [])
+
+    combinations = sweep(settings.load_settings(config_dir), options)
+    days = (history.end - history.start)/SECS_PER_DAY
+    print(f'Replaying {len(records)} payrate snapshots over {days:.1f} days '
+          + f'on {len(devices)} devices, {len(combinations)} combinations')
+    begin = time.perf_counter()
+    simulations = backtest(history, benchmarks, devices, algorithms,
+                           [nx_settings for _, nx_settings in combinations],
+                           latency=args.latency)
+    print(f'Done in {time.perf_counter() - begin:.2f} s\n')
+
+    results = sorted(zip(simulations, combinations),
+                     key=lambda result: result[0].revenue, reverse=True)
+    print(f'{"mBTC/day":>10} {"switches":>9} {"idle":>6}  settings')
+    for simulation, (chosen, _) in results[:args.top]:
+        idle = simulation.idle_secs/simulation.total_secs
+        description = ' '.join(f'{name}={value}'
+                               for name, value in chosen.items())
+        print(f'{simulation.revenue*1e3/days:10.4f} {simulation.switches:9d} '
+              + f'{idle*100:5.1f}%  {description}')
@@ -0,0 +1,463 @@
+import csv
+import math
+import statistics
+import threading
+import time
+from array import array
+from collections import defaultdict
+from threading import Event
+
+
+# z-score of a two-sided 95% confidence interval
+CONFIDENCE_Z = 1.96
+# modified z-score above which a sample is an outlier (Iglewicz and Hoaglin)
+OUTLIER_Z = 3.5
+# fraction of samples cut from each end for a trimmed mean
+TRIM_FRACTION = 0.1
+# number of superseded measurements kept with each benchmark
+HISTORY_LENGTH = 5
+
+
+class Benchmark(list):
+    """Speeds measured for an algorithm, one per sub-algorithm.
+
+    Behaves as a plain list of speeds, with details of the measurement kept in
+    attributes. Attributes left as None were not measured.
+    """
+
+    # attributes saved along with the speeds
+    DETAILS = ['error', 'stddev', 'warmup', 'timestamp', 'miner_version',
+               'driver_version', 'history']
+
+    def __init__(self, speeds=[], **details):
+        list.__init__(self, speeds)
+        # relative half-width of the 95% confidence interval of the speeds
+        self.error = None
+        # list of standard deviations of the samples, one per speed
+        self.stddev = None
+        # seconds spent warming up before sampling
+        self.warmup = None
+        # Unix time the measurement finished
+        self.timestamp = None
+        # version of the miner that ran the benchmark
+        self.miner_version = None
+        # version of the device driver
+        self.driver_version = None
+        # list of earlier Benchmarks for the same target, newest first
+        self.history = None
+        for key, value in details.items():
+            if key not in Benchmark.DETAILS:
+                raise TypeError(f'unknown benchmark detail {key}')
+            setattr(self, key, value)
+
+    @property
+    def details(self):
+        """Dict of the measured details."""
+        return {key: getattr(self, key) for key in Benchmark.DETAILS
+                if getattr(self, key) is not None}
+
+    def to_json(self):
+        js = dict(speeds=list(self), **self.details)
+        if 'history' in js:
+            js['history'] = [benchmark.to_json() for benchmark in self.history]
+        return js
+
+    @classmethod
+    def from_json(cls, js):
+        details = {key: value for key, value in js.items()
+                   if key in Benchmark.DETAILS}
+        if 'history' in details:
+            details['history'] = [cls.from_json(js_history)
+                                  for js_history in details['history']]
+        return cls(js['speeds'], **details)
+
+
+def record(benchmarks, algorithm_name, benchmark):
+    """Store a new benchmark, keeping the one it replaces in its history.
+
+    benchmarks -- dict of algorithm name -> speeds for one device
+    """
+    if not isinstance(benchmark, Benchmark):
+        benchmark = Benchmark(benchmark)
+    old = benchmarks.get(algorithm_name, None)
+    if old is not None:
+        if isinstance(old, Benchmark):
+            old_history = old.history or []
+            old = Benchmark(old, **dict(old.details, history=None))
+        else:
+            old_history = []
+            old = Benchmark(old)
+        benchmark.history = ([old] + old_history)[:HISTORY_LENGTH]
+    benchmarks[algorithm_name] = benchmark
+
+
+def is_stale(benchmark, algorithm, device, max_age_days=0):
+    """Check if a benchmark no longer reflects what algorithm can do on device.
+
+    A benchmark is stale if it predates versioned benchmarks, if it was taken
+    with a different miner or driver version than the ones running now, or if
+    it is older than max_age_days (0 for no limit).
+    """
+    if getattr(benchmark, 'timestamp', None) is None:
+        return True
+    miner_version = algorithm.parent.version
+    if miner_version is not None and benchmark.miner_version != miner_version:
+        return True
+    driver_version = getattr(device, 'driver_version', None)
+    if (driver_version is not None
+            and benchmark.driver_version != driver_version):
+        return True
+    return (max_age_days > 0
+            and time.time() - benchmark.timestamp > max_age_days*24*60*60)
+
+
+class RunningStats(object):
+    """Running mean and variance of speed samples, by Welford's method."""
+
+    def __init__(self, n_speeds):
+        self.count = 0
+        self.mean = [0.0]*n_speeds
+        self._m2 = [0.0]*n_speeds
+
+    def add(self, sample):
+        self.count += 1
+        for i, speed in enumerate(sample):
+            delta = speed - self.mean[i]
+            self.mean[i] += delta/self.count
+            self._m2[i] += delta*(speed - self.mean[i])
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return [math.inf]*len(self.mean)
+        return [m2/(self.count - 1) for m2 in self._m2]
+
+    def relative_error(self):
+        """Largest relative half-width of the 95% confidence intervals."""
+        def error(mean, variance):
+            if variance == 0.0:
+                return 0.0
+            elif mean == 0.0:
+                return math.inf
+            else:
+                return CONFIDENCE_Z*math.sqrt(variance/self.count)/abs(mean)
+        return max([error(mean, variance) for mean, variance
+                    in zip(self.mean, self.variance)], default=0.0)
+
+
+class SampleSeries(object):
+    """Every speed sample taken during a benchmark, with when it was taken.
+
+    Columns are kept in compact arrays: seconds since the first sample on the
+    monotonic clock, whether the sample was taken during warmup, and one
+    column of speeds per sub-algorithm.
+    """
+
+    def __init__(self, algorithms):
+        # list of sub-algorithm names, one per speed column
+        self.algorithms = list(algorithms)
+        self.times = array('d')
+        self.warmup = array('b')
+        self.speeds = [array('d') for _ in self.algorithms]
+        self._start = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, sample, warmup=False, timestamp=None):
+        """Append a sample; timestamp defaults to time.monotonic()."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._start is None:
+            self._start = timestamp
+        self.times.append(timestamp - self._start)
+        self.warmup.append(warmup)
+        for column, speed in zip(self.speeds, sample):
+            column.append(speed)
+
+    def write_csv(self, fd):
+        writer = csv.writer(fd)
+        writer.writerow(['time', 'warmup'] + self.algorithms)
+        for i in range(len(self)):
+            writer.writerow([f'{self.times[i]:.6f}', self.warmup[i]]
+                            + [repr(column[i]) for column in self.speeds])
+
+    @classmethod
+    def read_csv(cls, fd):
+        reader = csv.reader(fd)
+        header = next(reader)
+        series = cls(header[2:])
+        series._start = 0.0
+        for row in reader:
+            series.add([float(speed) for speed in row[2:]],
+                       warmup=bool(int(row[1])), timestamp=float(row[0]))
+        return series
+
+
+def summarize(samples, statistic='trimmed_mean'):
+    """Reduce speed samples to a Benchmark with one speed per sub-algorithm.
+
+    Each sub-algorithm's speeds are treated separately. Outliers, judged by
+    their distance from the median (see reject_outliers()), are dropped before
+    the statistic, standard deviation and error are computed from the speeds
+    that remain, so a stray zero from a stratum hiccup does not drag the result
+    down. The samples are left untouched.
+
+    samples -- list of samples, each a list of speeds
+    statistic -- 'mean', 'median' or 'trimmed_mean'
+    """
+    if len(samples) == 0:
+        return Benchmark()
+    speeds = []
+    stddevs = []
+    errors = []
+    for column in zip(*samples):
+        kept = reject_outliers(column)
+        if statistic == 'mean':
+            speed = statistics.mean(kept)
+        elif statistic == 'median':
+            speed = statistics.median(kept)
+        elif statistic == 'trimmed_mean':
+            speed = trimmed_mean(kept, TRIM_FRACTION)
+        else:
+            raise ValueError(f'unknown statistic {statistic}')
+        speeds.append(speed)
+        if len(kept) >= 2:
+            stddev = statistics.stdev(kept)
+            stddevs.append(stddev)
+            if stddev == 0.0:
+                errors.append(0.0)
+            elif speed == 0.0:
+                errors.append(math.inf)
+            else:
+                errors.append(
+                    CONFIDENCE_Z*stddev/math.sqrt(len(kept))/abs(speed))
+    if len(stddevs) == len(speeds):
+        return Benchmark(speeds, stddev=stddevs, error=max(errors, default=0.0))
+    else:
+        return Benchmark(speeds)
+
+
+def reject_outliers(values):
+    """Return values without those far from the median.
+
+    Distance is measured in median absolute deviations or, if most values are
+    identical and that is zero, in mean absolute deviations, each scaled to
+    match a standard deviation.
+    """
+    median = statistics.median(values)
+    deviations = [abs(value - median) for value in values]
+    spread = statistics.median(deviations)/0.6745
+    if spread == 0.0:
+        spread = statistics.mean(deviations)*1.2533
+    if spread == 0.0:
+        return list(values)
+    return [value for value, deviation in zip(values, deviations)
+            if deviation/spread <= OUTLIER_Z]
+
+
+def trimmed_mean(values, fraction):
+    """Return the mean of values without the highest and lowest fraction."""
+    values = sorted(values)
+    cut = int(len(values)*fraction)
+    return statistics.mean(values[cut:len(values) - cut])
+
+
+def is_steady(samples, threshold):
+    """Check if a window of speed samples has stopped rising or falling.
+
+    The window is steady if, for every sub-algorithm, the least-squares trend
+    line drifts by no more than threshold (as a fraction of the mean) from one
+    end of the window to the other. A window of nothing but zeroes, as during
+    DAG generation, is not steady.
+    """
+    n = len(samples)
+    if n < 2 or not any(any(sample) for sample in samples):
+        return False
+    x_mean = (n - 1)/2
+    x_var = sum([(x - x_mean)**2 for x in range(n)])
+    for i in range(len(samples[0])):
+        speeds = [sample[i] for sample in samples]
+        y_mean = sum(speeds)/n
+        if y_mean == 0.0:
+            if any(speeds):
+                return False
+            continue
+        slope = sum([(x - x_mean)*(y - y_mean)
+                     for x, y in enumerate(speeds)])/x_var
+        if abs(slope*(n - 1)/y_mean) > threshold:
+            return False
+    return True
+
+
+def sampling_options(settings):
+    """Translate benchmarking settings into run_benchmark() arguments."""
+    options = settings['benchmarking']
+    if options['adaptive']:
+        kwargs = {'sample_duration': options['min_secs'],
+                  'tolerance': options['tolerance'],
+                  'max_duration': options['max_secs']}
+    else:
+        kwargs = {'sample_duration': options['secs']}
+    kwargs['statistic'] = options['statistic']
+    kwargs['sample_interval'] = options['sample_interval']
+    if options['detect_warmup']:
+        kwargs.update({'warmup_window': options['warmup_window'],
+                       'warmup_drift': options['warmup_drift']})
+    return kwargs
+
+
+def plan_benchmarks(targets):
+    """Order (device, algorithm) targets so related algorithms run back to back.
+
+    Each device's targets are grouped by base algorithm, i.e. the first
+    sub-algorithm, so daggerhashimoto, daggerhashimoto_decred and
+    daggerhashimoto_pascal follow one another, with the plain base algorithm
+    first. The miner then keeps the base algorithm's pool subscription parked
+    between them instead of adding it and connecting to the stratum server
+    again for each. That is all grouping saves: every target still gets a new
+    worker, which pays the full warmup (and, for daggerhashimoto, builds its
+    DAG again). Each device starts at a different group, so run_parallel()
+    does not leave devices queueing for the same algorithm.
+    """
+    by_device = defaultdict(lambda: defaultdict(list))
+    for device, algorithm in targets:
+        by_device[device][algorithm.algorithms[0]].append(algorithm)
+    plan = []
+    for i, device in enumerate(sorted(by_device.keys(), key=str)):
+        groups = sorted(by_device[device].items())
+        groups = groups[i % len(groups):] + groups[:i % len(groups)]
+        for base, algorithms in groups:
+            for algorithm in sorted(algorithms,
+                                    key=lambda a: (len(a.algorithms), a.name)):
+                plan.append((device, algorithm))
+    return plan
+
+
+def estimate_secs(plan, settings, benchmarks={}, longest=False):
+    """Estimate how long run_parallel() will take to work through a plan.
+
+    Warmups are taken from earlier benchmarks of the same targets, where
+    recorded, and from the algorithms' warmup_secs otherwise. Every target is
+    charged its full warmup, grouped or not, since each starts a new worker.
+    Targets are scheduled like run_parallel() does, so a device waits while
+    another device is measuring the algorithm it would start next.
+
+    Adaptive benchmarks stop anywhere between min_secs and max_secs, so the
+    estimate is a lower bound, or an upper bound if longest is set.
+
+    benchmarks -- dict of device -> algorithm name -> earlier benchmark
+    """
+    options = settings['benchmarking']
+    if not options['adaptive']:
+        sample_secs = options['secs']
+    elif longest:
+        sample_secs = options['max_secs']
+    else:
+        sample_secs = options['min_secs']
+    # dict of device -> list of (algorithm, secs) left to run
+    pending = defaultdict(list)
+    for device, algorithm in plan:
+        old = benchmarks.get(device, {}).get(algorithm.name, None)
+        warmup = getattr(old, 'warmup', None)
+        if warmup is None or not options['detect_warmup']:
+            warmup = algorithm.warmup_secs
+        pending[device].append((algorithm, warmup + sample_secs))
+    # when each device and algorithm next becomes free
+    device_free = {device: 0.0 for device in pending}
+    algorithm_free = {}
+    now = 0.0
+    while any(len(targets) > 0 for targets in pending.values()):
+        for device, targets in pending.items():
+            if device_free[device] > now:
+                continue
+            target = next(((algorithm, secs) for algorithm, secs in targets
+                           if algorithm_free.get(algorithm, 0.0) <= now), None)
+            if target is not None:
+                targets.remove(target)
+                algorithm, secs = target
+                device_free[device] = algorithm_free[algorithm] = now + secs
+        now = min((t for t in (list(device_free.values())
+                               + list(algorithm_free.values())) if t > now),
+                  default=now)
+    return max(device_free.values(), default=0.0)
+
+
+def run_parallel(targets, run_target, abort_signal=None):
+    """Benchmark (device, algorithm) targets on all devices at once.
+
+    Each device runs one target at a time, in the order given. An algorithm is
+    only measured on one device at a time, because the speeds it reports cover
+    all of its devices. Devices otherwise work through their targets
+    independently, so a whole rig takes about as long as its busiest device.
+
+    run_target -- called as run_target(device, algorithm) from one thread per
+                  device; returns the measured speeds
+    abort_signal -- once set, no more targets are started and targets still
+                    running are not recorded
+
+    Returns dict of device -> algorithm name -> speeds. If run_target raises,
+    the remaining targets are aborted and the exception is raised here.
+    """
+    if abort_signal is None:
+        abort_signal = Event()
+    # dict of device -> list of algorithms left to benchmark
+    pending = defaultdict(list)
+    for device, algorithm in targets:
+        pending[device].append(algorithm)
+    # set of algorithms being benchmarked right now
+    busy = set()
+    condition = threading.Condition()
+    benchmarks = defaultdict(lambda: {})
+    errors = []
+
+    def take(device):
+        with condition:
+            while not abort_signal.is_set() and len(pending[device]) > 0:
+                algorithm = next((algorithm for algorithm in pending[device]
+                                  if algorithm not in busy), None)
+                if algorithm is not None:
+                    pending[device].remove(algorithm)
+                    busy.add(algorithm)
+                    return algorithm
+                condition.wait()
+            return None
+
+    def release(algorithm):
+        with condition:
+            busy.discard(algorithm)
+            condition.notify_all()
+
+    def work(device):
+        algorithm = take(device)
+        while algorithm is not None:
+            try:
+                speeds = run_target(device, algorithm)
+            except Exception as err:
+                errors.append(err)
+                abort_signal.set()
+            else:
+                if not abort_signal.is_set():
+                    benchmarks[device][algorithm.name] = speeds
+            finally:
+                release(algorithm)
+            algorithm = take(device)
+
+    threads = [threading.Thread(target=work, args=(device,), daemon=True)
+               for device in pending.keys()]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        # Most likely a KeyboardInterrupt; let running targets wind down.
+        abort_signal.set()
+        with condition:
+            condition.notify_all()
+        for thread in threads:
+            thread.join()
+        raise
+    if len(errors) > 0:
+        raise errors[0]
+    return benchmarks
@@ -7,24 +7,28 @@ import signal
 import socket
 import sys
 import time
+from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 from random import random
-from threading import Event
+from threading import Event, Lock, Thread
 
 from nuxhash import nicehash, settings, utils
+from nuxhash.benchmarking import (
+    estimate_secs, is_stale, plan_benchmarks, record, run_parallel,
+    SampleSeries, sampling_options)
 from nuxhash.bitcoin import check_bc
 from nuxhash.devices.nvidia import enumerate_devices as nvidia_devices
 from nuxhash.devices.nvidia import NvidiaDevice
 from nuxhash.download.downloads import make_miners
 from nuxhash.miners import all_miners
-from nuxhash.miners.miner import MinerNotRunning
-from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.miners.miner import MinerNotRunning, run_transition
+from nuxhash.switching import make_switcher
+from nuxhash.switching.revenue import RevenueMatrix
 from nuxhash.version import __version__
 
 
-BENCHMARK_SECS = 60
 DONATE_PROB = 0.005
 DONATE_ADDRESS = '3DJBpNcgP3Pihw45p9544PK6TbbYeMcnk7'
 
@@ -41,6 +45,13 @@ def main():
     argp_benchmark.add_argument(
         '--benchmark-missing', action='store_true',
         help='benchmark algorithm-device combinations not measured')
+    argp_benchmark.add_argument(
+        '--benchmark-stale', action='store_true',
+        help=('benchmark algorithm-device combinations not measured, or'
+              + ' measured with other miner or driver versions or too long ago'))
+    argp.add_argument('--resume', action='store_true',
+                      help=('skip benchmarks finished before nuxhash last'
+                            + ' stopped without saving'))
     argp.add_argument('--list-devices', action='store_true',
                       help='list all devices')
     argp.add_argument('-v', '--verbose', action='store_true',
@@ -90,19 +101,48 @@ def main():
     for miner in nx_miners:
         miner.settings = nx_settings
 
+    # Keep finished benchmarks safe from crashes until they are saved.
+    def journal(device, algorithm_name, benchmark):
+        settings.journal_benchmark(config_dir, device, algorithm_name, benchmark)
+    if args.resume:
+        finished = set((device, algorithm_name) for device, algorithm_name, _
+                       in settings.read_journal(config_dir, all_devices))
+    else:
+        finished = set()
+    if nx_settings['benchmarking']['export_samples']:
+        def export(device, algorithm_name, series):
+            settings.save_samples(config_dir, device, algorithm_name, series)
+    else:
+        export = None
+    if nx_settings['switching']['record_payrates']:
+        def payrate_log(timestamp, payrates):
+            settings.append_payrates(config_dir, timestamp, payrates)
+    else:
+        payrate_log = None
+
     # Select code path(s), benchmarks and/or mining.
     if args.benchmark_all:
         nx_benchmarks = run_missing_benchmarks(
-            nx_miners, nx_settings, all_devices, settings.EMPTY_BENCHMARKS)
+            nx_miners, nx_settings, all_devices, nx_benchmarks, redo='all',
+            skip=finished, journal=journal, export=export)
     elif args.benchmark_missing:
         nx_benchmarks = run_missing_benchmarks(
-            nx_miners, nx_settings, all_devices, nx_benchmarks)
+            nx_miners, nx_settings, all_devices, nx_benchmarks,
+            skip=finished, journal=journal, export=export)
+    elif args.benchmark_stale:
+        nx_benchmarks = run_missing_benchmarks(
+            nx_miners, nx_settings, all_devices, nx_benchmarks, redo='stale',
+            skip=finished, journal=journal, export=export)
     elif args.list_devices:
         list_devices(all_devices)
     else:
-        nx_benchmarks = run_missing_benchmarks(
-            nx_miners, nx_settings, all_devices, nx_benchmarks)
-        session = MiningSession(nx_miners, nx_settings, nx_benchmarks, all_devices)
+        if not nx_settings['benchmarking']['background']:
+            nx_benchmarks = run_missing_benchmarks(
+                nx_miners, nx_settings, all_devices, nx_benchmarks,
+                skip=finished, journal=journal, export=export)
+        session = MiningSession(nx_miners, nx_settings, nx_benchmarks, all_devices,
+                                journal=journal, export=export,
+                                payrate_log=payrate_log)
         # Attach the SIGINT signal for quitting.
         # NOTE: If running in a shell, Ctrl-C will get sent to our subprocesses too,
         #       because we are the foreground process group. Miners will get killed
@@ -145,7 +185,19 @@ def initial_setup():
     return wallet, workername, region
 
 
-def run_missing_benchmarks(miners, settings, devices, old_benchmarks):
+def run_missing_benchmarks(miners, settings, devices, old_benchmarks,
+                           redo='missing', skip=set(), journal=None,
+                           export=None):
+    """Benchmark targets and merge the results into old_benchmarks.
+
+    redo -- 'missing' to measure only targets without a benchmark, 'stale' to
+            also re-measure stale ones, or 'all' to measure everything
+    skip -- set of (device, algorithm name) not to measure in any case
+    journal -- called as journal(device, algorithm name, benchmark) for each
+               completed benchmark
+    export -- called as export(device, algorithm name, SampleSeries) with the
+              samples of each benchmark that took any
+    """
     # Temporarily suppress logging.
     logger = logging.getLogger()
     log_level = logger.getEffectiveLevel()
@@ -154,50 +206,98 @@ def run_missing_benchmarks(miners, settings, devices, old_benchmarks):
     for miner in miners:
         miner.load()
 
+    max_age_days = settings['benchmarking']['max_age_days']
+    def todo(device, algorithm):
+        if (device, algorithm.name) in skip:
+            return False
+        elif redo == 'all' or algorithm.name not in old_benchmarks[device]:
+            return True
+        elif redo == 'stale':
+            benchmark = old_benchmarks[device][algorithm.name]
+            return is_stale(benchmark, algorithm, device, max_age_days)
+        else:
+            return False
     algorithms = sum([miner.algorithms for miner in miners], [])
-    done = sum([[(device, next((algorithm for algorithm in algorithms
-                                if algorithm.name == algorithm_name), None))
-                 for algorithm_name in benchmarks.keys()]
-                for device, benchmarks in old_benchmarks.items()], [])
-    all_targets = sum([[(device, algorithm) for algorithm in algorithms
-                        if algorithm.accepts(device)]
-                       for device in devices], [])
-    benchmarks = run_benchmarks(set(all_targets) - set(done))
+    targets = [(device, algorithm) for device in devices
+               for algorithm in algorithms
+               if algorithm.accepts(device) and todo(device, algorithm)]
+    benchmarks = run_benchmarks(targets, settings, old_benchmarks, journal,
+                                export)
 
     for miner in miners:
         miner.unload()
     logger.setLevel(log_level)
 
-    for d in benchmarks:
-        old_benchmarks[d].update(benchmarks[d])
+    for device in benchmarks:
+        for algorithm_name, benchmark in benchmarks[device].items():
+            record(old_benchmarks[device], algorithm_name, benchmark)
     return old_benchmarks
 
 
-def run_benchmarks(targets):
+def run_benchmarks(targets, settings, old_benchmarks={}, journal=None,
+                   export=None):
     if len(targets) == 0:
         return []
 
-    benchmarks = settings.EMPTY_BENCHMARKS
-    last_device = None
-    for device, algorithm in sorted(targets, key=lambda t: str(t[0])):
-        if device != last_device:
-            if isinstance(device, NvidiaDevice):
-                print(f'\nCUDA device: {device.name} ({device.uuid})')
-            last_device = device
+    devices = sorted(set(device for device, algorithm in targets), key=str)
+    for i, device in enumerate(devices):
+        if isinstance(device, NvidiaDevice):
+            print(f'CUDA device {i}: {device.name} ({device.uuid})')
+    plan = plan_benchmarks(targets)
+    estimate = utils.format_time(
+        estimate_secs(plan, settings, old_benchmarks)).strip()
+    if settings['benchmarking']['adaptive']:
+        longest = utils.format_time(
+            estimate_secs(plan, settings, old_benchmarks, longest=True)).strip()
+        estimate = f'{estimate} to {longest}'
+    print(f'\nBenchmarking {len(plan)} targets, estimated time {estimate}\n')
+    board = StatusBoard(len(devices))
+    abort = Event()
+    completed = defaultdict(lambda: {})
+
+    def run_target(device, algorithm):
+        line = devices.index(device)
+        series = SampleSeries(algorithm.algorithms) if export else None
         try:
-            benchmarks[device][algorithm.name] = run_benchmark(device, algorithm)
+            speeds = run_benchmark(
+                device, algorithm, settings, abort,
+                lambda status: board.update(line, f'  [{line}] {status}'),
+                series=series)
         except MinerNotRunning:
-            print(f'  {algorithm.name}: failed to complete benchmark     ')
-            benchmarks[device][algorithm.name] = [0.0]*len(algorithm.algorithms)
-        except KeyboardInterrupt:
-            print('Benchmarking aborted (completed benchmarks saved).')
-            for algorithm in set(algorithm for device, algorithm in targets):
-                algorithm.set_devices([])
-            break
-    return benchmarks
+            board.print(f'  [{line}] {algorithm.name}: '
+                        + 'failed to complete benchmark')
+            speeds = [0.0]*len(algorithm.algorithms)
+        else:
+            if abort.is_set():
+                return speeds
+            if getattr(speeds, 'error', None) is not None:
+                error = f' (±{speeds.error*100:.1f}%)'
+            else:
+                error = ''
+            board.print(f'  [{line}] {algorithm.name}: '
+                        + utils.format_speeds(speeds) + error)
+        finally:
+            if export is not None and len(series) > 0:
+                export(device, algorithm.name, series)
+        completed[device][algorithm.name] = speeds
+        if journal is not None:
+            journal(device, algorithm.name, speeds)
+        return speeds
+
+    try:
+        run_parallel(plan, run_target, abort_signal=abort)
+    except KeyboardInterrupt:
+        board.clear()
+        print('Benchmarking aborted (completed benchmarks saved).')
+        for algorithm in set(algorithm for device, algorithm in targets):
+            algorithm.set_devices([])
+    else:
+        board.clear()
+    return completed
 
 
-def run_benchmark(device, algorithm):
+def run_benchmark(device, algorithm, settings, abort_signal, report_status,
+                  series=None):
     status_dot = [-1]
     def report_speeds(sample, secs_remaining):
         status_dot[0] = (status_dot[0] + 1) % 3
@@ -206,19 +306,56 @@ def run_benchmark(device, algorithm):
         speeds = utils.format_speeds(sample)
         time = utils.format_time(abs(secs_remaining))
         if secs_remaining < 0:
-            print(f'  {algorithm.name} {status_line} {speeds} (warming up, {time})'
-                  + '\r', end='')
+            report_status(f'{algorithm.name} {status_line} {speeds} '
+                          + f'(warming up, {time})')
         else:
-            print(f'  {algorithm.name} {status_line} {speeds} (sampling, {time}) '
-                  + '\r', end='')
-        sys.stdout.flush()
-
-    speeds = utils.run_benchmark(
-        algorithm, device, algorithm.warmup_secs, BENCHMARK_SECS,
-        sample_callback=report_speeds)
-
-    print(f'  {algorithm.name}: {utils.format_speeds(speeds)}' + ' '*22)
-    return speeds
+            report_status(f'{algorithm.name} {status_line} {speeds} '
+                          + f'(sampling, {time})')
+
+    return utils.run_benchmark(
+        algorithm, device, algorithm.warmup_secs,
+        sample_callback=report_speeds, abort_signal=abort_signal,
+        series=series, **sampling_options(settings))
+
+
+class StatusBoard(object):
+    """Keep one live status line per device at the bottom of the terminal."""
+
+    def __init__(self, n_lines):
+        self._lines = ['']*n_lines
+        self._drawn = False
+        self._tty = sys.stdout.isatty()
+        self._lock = Lock()
+
+    def update(self, i, status):
+        with self._lock:
+            self._lines[i] = status
+            self._redraw()
+
+    def print(self, message):
+        """Print a permanent line above the status lines."""
+        with self._lock:
+            self._erase()
+            print(message)
+            self._redraw()
+
+    def clear(self):
+        with self._lock:
+            self._erase()
+            self._lines = ['']*len(self._lines)
+
+    def _erase(self):
+        if self._drawn:
+            print('\x1b[F\x1b[K'*len(self._lines), end='')
+            self._drawn = False
+
+    def _redraw(self):
+        if self._tty:
+            self._erase()
+            for line in self._lines:
+                print(line)
+            self._drawn = True
+            sys.stdout.flush()
 
 
 def list_devices(nx_devices):
@@ -232,7 +369,8 @@ class MiningSession(object):
     PROFIT_PRIORITY = 1
     STOP_PRIORITY = 0
 
-    def __init__(self, miners, settings, benchmarks, devices):
+    def __init__(self, miners, settings, benchmarks, devices, journal=None,
+                 export=None, payrate_log=None):
         self._miners = miners
         self._settings = settings
         self._benchmarks = benchmarks
@@ -242,7 +380,22 @@ class MiningSession(object):
         self._scheduler = sched.scheduler(
                 time.time, lambda t: self._quit_signal.wait(t))
         self._algorithms = []
+        self._revenue_matrix = None
+        self._assignments = {}
         self._profit_switch = None
+        # (device, algorithm) being benchmarked in the background
+        self._benchmark_target = None
+        self._benchmark_thread = None
+        self._benchmark_result = None
+        self._benchmark_abort = Event()
+        # set of (device, algorithm) already benchmarked this session
+        self._benchmarked = set()
+        # called with each completed background benchmark
+        self._journal = journal
+        # called with the samples of each background benchmark
+        self._export = export
+        # called with each payrate snapshot fetched from NiceHash
+        self._payrate_log = payrate_log
 
     def run(self):
         # Initialize miners.
@@ -263,7 +416,9 @@ class MiningSession(object):
         self._algorithms = sum([miner.algorithms for miner in self._miners], [])
 
         # Initialize profit-switching.
-        self._profit_switch = NaiveSwitcher(self._settings)
+        self._revenue_matrix = RevenueMatrix(self._devices, self._algorithms,
+                                             self._benchmarks)
+        self._profit_switch = make_switcher(self._settings, self._benchmarks)
         self._profit_switch.reset()
 
         self._scheduler.enter(0, MiningSession.PROFIT_PRIORITY, self._switch_algos)
@@ -281,30 +436,45 @@ class MiningSession(object):
             logging.warning(f'NiceHash stats: {err}')
         else:
             self._payrates = (ret_payrates, datetime.now())
+            if self._payrate_log is not None:
+                self._payrate_log(time.time(), ret_payrates)
 
         interval = self._settings['switching']['interval']
         payrates, payrates_time = self._payrates
 
         # Calculate BTC/day rates.
-        def revenue(device, algorithm):
-            benchmarks = self._benchmarks[device]
-            if algorithm.name in benchmarks:
-                return sum([payrates[sub_algo]*benchmarks[algorithm.name][i]
-                            if sub_algo in payrates else 0.0
-                            for i, sub_algo in enumerate(algorithm.algorithms)])
-            else:
-                return 0.0
-        revenues = {device: {algorithm: revenue(device, algorithm)
-                             for algorithm in self._algorithms}
-                    for device in self._devices}
+        revenues = self._revenue_matrix.revenues(payrates)
+
+        # Take a device out of mining to benchmark it, if it is worth the least.
+        finished = self._finish_benchmark()
+        if (self._benchmark_target is None
+                and self._settings['benchmarking']['background']):
+            # Let a device that just finished a benchmark mine for an interval.
+            self._benchmark_target = self._pick_benchmark(
+                revenues, skip=[finished] if finished is not None else [])
+        if self._benchmark_target is not None:
+            # Benchmark mode takes over the benchmarked algorithm's
+            # sub-algorithms, so keep other devices off any algorithm that
+            # shares them until the benchmark is done.
+            bm_device, bm_algorithm = self._benchmark_target
+            bm_sub_algorithms = set(bm_algorithm.algorithms)
+            revenues = {device: {algorithm: rate
+                                 for algorithm, rate in device_revenues.items()
+                                 if bm_sub_algorithms.isdisjoint(
+                                     algorithm.algorithms)}
+                        for device, device_revenues in revenues.items()
+                        if device != bm_device}
 
         # Get device -> algorithm assignments from profit switcher.
-        self._assignments = self._profit_switch.decide(revenues, payrates_time)
-        for this_algorithm in self._algorithms:
-            this_devices = [device for device, algorithm
-                            in self._assignments.items()
-                            if algorithm == this_algorithm]
-            this_algorithm.set_devices(this_devices)
+        assignments = self._profit_switch.decide(revenues, payrates_time)
+        started = run_transition(self._assignments, assignments)
+        self._profit_switch.switched(started)
+        self._assignments = assignments
+        for device, secs in started.items():
+            logging.info(f'{device} switched to {assignments[device].name}, '
+                         + f'accepted by the miner after {secs:.2f} s')
+        if self._benchmark_target is not None and self._benchmark_thread is None:
+            self._start_benchmark()
 
         # Donation time.
         if not self._settings['donate']['optout'] and random() < DONATE_PROB:
@@ -320,6 +490,99 @@ class MiningSession(object):
         self._scheduler.enter(interval, MiningSession.PROFIT_PRIORITY,
                               self._switch_algos)
 
+    def _pick_benchmark(self, revenues, skip=[]):
+        """Choose a missing or stale benchmark to run in the background.
+
+        The device chosen is the one currently earning the least; a device that
+        is not mining counts as earning what its best algorithm would. Only
+        algorithms that share no sub-algorithm with what other devices are
+        mining are considered, since benchmarking takes over all of an
+        algorithm's devices and miners may share sub-algorithms between
+        algorithms (e.g. daggerhashimoto and daggerhashimoto_pascal).
+
+        skip -- devices not to take out of mining
+
+        Returns (device, algorithm), or None if there is nothing to do.
+        """
+        max_age_days = self._settings['benchmarking']['max_age_days']
+        def todo(device):
+            benchmarks = self._benchmarks[device]
+            busy = set(sub_algorithm
+                       for other, assigned in self._assignments.items()
+                       if other != device
+                       for sub_algorithm in assigned.algorithms)
+            missing = []
+            stale = []
+            for algorithm in self._algorithms:
+                if (not algorithm.accepts(device)
+                        or (device, algorithm) in self._benchmarked
+                        or not busy.isdisjoint(algorithm.algorithms)):
+                    continue
+                if algorithm.name not in benchmarks:
+                    missing.append(algorithm)
+                elif is_stale(benchmarks[algorithm.name], algorithm, device,
+                              max_age_days):
+                    stale.append(algorithm)
+            return missing + stale
+        def marginal_revenue(device):
+            algorithm = self._assignments.get(device, None)
+            if algorithm is not None:
+                return revenues[device][algorithm]
+            return max(revenues[device].values(), default=0.0)
+        candidates = [(device, todo(device)) for device in self._devices
+                      if device not in skip]
+        candidates = [(device, algorithms) for device, algorithms in candidates
+                      if len(algorithms) > 0]
+        if len(candidates) == 0:
+            return None
+        device, algorithms = min(candidates,
+                                 key=lambda c: marginal_revenue(c[0]))
+        return device, algorithms[0]
+
+    def _start_benchmark(self):
+        device, algorithm = self._benchmark_target
+        logging.info(f'Benchmarking {algorithm.name} on {device} '
+                     + 'in the background')
+        self._benchmarked.add((device, algorithm))
+        self._benchmark_result = None
+        def run():
+            series = SampleSeries(algorithm.algorithms) if self._export else None
+            try:
+                self._benchmark_result = utils.run_benchmark(
+                    algorithm, device, algorithm.warmup_secs,
+                    abort_signal=self._benchmark_abort, series=series,
+                    **sampling_options(self._settings))
+            except MinerNotRunning as err:
+                logging.warning(f'Benchmarking {algorithm.name} on {device} '
+                                + f'failed: {err}')
+            finally:
+                if self._export is not None and len(series) > 0:
+                    self._export(device, algorithm.name, series)
+        self._benchmark_thread = Thread(target=run, daemon=True)
+        self._benchmark_thread.start()
+
+    def _finish_benchmark(self):
+        """Collect a finished background benchmark and free its device.
+
+        Returns the device freed, or None if no benchmark has finished.
+        """
+        thread = self._benchmark_thread
+        if thread is None or thread.is_alive():
+            return None
+        thread.join()
+        device, algorithm = self._benchmark_target
+        benchmark = self._benchmark_result
+        if benchmark is not None and not self._benchmark_abort.is_set():
+            logging.info(f'Benchmarked {algorithm.name} on {device}: '
+                         + utils.format_speeds(benchmark))
+            record(self._benchmarks[device], algorithm.name, benchmark)
+            self._revenue_matrix.set_speeds(device, algorithm, benchmark)
+            if self._journal is not None:
+                self._journal(device, algorithm.name, benchmark)
+        self._benchmark_target = self._benchmark_thread = None
+        self._benchmark_result = None
+        return device
+
     def _reset_miners(self):
         for miner in self._miners:
             miner.settings = self._settings
@@ -329,4 +592,8 @@ class MiningSession(object):
         # Empty the scheduler.
         for job in self._scheduler.queue:
             self._scheduler.cancel(job)
+        # Drop any unfinished background benchmark.
+        self._benchmark_abort.set()
+        if self._benchmark_thread is not None:
+            self._benchmark_thread.join()
 
@@ -2,10 +2,11 @@ import subprocess
 import xml.etree.ElementTree as ET
 
 class NvidiaDevice(object):
-    def __init__(self, pci_bus, uuid, name):
+    def __init__(self, pci_bus, uuid, name, driver_version=None):
         self.pci_bus = pci_bus
         self.uuid = uuid
         self.name = name
+        self.driver_version = driver_version
     def __eq__(self, other):
         if isinstance(other, NvidiaDevice):
             return self.uuid == other.uuid
@@ -29,10 +30,12 @@ def enumerate_devices():
         if err.errno != 2: # file not found
             raise
     else:
+        driver = xml.find('driver_version')
+        driver_version = driver.text if driver is not None else None
         for gpu in xml.findall('gpu'):
             pci_bus = int(gpu.find('pci').find('pci_bus').text, 16)
             uuid = gpu.find('uuid').text
             name = gpu.find('product_name').text
-            devices.append(NvidiaDevice(pci_bus, uuid, name))
+            devices.append(NvidiaDevice(pci_bus, uuid, name, driver_version))
     return devices
 
@@ -8,14 +8,14 @@ from wx.lib.pubsub import pub
 from wx.lib.scrolledpanel import ScrolledPanel
 
 from nuxhash import utils
+from nuxhash.benchmarking import (
+    plan_benchmarks, record, run_parallel, SampleSeries, sampling_options)
 from nuxhash.devices.nvidia import NvidiaDevice
 from nuxhash.gui import main
 from nuxhash.miners import all_miners
-from nuxhash.settings import DEFAULT_SETTINGS
+from nuxhash.settings import DEFAULT_SETTINGS, save_samples
 
 
-BENCHMARK_SECS = 60
-
 InputSpeedsEvent, EVT_SPEEDS = NewCommandEvent()
 
 
@@ -179,7 +179,7 @@ class BenchmarksScreen(wx.Panel):
 
     def _OnBenchmarkSet(self, target, speeds):
         device, algorithm = target
-        self._Benchmarks[device][algorithm.name] = speeds
+        record(self._Benchmarks[device], algorithm.name, speeds)
         pub.sendMessage('data.benchmarks', benchmarks=self._Benchmarks)
         self._ResetSpeedCtrl(device, algorithm)
 
@@ -257,20 +257,32 @@ class BenchmarkThread(threading.Thread):
         for miner in self._miners:
             miner.load()
 
-        for target in self._targets:
+        def run_target(device, algorithm):
+            target = (device, algorithm)
             def report(sample, secs_remaining):
                 main.sendMessage(
                         self._window, 'benchmarking.status',
                         target=target, speeds=sample, time=abs(secs_remaining),
                         warmup=(secs_remaining < 0))
-            device, algorithm = target
-            speeds = utils.run_benchmark(
-                algorithm, device, algorithm.warmup_secs, BENCHMARK_SECS,
-                sample_callback=report, abort_signal=self._abort)
-            if self._abort.is_set():
-                break
-            main.sendMessage(self._window, 'benchmarking.set',
-                             target=target, speeds=speeds)
+            if self._settings['benchmarking']['export_samples']:
+                series = SampleSeries(algorithm.algorithms)
+            else:
+                series = None
+            try:
+                speeds = utils.run_benchmark(
+                    algorithm, device, algorithm.warmup_secs,
+                    sample_callback=report, abort_signal=self._abort,
+                    series=series, **sampling_options(self._settings))
+            finally:
+                if series is not None and len(series) > 0:
+                    save_samples(main.CONFIG_DIR, device, algorithm.name,
+                                 series)
+            if not self._abort.is_set():
+                main.sendMessage(self._window, 'benchmarking.set',
+                                 target=target, speeds=speeds)
+            return speeds
+        run_parallel(plan_benchmarks(self._targets), run_target,
+                     abort_signal=self._abort)
 
         for miner in self._miners:
             miner.unload()
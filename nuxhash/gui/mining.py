@@ -17,9 +17,12 @@ from nuxhash.daemon import DONATE_ADDRESS
 from nuxhash.devices.nvidia import NvidiaDevice
 from nuxhash.gui import main
 from nuxhash.miners import all_miners
+from nuxhash.miners.miner import run_transition
 from nuxhash.nicehash import get_balances
-from nuxhash.settings import DEFAULT_SETTINGS, EMPTY_BENCHMARKS
-from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.settings import (
+    append_payrates, DEFAULT_SETTINGS, EMPTY_BENCHMARKS)
+from nuxhash.switching import make_switcher
+from nuxhash.switching.revenue import RevenueMatrix
 
 
 MINING_UPDATE_SECS = 5
@@ -311,6 +314,7 @@ class MiningThread(threading.Thread):
         self._benchmarks = benchmarks
         self._devices = devices
         self._payrates = (None, None)
+        self._assignments = {}
         self._stop_signal = threading.Event()
         self._scheduler = sched.scheduler(
             time.time, lambda t: self._stop_signal.wait(t))
@@ -326,7 +330,7 @@ class MiningThread(threading.Thread):
                 logging.warning(f'NiceHash stats: {err}, retrying in 5 seconds')
                 time.sleep(5)
             else:
-                self._payrates = payrates
+                self._payrates = (payrates, datetime.now())
         self._miners = [miner(main.CONFIG_DIR) for miner in all_miners]
         for miner in self._miners:
             miner.settings = self._settings
@@ -334,7 +338,9 @@ class MiningThread(threading.Thread):
         self._algorithms = sum([miner.algorithms for miner in self._miners], [])
 
         # Initialize profit-switching.
-        self._profit_switch = NaiveSwitcher(self._settings)
+        self._revenue_matrix = RevenueMatrix(self._devices, self._algorithms,
+                                             self._benchmarks)
+        self._profit_switch = make_switcher(self._settings, self._benchmarks)
         self._profit_switch.reset()
 
         self._scheduler.enter(0, MiningThread.PROFIT_PRIORITY, self._switch_algos)
@@ -354,31 +360,24 @@ class MiningThread(threading.Thread):
             logging.warning(f'NiceHash stats: {err}')
         else:
             self._payrates = (ret_payrates, datetime.now())
+            if self._settings['switching']['record_payrates']:
+                append_payrates(main.CONFIG_DIR, time.time(), ret_payrates)
 
         interval = self._settings['switching']['interval']
         payrates, payrates_time = self._payrates
 
         # Calculate BTC/day rates.
-        def revenue(device, algorithm):
-            benchmarks = self._benchmarks[device]
-            if algorithm.name in benchmarks:
-                return sum([payrates[sub_algo]*benchmarks[algorithm.name][i]
-                            if sub_algo in payrates else 0.0
-                            for i, sub_algo in enumerate(algorithm.algorithms)])
-            else:
-                return 0.0
-        revenues = {device: {algorithm: revenue(device, algorithm)
-                             for algorithm in self._algorithms}
-                    for device in self._devices}
+        revenues = self._revenue_matrix.revenues(payrates)
 
         # Get device -> algorithm assignments from profit switcher.
         assigned_algorithm = self._profit_switch.decide(revenues, payrates_time)
+        started = run_transition(self._assignments, assigned_algorithm)
+        self._profit_switch.switched(started)
         self._assignments = assigned_algorithm
-        for this_algorithm in self._algorithms:
-            this_devices = [device for device, algorithm
-                            in assigned_algorithm.items()
-                            if algorithm == this_algorithm]
-            this_algorithm.set_devices(this_devices)
+        for device, secs in started.items():
+            name = assigned_algorithm[device].name
+            logging.info(f'{device} switched to {name}, '
+                         + f'accepted by the miner after {secs:.2f} s')
 
         # Donation time.
         if not self._settings['donate']['optout'] and random() < DONATE_PROB:
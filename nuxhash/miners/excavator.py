@@ -1,9 +1,16 @@
+import asyncio
+import itertools
 import json
 import os
+import select
 import socket
 import subprocess
+import logging
 import threading
+import time
+from collections import deque, OrderedDict
 
+from nuxhash.devices.nvidia import enumerate_devices as nvidia_devices
 from nuxhash.devices.nvidia import NvidiaDevice
 from nuxhash.miners import miner
 from nuxhash.utils import get_port
@@ -31,6 +38,14 @@ ALGORITHMS = [
     'x16r'
     ]
 NHMP_PORT = 3200
+SPEEDS_TTL = 0.5
+IDLE_ALGORITHMS = 2
+IDLE_TIMEOUT = 300
+STARTUP_POLL_SECS = 0.01
+STARTUP_POLL_MAX_SECS = 0.5
+RESTART_BACKOFF_SECS = 1
+RESTART_BACKOFF_MAX_SECS = 60
+CRASH_OUTPUT_WAIT_SECS = 5
 
 
 class ExcavatorError(Exception):
@@ -45,16 +60,281 @@ class ExcavatorAPIError(ExcavatorError):
         self.error = response['error']
 
 
-class ExcavatorServer(object):
+class ExcavatorConnection(object):
+    """Long-lived connection to excavator's JSON-RPC interface.
+
+    The socket is opened on first use and kept open between commands. If
+    excavator has dropped the idle connection, it is reopened before sending.
+    A command is only sent again if sending it failed; once it went out,
+    excavator may have run it, and running worker.add or worker.free twice
+    would leave the wrong workers behind.
+    """
 
-    BUFFER_SIZE = 1024
+    BUFFER_SIZE = 65536
     TIMEOUT = 10
 
-    def __init__(self, executable):
+    def __init__(self, address):
+        self._address = address
+        self._socket = None
+        # received bytes not yet returned as a response
+        self._buffer = bytearray()
+        self._chunk = memoryview(bytearray(self.BUFFER_SIZE))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def address(self):
+        return self._address
+    @address.setter
+    def address(self, v):
+        with self._lock:
+            if v != self._address:
+                self._close()
+                self._address = v
+
+    def send(self, method, params, read_response=True):
+        """Send a command and return the decoded response (or None).
+
+        method -- name of the command to execute
+        params -- list of arguments for the command
+        read_response -- if False, don't wait for excavator to respond
+        """
+        with self._lock:
+            request_id = next(self._ids)
+            data = _encode_command(request_id, method, params)
+
+            if self._socket is not None and _peer_closed(self._socket):
+                self._close()
+            reused = self._socket is not None
+            try:
+                self._send(data)
+            except socket.error as err:
+                self._close()
+                if not reused or isinstance(err, socket.timeout):
+                    raise
+                # The old connection went stale; try again on a fresh one.
+                try:
+                    self._send(data)
+                except Exception:
+                    self._close()
+                    raise
+            except Exception:
+                self._close()
+                raise
+
+            if not read_response:
+                return None
+            try:
+                return self._read_response(request_id)
+            except Exception:
+                self._close()
+                raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        del self._buffer[:]
+
+    def _send(self, data):
+        if self._socket is None:
+            self._socket = socket.create_connection(self._address, self.TIMEOUT)
+        self._socket.sendall(data)
+
+    def _read_response(self, request_id):
+        while True:
+            response_data = json.loads(self._read_line())
+            # Skip leftover responses to commands sent without reading.
+            if response_data.get('id', request_id) == request_id:
+                return response_data
+
+    def _read_line(self):
+        # Excavator responses are newline-terminated too. Only scan the bytes
+        # received since the last pass, and keep anything past the newline for
+        # the next response.
+        end = self._buffer.find(b'\n')
+        while end < 0:
+            n = self._socket.recv_into(self._chunk)
+            if n == 0:
+                raise ConnectionResetError('excavator closed the connection')
+            scanned = len(self._buffer)
+            self._buffer += self._chunk[:n]
+            end = self._buffer.find(b'\n', scanned)
+        line = self._buffer[:end]
+        del self._buffer[:end + 1]
+        return line
+
+
+class AsyncExcavatorConnection(object):
+    """Pipelined connection to excavator's JSON-RPC interface, using asyncio.
+
+    A batch of commands is written back to back on one stream and responses are
+    matched to their requests by id, so the whole batch costs about one round
+    trip. If excavator has dropped the idle connection, it is reopened before
+    sending. A batch that went out is never sent again, since excavator may
+    have run some of its commands.
+    """
+
+    TIMEOUT = ExcavatorConnection.TIMEOUT
+    STREAM_LIMIT = 2**20
+
+    def __init__(self, address):
+        self.address = address
+        self._reader = self._writer = self._read_task = None
+        self._ids = itertools.count(1)
+        # dict of request id -> Future for the response
+        self._pending = {}
+
+    async def send_commands(self, commands, latencies=None):
+        """Send commands and return their decoded responses, in order.
+
+        commands -- list of (method, params) tuples
+        latencies -- if a list, filled with the seconds each response took
+        """
+        if self._writer is None or self._read_task.done() or self._stale():
+            await self._connect()
+        loop = asyncio.get_event_loop()
+        sent = loop.time()
+        futures = []
+        for method, params in commands:
+            request_id = next(self._ids)
+            future = loop.create_future()
+            self._pending[request_id] = future
+            futures.append(future)
+            self._writer.write(_encode_command(request_id, method, params))
+        if latencies is not None:
+            latencies[:] = [None]*len(futures)
+            def record(i):
+                def callback(future):
+                    latencies[i] = loop.time() - sent
+                return callback
+            for i, future in enumerate(futures):
+                future.add_done_callback(record(i))
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(asyncio.gather(*futures), self.TIMEOUT)
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._read_task.cancel()
+            self._reader = self._writer = self._read_task = None
+        self._fail_pending(ConnectionResetError('connection closed'))
+
+    async def _connect(self):
+        await self.close()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(*self.address, limit=self.STREAM_LIMIT),
+            self.TIMEOUT)
+        self._read_task = asyncio.ensure_future(self._read_responses(self._reader))
+
+    async def _read_responses(self, reader):
+        try:
+            while True:
+                response_data = json.loads(await reader.readuntil(b'\n'))
+                future = self._pending.pop(response_data.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response_data)
+        except (asyncio.IncompleteReadError, socket.error, ValueError):
+            self._fail_pending(
+                ConnectionResetError('excavator closed the connection'))
+
+    def _stale(self):
+        with self._writer.get_extra_info('socket').dup() as sock:
+            return _peer_closed(sock)
+
+    def _fail_pending(self, err):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(err)
+        self._pending = {}
+
+
+class ExcavatorPipeline(object):
+    """Synchronous facade for AsyncExcavatorConnection.
+
+    The connection is driven by a private event loop in a background thread.
+    """
+
+    def __init__(self, address):
+        self._connection = AsyncExcavatorConnection(address)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self._connection.address
+    @address.setter
+    def address(self, v):
+        if v != self._connection.address:
+            self.close()
+            self._connection.address = v
+
+    def send_commands(self, commands, latencies=None):
+        """Send commands and return their decoded responses, in order.
+
+        commands -- list of (method, params) tuples
+        latencies -- if a list, filled with the seconds each response took
+        """
+        if len(commands) == 0:
+            return []
+        try:
+            return self._run(self._connection.send_commands(commands, latencies))
+        except asyncio.TimeoutError:
+            raise socket.timeout('excavator did not respond')
+
+    def close(self):
+        if self._loop is not None:
+            self._run(self._connection.close())
+
+    def _run(self, coroutine):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                loop_thread = threading.Thread(target=self._loop.run_forever,
+                                               daemon=True)
+                loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+def _peer_closed(sock):
+    """Check, without blocking, if the other end has closed sock."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+def _encode_command(request_id, method, params):
+    command = {
+        'id': request_id,
+        'method': method,
+        'params': [str(param) for param in params]
+        }
+    # Send newline-terminated command.
+    js_data = json.dumps(command).replace('\n', '\\n') + '\n'
+    return js_data.encode('ascii')
+
+
+class ExcavatorServer(object):
+
+    def __init__(self, executable, devices=None):
         self._executable = executable
+        # list of devices this excavator may use, or None for all of them
+        self.devices = devices
         self.__subscription = self._process = None
         self._randport = get_port()
         self.__address = ('127.0.0.1', self._randport)
+        self._connection = ExcavatorConnection(self.__address)
+        self._pipeline = ExcavatorPipeline(self.__address)
         self._extra_args = []
         # dict of algorithm name -> ESAlgorithm
         self._running_algorithms = {algorithm: ESAlgorithm(self, algorithm)
@@ -63,6 +343,23 @@ class ExcavatorServer(object):
         self._device_map = {}
         # dict of (algorithm name, Device instance) -> excavator worker id
         self._running_workers = {}
+        # dict of device id -> algorithm name -> speed, from the last worker.list
+        self._speeds = None
+        self._speeds_time = 0.0
+        self._speeds_ttl = SPEEDS_TTL
+        self._speeds_lock = threading.Lock()
+        # dict of ESAlgorithm -> time it went idle, least recently used first
+        self._idle_algorithms = OrderedDict()
+        self._idle_limit = IDLE_ALGORITHMS
+        self._idle_timeout = IDLE_TIMEOUT
+        # guards the process and worker state against the supervisor thread
+        self._lock = threading.RLock()
+        # restart excavator if it exits on its own
+        self._supervising = False
+        # seconds taken by recent crash recoveries, oldest first
+        self.restart_latencies = deque(maxlen=100)
+        # version reported by the running excavator
+        self.version = None
 
     @property
     def settings(self):
@@ -72,12 +369,15 @@ class ExcavatorServer(object):
         self._subscription = (v['nicehash']['region'],
                               v['nicehash']['wallet'],
                               v['nicehash']['workername'])
-        if v['excavator_miner']['listen'] == '':
+        if v['excavator_miner']['listen'] == '' or self.devices is not None:
             self._address = ('127.0.0.1', self._randport)
         else:
             ip, port = v['excavator_miner']['listen'].split(':')
             self._address = (ip, port)
         self._extra_args = v['excavator_miner']['args'].split()
+        self._speeds_ttl = v['excavator_miner']['speeds_ttl']
+        self._idle_limit = v['excavator_miner']['idle_algorithms']
+        self._idle_timeout = v['excavator_miner']['idle_timeout']
 
     @property
     def _subscription(self):
@@ -100,28 +400,43 @@ class ExcavatorServer(object):
             if self.is_running():
                 self.stop()
                 self.__address = v
+                self._connection.address = self._pipeline.address = v
                 self.start()
             else:
                 self.__address = v
+                self._connection.address = self._pipeline.address = v
 
     def start(self):
-        """Launches excavator."""
+        """Launches excavator, unless it is already running."""
+        with self._lock:
+            if not self.is_running():
+                self._start()
 
+    def _start(self):
         # Start process.
+        self._connection.close()
+        self._pipeline.close()
         ip, port = self._address
+        env = dict(os.environ)
+        if self.devices is not None:
+            # Keep faults in one shard from taking down the others' devices.
+            env['CUDA_VISIBLE_DEVICES'] = ','.join(device.uuid
+                                                   for device in self.devices)
         self._process = subprocess.Popen(
             [self._executable, '-i', ip, '-p', str(port)] + self._extra_args,
-            stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+            stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
+            env=env)
 
         # Send stdout to logger.
-        log_thread = threading.Thread(
-            target=miner.log_output, args=(self._process,))
-        log_thread.start()
+        miner.log_output(self._process)
 
-        # Wait for startup.
+        # Wait for startup, polling more slowly the longer it takes.
+        poll_secs = STARTUP_POLL_SECS
         while not self._test_connection():
             if self._process.poll() is not None:
                 raise miner.MinerStartFailed
+            time.sleep(poll_secs)
+            poll_secs = min(poll_secs*2, STARTUP_POLL_MAX_SECS)
 
         self._read_devices()
         self._subscribe()
@@ -129,9 +444,47 @@ class ExcavatorServer(object):
         # Add back previously running workers.
         self._running_algorithms = {algorithm: ESAlgorithm(self, algorithm)
                                     for algorithm in ALGORITHMS}
-        for key, worker_id in self._running_workers.items():
-            algorithm, device = key
-            self.start_work(algorithm, device)
+        self._idle_algorithms = OrderedDict()
+        self.apply_work(start=list(self._running_workers.keys()))
+
+        # Watch for crashes.
+        self._supervising = True
+        supervisor = threading.Thread(target=self._supervise,
+                                      args=(self._process,), daemon=True)
+        supervisor.start()
+
+    def _supervise(self, process):
+        process.wait()
+        # The exit can be noticed before the last output is read.
+        miner.wait_for_output(process, CRASH_OUTPUT_WAIT_SECS)
+        with self._lock:
+            if not self._supervising or process is not self._process:
+                return
+            lines = '\n'.join(miner.last_output(process))
+            logging.error(f'excavator exited with code {process.returncode}, '
+                          + f'restarting; last output:\n{lines}')
+
+        crashed = time.monotonic()
+        backoff = RESTART_BACKOFF_SECS
+        while True:
+            with self._lock:
+                # Someone else may have stopped or restarted excavator meanwhile.
+                if not self._supervising or self.is_running():
+                    break
+                try:
+                    self._start()
+                except (miner.MinerStartFailed, socket.error, ExcavatorError) as err:
+                    logging.error(f'excavator restart failed ({err!r}), '
+                                  + f'retrying in {backoff} s')
+                else:
+                    break
+            time.sleep(backoff)
+            backoff = min(backoff*2, RESTART_BACKOFF_MAX_SECS)
+
+        if self.is_running():
+            latency = time.monotonic() - crashed
+            self.restart_latencies.append(latency)
+            logging.warning(f'excavator recovered after {latency:.2f} s')
 
     def _subscribe(self):
         region, wallet, worker = self._subscription
@@ -140,10 +493,14 @@ class ExcavatorServer(object):
 
     def stop(self):
         """Stops excavator."""
-        self.send_command('unsubscribe', [])
-        self.send_command_only('quit', [])
+        with self._lock:
+            self._supervising = False
+            self.send_command('unsubscribe', [])
+            self.send_command_only('quit', [])
+            self._connection.close()
+            self._pipeline.close()
 
-        self._process.wait()
+            self._process.wait()
 
     def is_running(self):
         return self._process is not None and self._process.poll() is None
@@ -154,26 +511,7 @@ class ExcavatorServer(object):
         method -- name of the command to execute
         params -- list of arguments for the command
         """
-        # Send newline-terminated command.
-        command = {
-            'id': 1,
-            'method': method,
-            'params': [str(param) for param in params]
-            }
-        js_data = json.dumps(command).replace('\n', '\\n') + '\n'
-        response = ''
-        with socket.create_connection(self._address, self.TIMEOUT) as s:
-            s.sendall(js_data.encode('ascii'))
-            while True:
-                chunk = s.recv(self.BUFFER_SIZE).decode()
-                # Excavator responses are newline-terminated too.
-                if '\n' in chunk:
-                    response += chunk[:chunk.index('\n')]
-                    break
-                else:
-                    response += chunk
-        # Read the response.
-        response_data = json.loads(response)
+        response_data = self._connection.send(method, params)
         if response_data['error'] is None:
             return response_data
         else:
@@ -185,22 +523,27 @@ class ExcavatorServer(object):
         method -- name of the command to execute
         params -- list of arguments for the command
         """
-        # Send newline-terminated command.
-        command = {
-            'id': 1,
-            'method': method,
-            'params': [str(param) for param in params]
-            }
-        js_data = json.dumps(command).replace('\n', '\\n') + '\n'
-        with socket.create_connection(self._address, self.TIMEOUT) as s:
-            s.sendall(js_data.encode('ascii'))
+        self._connection.send(method, params, read_response=False)
+
+    def send_commands(self, commands, latencies=None):
+        """Sends several commands to excavator at once, returns the responses.
+
+        Commands are pipelined, so the batch costs about one round trip. Unlike
+        send_command(), failed commands do not raise; check each response's
+        'error' field.
+
+        commands -- list of (method, params) tuples
+        latencies -- if a list, filled with the seconds each response took
+        """
+        return self._pipeline.send_commands(commands, latencies)
 
     def _test_connection(self):
         try:
-            self.send_command_only('info', [])
+            response = self.send_command('info', [])
         except (socket.error, socket.timeout, ValueError):
             return False
         else:
+            self.version = response.get('version', None)
             return True
 
     def _read_devices(self):
@@ -211,41 +554,145 @@ class ExcavatorServer(object):
 
     def start_work(self, algorithm, device, benchmarking=False):
         """Start running algorithm on device."""
-        # Create associated algorithm(s).
-        for multialgorithm in algorithm.split('_'):
-            algorithm_instance = self._running_algorithms[multialgorithm]
-            algorithm_instance.set_benchmarking(benchmarking)
-            algorithm_instance.grab()
-
-        # Create worker.
-        device_id = self._device_map[device.pci_bus]
-        if benchmarking:
-            response = self.send_command(
-                    'worker.add', [f'benchmark-{algorithm}', device_id])
-        else:
-            response = self.send_command('worker.add', [algorithm, device_id])
-        self._running_workers[(algorithm, device)] = response['worker_id']
+        self.apply_work(start=[(algorithm, device)], benchmarking=benchmarking)
 
     def stop_work(self, algorithm, device):
         """Stop running algorithm on device."""
-        # Destroy worker.
-        worker_id = self._running_workers[(algorithm, device)]
-        self.send_command('worker.free', [str(worker_id)])
-        self._running_workers.pop((algorithm, device))
+        self.apply_work(stop=[(algorithm, device)])
+
+    def apply_work(self, start=[], stop=[], benchmarking=False):
+        """Start and stop several workers with one batch of commands.
 
-        # Destroy associated algorithm(s) if no longer used.
+        Idle devices get their new workers first, then each moving device is
+        freed and immediately given its new worker, and devices going idle are
+        freed last.
+
+        start -- list of (algorithm name, Device) workers to create
+        stop -- list of (algorithm name, Device) workers to destroy
+        benchmarking -- run the new workers in benchmark mode
+
+        Returns dict of Device -> seconds until its new worker was added.
+        """
+        with self._lock:
+            return self._apply_work(start, stop, benchmarking)
+
+    def _apply_work(self, start, stop, benchmarking):
+        self._expire_algorithms()
+
+        # Create associated algorithm(s) first, so that algorithms shared by old
+        # and new workers are never torn down in between.
+        for algorithm, device in start:
+            for multialgorithm in algorithm.split('_'):
+                algorithm_instance = self._running_algorithms[multialgorithm]
+                algorithm_instance.set_benchmarking(benchmarking)
+                algorithm_instance.grab()
+
+        # Destroy and create workers.
+        starting = [device for algorithm, device in start]
+        stopping = [device for algorithm, device in stop]
+        devices = starting + [device for device in stopping
+                              if device not in starting]
+        def order(op):
+            action, (algorithm, device) = op
+            if device not in stopping:
+                group = 0
+            elif device in starting:
+                group = 1
+            else:
+                group = 2
+            return (group, devices.index(device), action == 'add')
+        ops = sorted([('free', key) for key in stop]
+                     + [('add', key) for key in start], key=order)
+        commands = []
+        for action, (algorithm, device) in ops:
+            if action == 'free':
+                commands.append(
+                    ('worker.free', [self._running_workers[(algorithm, device)]]))
+            else:
+                device_id = self._device_map[device.pci_bus]
+                if benchmarking:
+                    commands.append(
+                        ('worker.add', [f'benchmark-{algorithm}', device_id]))
+                else:
+                    commands.append(('worker.add', [algorithm, device_id]))
+        latencies = []
+        try:
+            responses = self.send_commands(commands, latencies=latencies)
+        except Exception:
+            for algorithm, device in start:
+                self._release_algorithms(algorithm)
+            raise
+        finally:
+            self._invalidate_speeds()
+
+        errors = []
+        added = {}
+        for (action, key), response, latency in zip(ops, responses, latencies):
+            algorithm, device = key
+            if response['error'] is not None:
+                errors.append(response)
+                if action == 'add':
+                    self._release_algorithms(algorithm)
+            elif action == 'free':
+                self._running_workers.pop(key)
+                # Destroy associated algorithm(s) if no longer used.
+                self._release_algorithms(algorithm)
+            else:
+                self._running_workers[key] = response['worker_id']
+                added[device] = latency
+        if len(errors) > 0:
+            raise ExcavatorAPIError(errors[0])
+        return added
+
+    def _release_algorithms(self, algorithm):
         for multialgorithm in algorithm.split('_'):
             self._running_algorithms[multialgorithm].release()
 
+    def _park_algorithm(self, algorithm):
+        self._idle_algorithms[algorithm] = time.monotonic()
+        self._expire_algorithms()
+
+    def _unpark_algorithm(self, algorithm):
+        self._idle_algorithms.pop(algorithm, None)
+
+    def _expire_algorithms(self):
+        """Remove idle algorithms that timed out or exceed the idle limit."""
+        now = time.monotonic()
+        for algorithm, since in list(self._idle_algorithms.items()):
+            if (len(self._idle_algorithms) > self._idle_limit
+                    or now - since >= self._idle_timeout):
+                self._idle_algorithms.pop(algorithm)
+                algorithm.evict()
+
     def device_speeds(self, device):
         """Report the speeds of all algorithms running on device."""
-        response = self.send_command('worker.list', [])
-        # NOTE: assumes 1:1 mapping of workers to devices
         device_id = self._device_map[device.pci_bus]
-        data = next(worker for worker in response['workers']
-                    if worker['device_id'] == device_id)
-        return {algorithm['name']: algorithm['speed']
-                for algorithm in data['algorithms']}
+        return self.worker_speeds().get(device_id, {})
+
+    def worker_speeds(self):
+        """Report the speeds of all running workers, indexed by device id.
+
+        The worker.list snapshot is shared by all callers for a short time, so
+        polling every device in a rig costs a single request.
+        """
+        with self._lock:
+            self._expire_algorithms()
+        with self._speeds_lock:
+            now = time.monotonic()
+            if self._speeds is None or now - self._speeds_time >= self._speeds_ttl:
+                response = self.send_command('worker.list', [])
+                speeds = {}
+                for worker in response['workers']:
+                    device_speeds = speeds.setdefault(worker['device_id'], {})
+                    for algorithm in worker['algorithms']:
+                        device_speeds[algorithm['name']] = algorithm['speed']
+                self._speeds = speeds
+                self._speeds_time = now
+            return self._speeds
+
+    def _invalidate_speeds(self):
+        with self._speeds_lock:
+            self._speeds = None
 
 
 class ESResource(object):
@@ -272,29 +719,43 @@ class ESResource(object):
 
 
 class ESAlgorithm(ESResource):
+    """An excavator algorithm, which holds a stratum connection (and DAG state).
+
+    When the last worker leaves, the algorithm is parked instead of removed, so
+    that switching back to it soon does not pay the setup cost again. The server
+    removes parked algorithms once they time out or too many are idle.
+    """
 
     def __init__(self, server, algorithm):
         super(ESAlgorithm, self).__init__()
         self._server = server
         self._algorithm = algorithm
         self._benchmark = False
+        # name this algorithm is added to excavator as, or None
+        self._added = None
 
     def set_benchmarking(self, v):
         self._benchmark = v
 
     def _create(self):
+        self._server._unpark_algorithm(self)
         if self._benchmark:
-            self._server.send_command(
-                    'algorithm.add', [f'benchmark-{self._algorithm}'])
+            name = f'benchmark-{self._algorithm}'
         else:
-            self._server.send_command('algorithm.add', [self._algorithm])
+            name = self._algorithm
+        if self._added != name:
+            self.evict()
+            self._server.send_command('algorithm.add', [name])
+            self._added = name
 
     def _destroy(self):
-        if self._benchmark:
-            self._server.send_command(
-                    'algorithm.remove', [f'benchmark-{self._algorithm}'])
-        else:
-            self._server.send_command('algorithm.remove', [self._algorithm])
+        self._server._park_algorithm(self)
+
+    def evict(self):
+        """Remove the algorithm from excavator."""
+        if self._added is not None:
+            self._server.send_command('algorithm.remove', [self._added])
+            self._added = None
 
 
 class ExcavatorAlgorithm(miner.Algorithm):
@@ -305,7 +766,6 @@ class ExcavatorAlgorithm(miner.Algorithm):
             self, parent, name=f'excavator_{excavator_algorithm}',
             algorithms=algorithms, **kwargs)
         self._excavator_algorithm = excavator_algorithm
-        self._devices = []
 
     def accepts(self, device):
         # TODO: Proper support table instead of blindly accepting team green.
@@ -314,9 +774,17 @@ class ExcavatorAlgorithm(miner.Algorithm):
     @miner.needs_miner_running
     def set_devices(self, devices):
         assert all(self.accepts(device) for device in devices)
-        self._transition(set(self._devices), set(devices),
-                         detach=self._stop_work,
-                         attach=self._start_work)
+        old, new = set(self._devices), set(devices)
+        if old != new:
+            try:
+                self.parent.apply_work(
+                    start=[(self._excavator_algorithm, device)
+                           for device in new - old],
+                    stop=[(self._excavator_algorithm, device)
+                          for device in old - new],
+                    benchmarking=self.benchmarking)
+            except (socket.error, socket.timeout):
+                raise miner.MinerNotRunning('could not connect to excavator')
         self._devices = devices
 
     @miner.Algorithm.benchmarking.setter
@@ -328,31 +796,10 @@ class ExcavatorAlgorithm(miner.Algorithm):
             self.set_devices([])
             self.set_devices(devices)
 
-    def _transition(self, old, new,
-                    detach=lambda x: None, attach=lambda x: None):
-        if old != new:
-            for x in old - new:
-                detach(x)
-            for x in new - old:
-                attach(x)
-
-    def _start_work(self, device):
-        try:
-            self.parent.server.start_work(self._excavator_algorithm, device,
-                                          benchmarking=self.benchmarking)
-        except (socket.error, socket.timeout):
-            raise miner.MinerNotRunning('could not connect to excavator')
-
-    def _stop_work(self, device):
-        try:
-            self.parent.server.stop_work(self._excavator_algorithm, device)
-        except (socket.error, socket.timeout):
-            raise miner.MinerNotRunning('could not connect to excavator')
-
     @miner.needs_miner_running
     def current_speeds(self):
         try:
-            workers = [self.parent.server.device_speeds(device)
+            workers = [self.parent.server_for(device).device_speeds(device)
                        for device in self._devices]
         except (socket.error, socket.timeout):
             raise miner.MinerNotRunning('could not connect to excavator')
@@ -365,6 +812,13 @@ class ExcavatorAlgorithm(miner.Algorithm):
 
 
 class Excavator(miner.Miner):
+    """NiceHash's excavator miner.
+
+    By default, one excavator process runs all devices. With
+    excavator_miner.shard_size set, devices are split into groups of that size,
+    each served by its own excavator process on its own port. A crash then only
+    stops its own shard, and needs_miner_running restarts just that shard.
+    """
 
     def __init__(self, config_dir):
         miner.Miner.__init__(self, config_dir)
@@ -372,19 +826,105 @@ class Excavator(miner.Miner):
             runnable = ExcavatorAlgorithm(self, algorithm,
                                           warmup_secs=miner.SHORT_WARMUP_SECS)
             self.algorithms.append(runnable)
-        self.server = ExcavatorServer(config_dir/'excavator'/'excavator')
+        self._executable = config_dir/'excavator'/'excavator'
+        self._shard_size = self._built_shard_size = 0
+        self.server = ExcavatorServer(self._executable)
+        # list of all ExcavatorServer processes
+        self.servers = [self.server]
+        # dict of Device -> ExcavatorServer, if sharded
+        self._shards = {}
 
     def load(self):
-        self.server.start()
+        if (self._shard_size != self._built_shard_size
+                and not any(server.is_running() for server in self.servers)):
+            self._make_shards()
+        for server in self.servers:
+            if not server.is_running():
+                server.start()
 
     def unload(self):
-        self.server.stop()
+        for server in self.servers:
+            if server.is_running():
+                server.stop()
 
     def is_running(self):
-        return self.server.is_running()
+        return all(server.is_running() for server in self.servers)
+
+    @property
+    def version(self):
+        return self.servers[0].version
+
+    def server_for(self, device):
+        """Return the ExcavatorServer responsible for device."""
+        if not self._shards:
+            return self.server
+        try:
+            return self._shards[device]
+        except KeyError:
+            raise ExcavatorError(f'{device} is not in any excavator shard')
+
+    def apply_work(self, start=[], stop=[], benchmarking=False):
+        """Route ExcavatorServer.apply_work() to the right shard(s)."""
+        batches = {}
+        for key in start:
+            batches.setdefault(self.server_for(key[1]), ([], []))[0].append(key)
+        for key in stop:
+            batches.setdefault(self.server_for(key[1]), ([], []))[1].append(key)
+        started = {}
+        for server, (this_start, this_stop) in batches.items():
+            started.update(server.apply_work(start=this_start, stop=this_stop,
+                                             benchmarking=benchmarking))
+        return started
+
+    def switch(self, moves):
+        # Benchmarking algorithms need their own batches.
+        if any(algorithm is not None and algorithm.benchmarking
+               for device, old_algorithm, new_algorithm in moves
+               for algorithm in [old_algorithm, new_algorithm]):
+            return miner.Miner.switch(self, moves)
+
+        if not self.is_running():
+            self.load()
+        start = [(new_algorithm._excavator_algorithm, device)
+                 for device, old_algorithm, new_algorithm in moves
+                 if new_algorithm is not None]
+        stop = [(old_algorithm._excavator_algorithm, device)
+                for device, old_algorithm, new_algorithm in moves
+                if old_algorithm is not None]
+        try:
+            started = self.apply_work(start=start, stop=stop)
+        except (socket.error, socket.timeout):
+            raise miner.MinerNotRunning('could not connect to excavator')
+        for device, old_algorithm, new_algorithm in moves:
+            if old_algorithm is not None:
+                old_algorithm._devices = [d for d in old_algorithm._devices
+                                          if d != device]
+            if new_algorithm is not None:
+                new_algorithm._devices = new_algorithm._devices + [device]
+        return started
 
     @miner.Miner.settings.setter
     def settings(self, v):
-        miner.Miner.settings.setter(v)
-        self.server.settings = v
-
+        miner.Miner.settings.fset(self, v)
+        # A new shard size takes effect the next time excavator is loaded.
+        self._shard_size = v['excavator_miner']['shard_size']
+        for server in set([self.server] + self.servers):
+            server.settings = v
+
+    def _make_shards(self):
+        self._built_shard_size = self._shard_size
+        if self._shard_size > 0:
+            devices = sorted(nvidia_devices(), key=lambda device: device.pci_bus)
+        else:
+            devices = []
+        if len(devices) <= self._shard_size or self._shard_size <= 0:
+            self.servers = [self.server]
+            self._shards = {}
+        else:
+            self.servers = [ExcavatorServer(self._executable,
+                                            devices=devices[i:i + self._shard_size])
+                            for i in range(0, len(devices), self._shard_size)]
+            for server in self.servers:
+                server.settings = self.settings
+            self._shards = {device: server for server in self.servers
+                            for device in server.devices}
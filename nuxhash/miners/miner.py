@@ -1,4 +1,10 @@
 import logging
+import os
+import selectors
+import threading
+import time
+import weakref
+from collections import deque
 from functools import wraps
 
 
@@ -46,6 +52,11 @@ class Miner(object):
         """Probe if the miner is operational."""
         pass
 
+    @property
+    def version(self):
+        """Version of the mining program, if known."""
+        return None
+
     @property
     def settings(self):
         return self._settings
@@ -62,6 +73,34 @@ class Miner(object):
         """Change pools during runtime."""
         self._stratums = v
 
+    def switch(self, moves):
+        """Reassign devices between this miner's algorithms.
+
+        moves -- list of (device, old algorithm, new algorithm) tuples, as
+                 returned by plan_transition(); either algorithm may be None
+
+        Returns dict of device -> seconds until the miner accepted its new
+        algorithm. That is not when it starts hashing, which takes its warmup.
+        """
+        start = time.monotonic()
+        devices = {}
+        for device, old_algorithm, new_algorithm in moves:
+            for algorithm in [old_algorithm, new_algorithm]:
+                if algorithm is not None and algorithm not in devices:
+                    devices[algorithm] = list(algorithm.devices)
+            if old_algorithm is not None:
+                devices[old_algorithm].remove(device)
+            if new_algorithm is not None:
+                devices[new_algorithm].append(device)
+        started = {}
+        for algorithm, algorithm_devices in devices.items():
+            algorithm.set_devices(algorithm_devices)
+            secs = time.monotonic() - start
+            for device, old_algorithm, new_algorithm in moves:
+                if new_algorithm == algorithm:
+                    started[device] = secs
+        return started
+
 
 class Algorithm(object):
 
@@ -76,6 +115,8 @@ class Algorithm(object):
         self.warmup_secs = warmup_secs
         # benchmarking mode
         self._benchmarking = False
+        # list of devices this algorithm is running on
+        self._devices = []
 
     def __repr__(self):
         return f'<algorithm:{self.name} {self.algorithms}>'
@@ -88,6 +129,10 @@ class Algorithm(object):
         """Run this algorithm on the set of devices."""
         pass
 
+    @property
+    def devices(self):
+        return self._devices
+
     @property
     def benchmarking(self):
         return self._benchmarking
@@ -109,11 +154,184 @@ def needs_miner_running(method):
     return wrapper
 
 
+def plan_transition(old, new):
+    """Work out the moves needed to go from one rig assignment to another.
+
+    old -- dict of device -> algorithm currently running on it
+    new -- dict of device -> algorithm that should run on it
+
+    Returns list of (device, old algorithm, new algorithm) tuples for the
+    devices that change, with None standing in for an idle device. Devices that
+    were idle come first, then devices moving between algorithms, then devices
+    going idle.
+    """
+    moves = []
+    for device in set(old.keys()) | set(new.keys()):
+        old_algorithm = old.get(device, None)
+        new_algorithm = new.get(device, None)
+        if old_algorithm != new_algorithm:
+            moves.append((device, old_algorithm, new_algorithm))
+    def order(move):
+        device, old_algorithm, new_algorithm = move
+        if old_algorithm is None:
+            group = 0
+        elif new_algorithm is not None:
+            group = 1
+        else:
+            group = 2
+        return (group, str(device))
+    return sorted(moves, key=order)
+
+
+def run_transition(old, new):
+    """Move devices from one rig assignment to another in a single pass.
+
+    Each miner receives all of its moves at once; devices that are not moving
+    are left untouched.
+
+    old -- dict of device -> algorithm currently running on it
+    new -- dict of device -> algorithm that should run on it
+
+    Returns dict of device -> seconds until the miner accepted its new
+    algorithm (for excavator, the worker.add response latency).
+    """
+    moves = plan_transition(old, new)
+    # Split moves that cross between miners into a stop and a start.
+    miner_moves = {}
+    for device, old_algorithm, new_algorithm in moves:
+        if (old_algorithm is not None and new_algorithm is not None
+                and old_algorithm.parent != new_algorithm.parent):
+            miner_moves.setdefault(old_algorithm.parent, []).append(
+                (device, old_algorithm, None))
+            miner_moves.setdefault(new_algorithm.parent, []).append(
+                (device, None, new_algorithm))
+        else:
+            parent = (old_algorithm or new_algorithm).parent
+            miner_moves.setdefault(parent, []).append(
+                (device, old_algorithm, new_algorithm))
+
+    # Make sure every miner in use is up, even ones with nothing to change.
+    for algorithm in set(new.values()):
+        if algorithm is not None and not algorithm.parent.is_running():
+            algorithm.parent.load()
+
+    start = time.monotonic()
+    started = {}
+    for miner, this_moves in miner_moves.items():
+        offset = time.monotonic() - start
+        for device, secs in miner.switch(this_moves).items():
+            started[device] = offset + secs
+    return started
+
+
+class LogMultiplexer(object):
+    """Reads the output of every miner process from one selector thread.
+
+    The most recent lines of each process are kept in a ring buffer for crash
+    reports. Lines are only decoded and logged if debug logging is enabled.
+    """
+
+    READ_SIZE = 65536
+    HISTORY_LINES = 100
+    # unfinished lines longer than this are cut off and kept as a line
+    MAX_LINE = 4096
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._thread = None
+        self._lock = threading.Lock()
+        # list of processes waiting to be registered by the reader thread
+        self._new_processes = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        # dict of process -> deque of its most recent lines
+        self._history = weakref.WeakKeyDictionary()
+        # dict of process -> bytes of its current unfinished line
+        self._partial = {}
+        # dict of process -> Event set once all of its output has been read
+        self._finished = weakref.WeakKeyDictionary()
+
+    def register(self, process):
+        """Start reading process's stdout."""
+        with self._lock:
+            self._history[process] = deque(maxlen=self.HISTORY_LINES)
+            self._finished[process] = threading.Event()
+            self._new_processes.append(process)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        os.write(self._wakeup_w, b'\0')
+
+    def last_lines(self, process):
+        """Return the most recent lines that process wrote."""
+        with self._lock:
+            history = list(self._history.get(process, []))
+        return [line.decode('utf-8', errors='replace') for line in history]
+
+    def wait_finished(self, process, timeout=None):
+        """Wait until all of process's output has been read.
+
+        Returns False if timeout expired first.
+        """
+        with self._lock:
+            finished = self._finished.get(process, None)
+        return finished is None or finished.wait(timeout)
+
+    def _run(self):
+        while True:
+            for key, events in self._selector.select():
+                if key.fd == self._wakeup_r:
+                    os.read(self._wakeup_r, self.READ_SIZE)
+                    with self._lock:
+                        new_processes, self._new_processes = self._new_processes, []
+                    for process in new_processes:
+                        self._partial[process] = b''
+                        self._selector.register(
+                            process.stdout, selectors.EVENT_READ, process)
+                else:
+                    self._read(key.data)
+
+    def _read(self, process):
+        data = os.read(process.stdout.fileno(), self.READ_SIZE)
+        if data:
+            lines = (self._partial[process] + data).split(b'\n')
+            partial = lines.pop()
+            while len(partial) > self.MAX_LINE:
+                lines.append(partial[:self.MAX_LINE])
+                partial = partial[self.MAX_LINE:]
+            self._partial[process] = partial
+        else:
+            # End of output.
+            lines = [self._partial.pop(process)]
+            self._selector.unregister(process.stdout)
+            process.stdout.close()
+        lines = [line.rstrip(b'\r') for line in lines if line.strip() != b'']
+        with self._lock:
+            history = self._history.get(process, None)
+            if history is not None:
+                history.extend(lines)
+            finished = self._finished.get(process, None)
+        if not data and finished is not None:
+            finished.set()
+        if lines and logging.getLogger().isEnabledFor(logging.DEBUG):
+            for line in lines:
+                # Reset terminal colors.
+                logging.debug(line.decode('utf-8', errors='replace') + '\033[0m')
+
+
+_log_multiplexer = LogMultiplexer()
+
+
 def log_output(process):
-    while process.poll() is None:
-        line = process.stdout.readline().decode('utf-8').rstrip()
-        if line != '':
-            # Reset terminal colors.
-            logging.debug(line + '\033[0m')
-    process.stdout.close()
+    """Send process's stdout to the debug log."""
+    _log_multiplexer.register(process)
+
+
+def last_output(process):
+    """Return the most recent lines of output from process."""
+    return _log_multiplexer.last_lines(process)
+
 
+def wait_for_output(process, timeout=None):
+    """Wait until all of process's output has been read, up to timeout."""
+    return _log_multiplexer.wait_finished(process, timeout)
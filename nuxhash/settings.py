@@ -2,13 +2,21 @@ import configparser
 import errno
 import json
 import os
+import threading
+import time
 from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
 
+from nuxhash.benchmarking import Benchmark, record
+
 
 DEFAULT_CONFIGDIR = Path(os.path.expanduser('~/.config/nuxhash'))
 SETTINGS_FILENAME = 'settings.conf'
 BENCHMARKS_FILENAME = 'benchmarks.json'
+JOURNAL_FILENAME = 'benchmarks.journal'
+SAMPLES_DIRNAME = 'samples'
+PAYRATES_FILENAME = 'payrates.jsonl'
 DEFAULT_SETTINGS = {
     'nicehash': {
         'wallet': '',
@@ -20,7 +28,22 @@ DEFAULT_SETTINGS = {
         },
     'switching': {
         'interval': 60,
-        'threshold': 0.1
+        'threshold': 0.1,
+        'method': 'naive',
+        'min_dwell': 300,
+        'window': 30,
+        'smoothing': 0.3,
+        'volatility_penalty': 1.0,
+        'record_payrates': False
+        },
+    'constraints': {
+        'power_cap': 0,
+        'device_watts': 150,
+        'algorithm_watts': '',
+        'max_devices_per_algorithm': 0,
+        'cpu_algorithms': 'cryptonightv7, cryptonightv8',
+        'cpu_budget': 0,
+        'grouping': 0.0
         },
     'gui': {
         'units': 'mBTC'
@@ -28,13 +51,34 @@ DEFAULT_SETTINGS = {
     'donate': {
         'optout': False
         },
+    'benchmarking': {
+        'secs': 60,
+        'adaptive': True,
+        'tolerance': 0.01,
+        'min_secs': 20,
+        'max_secs': 180,
+        'detect_warmup': True,
+        'warmup_window': 10,
+        'warmup_drift': 0.01,
+        'statistic': 'trimmed_mean',
+        'max_age_days': 90,
+        'background': False,
+        'sample_interval': 1.0,
+        'export_samples': False
+        },
     'excavator_miner': {
         'listen': '',
-        'args': ''
+        'args': '',
+        'speeds_ttl': 0.5,
+        'idle_algorithms': 2,
+        'idle_timeout': 300.0,
+        'shard_size': 0
         }
     }
 EMPTY_BENCHMARKS = defaultdict(lambda: {})
 
+_journal_lock = threading.Lock()
+
 
 def read_settings_from_file(fd):
     parser = configparser.ConfigParser()
@@ -50,7 +94,22 @@ def read_settings_from_file(fd):
             },
         'switching': {
             'interval': parser.getint,
-            'threshold': parser.getfloat
+            'threshold': parser.getfloat,
+            'method': parser.get,
+            'min_dwell': parser.getint,
+            'window': parser.getint,
+            'smoothing': parser.getfloat,
+            'volatility_penalty': parser.getfloat,
+            'record_payrates': parser.getboolean
+            },
+        'constraints': {
+            'power_cap': parser.getint,
+            'device_watts': parser.getint,
+            'algorithm_watts': parser.get,
+            'max_devices_per_algorithm': parser.getint,
+            'cpu_algorithms': parser.get,
+            'cpu_budget': parser.getint,
+            'grouping': parser.getfloat
             },
         'gui': {
             'units': parser.get
@@ -58,9 +117,28 @@ def read_settings_from_file(fd):
         'donate': {
             'optout': parser.getboolean
             },
+        'benchmarking': {
+            'secs': parser.getint,
+            'adaptive': parser.getboolean,
+            'tolerance': parser.getfloat,
+            'min_secs': parser.getint,
+            'max_secs': parser.getint,
+            'detect_warmup': parser.getboolean,
+            'warmup_window': parser.getint,
+            'warmup_drift': parser.getfloat,
+            'statistic': parser.get,
+            'max_age_days': parser.getint,
+            'background': parser.getboolean,
+            'sample_interval': parser.getfloat,
+            'export_samples': parser.getboolean
+            },
         'excavator_miner': {
             'listen': parser.get,
-            'args': parser.get
+            'args': parser.get,
+            'speeds_ttl': parser.getfloat,
+            'idle_algorithms': parser.getint,
+            'idle_timeout': parser.getfloat,
+            'shard_size': parser.getint
             }
         }
     def read_options(data, *sections):
@@ -100,10 +178,14 @@ def read_benchmarks_from_file(fd, devices):
             continue
         js_speeds = js[js_device]
         for algorithm_name in js_speeds:
-            if isinstance(js_speeds[algorithm_name], list):
-                benchmarks[device][algorithm_name] = js_speeds[algorithm_name]
+            js_benchmark = js_speeds[algorithm_name]
+            if isinstance(js_benchmark, dict):
+                benchmarks[device][algorithm_name] = Benchmark.from_json(
+                    js_benchmark)
+            elif isinstance(js_benchmark, list):
+                benchmarks[device][algorithm_name] = js_benchmark
             else:
-                benchmarks[device][algorithm_name] = [js_speeds[algorithm_name]]
+                benchmarks[device][algorithm_name] = [js_benchmark]
     return benchmarks
 
 
@@ -113,7 +195,11 @@ def write_benchmarks_to_file(fd, benchmarks):
         to_file[str(device)] = {}
         speeds = benchmarks[device]
         for algorithm_name in speeds:
-            if len(speeds[algorithm_name]) == 1:
+            details = getattr(speeds[algorithm_name], 'details', {})
+            if len(details) > 0:
+                to_file[str(device)][algorithm_name] = \
+                        speeds[algorithm_name].to_json()
+            elif len(speeds[algorithm_name]) == 1:
                 to_file[str(device)][algorithm_name] = speeds[algorithm_name][0]
             else:
                 to_file[str(device)][algorithm_name] = speeds[algorithm_name]
@@ -139,21 +225,128 @@ def load_benchmarks(config_dir, devices):
     except IOError as err:
         if err.errno != errno.ENOENT:
             raise
-        return EMPTY_BENCHMARKS
-    else:
-        return benchmarks
+        benchmarks = defaultdict(lambda: {})
+    # Recover benchmarks finished after the last save.
+    for device, algorithm_name, benchmark in read_journal(config_dir, devices):
+        # Skip entries saved just before a crash removed the journal.
+        old = benchmarks[device].get(algorithm_name, None)
+        if (benchmark.timestamp is None
+                or getattr(old, 'timestamp', None) != benchmark.timestamp):
+            record(benchmarks[device], algorithm_name, benchmark)
+    return benchmarks
+
+
+def journal_benchmark(config_dir, device, algorithm_name, benchmark):
+    """Durably append a finished benchmark to the journal.
+
+    The journal keeps benchmarks taken since the last save_benchmarks(), so
+    that a crash does not lose them; load_benchmarks() merges it back in.
+    """
+    if not isinstance(benchmark, Benchmark):
+        benchmark = Benchmark(benchmark)
+    line = json.dumps({'device': str(device),
+                       'algorithm': algorithm_name,
+                       'benchmark': benchmark.to_json()})
+    _mkdir(config_dir)
+    with _journal_lock:
+        with open(config_dir/JOURNAL_FILENAME, 'a') as journal_fd:
+            journal_fd.write(line + '\n')
+            journal_fd.flush()
+            os.fsync(journal_fd.fileno())
+
+
+def read_journal(config_dir, devices):
+    """Return list of (device, algorithm name, Benchmark) in the journal."""
+    entries = []
+    try:
+        with open(config_dir/JOURNAL_FILENAME, 'r') as journal_fd:
+            for line in journal_fd:
+                try:
+                    js = json.loads(line)
+                except ValueError:
+                    # Torn write from a crash.
+                    continue
+                device = next((device for device in devices
+                               if str(device) == js['device']), None)
+                if device is not None:
+                    entries.append((device, js['algorithm'],
+                                    Benchmark.from_json(js['benchmark'])))
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return entries
+
+
+def append_payrates(config_dir, timestamp, payrates):
+    """Add a snapshot of NiceHash's payrates to the payrate log.
+
+    The log is replayed by nuxhash-backtest.
+    """
+    line = json.dumps({'time': timestamp, 'payrates': payrates})
+    _mkdir(config_dir)
+    with open(config_dir/PAYRATES_FILENAME, 'a') as payrates_fd:
+        payrates_fd.write(line + '\n')
+
+
+def read_payrates(fd):
+    """Return list of (Unix time, dict of sub-algorithm -> payrate), in order."""
+    records = []
+    for line in fd:
+        try:
+            js = json.loads(line)
+        except ValueError:
+            # Torn write from a crash.
+            continue
+        records.append((js['time'], js['payrates']))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def save_samples(config_dir, device, algorithm_name, series):
+    """Write the samples taken by a benchmark to their own CSV file.
+
+    Returns the path written, which is unique to the device, algorithm and
+    time of writing.
+    """
+    samples_dir = config_dir/SAMPLES_DIRNAME/str(device)
+    _mkdir(samples_dir)
+    path = samples_dir/f'{algorithm_name}-{int(time.time())}.csv'
+    with _open_atomic(path) as samples_fd:
+        series.write_csv(samples_fd)
+    return path
 
 
 def save_settings(config_dir, settings):
     _mkdir(config_dir)
-    with open(config_dir/SETTINGS_FILENAME, 'w') as settings_fd:
+    with _open_atomic(config_dir/SETTINGS_FILENAME) as settings_fd:
         write_settings_to_file(settings_fd, settings)
 
 
 def save_benchmarks(config_dir, benchmarks):
     _mkdir(config_dir)
-    with open(config_dir/BENCHMARKS_FILENAME, 'w') as benchmarks_fd:
-        write_benchmarks_to_file(benchmarks_fd, benchmarks)
+    with _journal_lock:
+        with _open_atomic(config_dir/BENCHMARKS_FILENAME) as benchmarks_fd:
+            write_benchmarks_to_file(benchmarks_fd, benchmarks)
+        # Everything in the journal is in the saved file now.
+        try:
+            os.remove(config_dir/JOURNAL_FILENAME)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def _open_atomic(path):
+    """Write a file so that it is either entirely old or entirely new."""
+    temp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(temp_path, 'w') as fd:
+            yield fd
+            fd.flush()
+            os.fsync(fd.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
 
 
 def _mkdir(d):
@@ -0,0 +1,21 @@
+from nuxhash.switching.forecast import ForecastSwitcher
+from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.switching.optimizer import OptimizingSwitcher
+from nuxhash.switching.switchcost import SwitchCostSwitcher
+
+
+# dict of switching.method setting -> ProfitSwitcher
+all_switchers = {
+    'naive': NaiveSwitcher,
+    'switchcost': SwitchCostSwitcher,
+    'forecast': ForecastSwitcher,
+    'optimizer': OptimizingSwitcher
+    }
+
+
+def make_switcher(settings, benchmarks={}):
+    """Create the profit switcher selected by switching.method."""
+    method = settings['switching']['method']
+    if method not in all_switchers:
+        raise ValueError(f'unknown switching method {method}')
+    return all_switchers[method](settings, benchmarks=benchmarks)
@@ -0,0 +1,104 @@
+import math
+from array import array
+
+from nuxhash.switching.naive import NaiveSwitcher
+
+
+class RingBuffer(object):
+    """The latest values of a series, up to a fixed number, in a flat array.
+
+    Appending is O(1): the oldest value is overwritten in place. The sum and
+    sum of squares of the values held are kept up to date as well, so the
+    mean and spread of the window are O(1) too.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._values = array('d', [0.0])*capacity
+        # index of the oldest value
+        self._start = 0
+        self._length = 0
+        self._sum = self._sum_squares = 0.0
+        self._appends = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self._values[(self._start + i) % self.capacity]
+
+    def append(self, value):
+        if self._length < self.capacity:
+            self._values[(self._start + self._length) % self.capacity] = value
+            self._length += 1
+        else:
+            old = self._values[self._start]
+            self._sum -= old
+            self._sum_squares -= old*old
+            self._values[self._start] = value
+            self._start = (self._start + 1) % self.capacity
+        self._sum += value
+        self._sum_squares += value*value
+        self._appends += 1
+        if self._appends % self.capacity == 0:
+            # Wipe out rounding errors from the running sums.
+            self._sum = math.fsum(self)
+            self._sum_squares = math.fsum(v*v for v in self)
+
+    def mean(self):
+        return self._sum/self._length if self._length > 0 else 0.0
+
+    def stddev(self):
+        """Population standard deviation of the values held."""
+        if self._length < 2:
+            return 0.0
+        mean = self.mean()
+        return math.sqrt(max(0.0, self._sum_squares/self._length - mean*mean))
+
+
+class ForecastSwitcher(NaiveSwitcher):
+    """Switch on smoothed revenues, discounted for how erratic they are.
+
+    A price spike that lasts one interval does not move devices around: each
+    device's revenue for each algorithm is scored by its exponentially
+    weighted moving average (weight switching.smoothing on the newest value),
+    less switching.volatility_penalty times its standard deviation over the
+    last switching.window intervals. Scores then go through the same
+    threshold rule as NaiveSwitcher.
+    """
+
+    def __init__(self, settings, **kwargs):
+        super(ForecastSwitcher, self).__init__(settings, **kwargs)
+        # dict of device -> algorithm -> (RingBuffer, moving average)
+        self._history = {}
+
+    def reset(self):
+        super(ForecastSwitcher, self).reset()
+        self._history = {}
+
+    def score(self, btc_per_day_per_device):
+        """Turn dict of device -> algorithm -> revenue into scores, alike."""
+        options = self.settings['switching']
+        weight = options['smoothing']
+        penalty = options['volatility_penalty']
+        window = options['window']
+        scores = {}
+        for device, revenues in btc_per_day_per_device.items():
+            history = self._history.setdefault(device, {})
+            device_scores = scores[device] = {}
+            for algorithm, revenue in revenues.items():
+                if algorithm in history:
+                    buffer, average = history[algorithm]
+                    average += weight*(revenue - average)
+                else:
+                    buffer, average = RingBuffer(window), revenue
+                buffer.append(revenue)
+                history[algorithm] = (buffer, average)
+                device_scores[algorithm] = max(
+                    0.0, average - penalty*buffer.stddev())
+        return scores
+
+    def decide(self, btc_per_day_per_device, timestamp):
+        return super(ForecastSwitcher, self).decide(
+            self.score(btc_per_day_per_device), timestamp)
@@ -15,7 +15,7 @@ class NaiveSwitcher(ProfitSwitcher):
         decision = {}
         for device, revenues in btc_per_day_per_device.items():
             switch_algo, switch_revenue = max(revenues.items(), key=lambda p: p[1])
-            stay_algo = self.last_decision[device]
+            stay_algo = self.last_decision.get(device, None)
 
             if stay_algo is None:
                 logging.info(f'Assigning {device} to {switch_algo.name} '
@@ -0,0 +1,144 @@
+import logging
+from collections import Counter
+
+from nuxhash.switching.switcher import ProfitSwitcher
+
+
+class OptimizingSwitcher(ProfitSwitcher):
+    """Assign devices to algorithms for the whole rig at once, under limits.
+
+    The limits, in the constraints settings, are:
+
+    power_cap -- most watts the rig may draw, or 0 for no limit; devices draw
+                 device_watts, or their algorithm's entry in algorithm_watts
+                 (e.g. "daggerhashimoto:180, equihash:140")
+    max_devices_per_algorithm -- or 0 for no limit
+    cpu_budget -- most devices that may run cpu_algorithms, whose shares are
+                  expensive for the host CPU to verify, or 0 for no limit
+    grouping -- fraction of a device's revenue worth giving up to run an
+                algorithm another device already runs, so that fewer
+                algorithms stay subscribed
+
+    Algorithms are named by their sub-algorithms, e.g. daggerhashimoto_pascal,
+    in any case.
+
+    Candidates are assigned greedily, best revenue first, skipping any that
+    would break a limit; devices left without a feasible algorithm stay idle.
+    A repair pass then moves devices off algorithms that only they run, where
+    grouping allows. Revenue from a device's current algorithm is counted
+    1 + switching.threshold times, so devices do not switch for small gains.
+    """
+
+    def __init__(self, settings, **kwargs):
+        super(OptimizingSwitcher, self).__init__(settings, **kwargs)
+        # dict of device -> algorithm
+        self.last_decision = {}
+
+    def reset(self):
+        self.last_decision = {}
+
+    def decide(self, btc_per_day_per_device, timestamp):
+        limits = self.settings['constraints']
+        stay_factor = 1.0 + self.settings['switching']['threshold']
+        watts = _parse_watts(limits['algorithm_watts'])
+        cpu_algorithms = set(name.strip().lower() for name
+                             in limits['cpu_algorithms'].split(',')
+                             if name.strip() != '')
+        def power(algorithm):
+            name = '_'.join(algorithm.algorithms)
+            return watts.get(name, watts.get(algorithm.algorithms[0],
+                                             limits['device_watts']))
+        def cpu_heavy(algorithm):
+            return any(sub_algo in cpu_algorithms
+                       for sub_algo in algorithm.algorithms)
+
+        # list of (value, device name, device, algorithm), best first
+        candidates = []
+        for device, revenues in btc_per_day_per_device.items():
+            stay_algo = self.last_decision.get(device, None)
+            for algorithm, revenue in revenues.items():
+                if revenue <= 0.0:
+                    continue
+                value = revenue*stay_factor if algorithm == stay_algo else revenue
+                candidates.append((value, str(device), device, algorithm))
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+
+        decision = {}
+        values = {}
+        counts = Counter()
+        state = {'watts': 0.0, 'cpu': 0}
+        def fits(algorithm, old=None):
+            """Check if a device can move from old to algorithm."""
+            if algorithm == old:
+                return True
+            if (limits['max_devices_per_algorithm'] > 0
+                    and counts[algorithm] >= limits['max_devices_per_algorithm']):
+                return False
+            cpu = state['cpu'] + cpu_heavy(algorithm) - (
+                cpu_heavy(old) if old is not None else 0)
+            if limits['cpu_budget'] > 0 and cpu > limits['cpu_budget']:
+                return False
+            power_draw = state['watts'] + power(algorithm) - (
+                power(old) if old is not None else 0.0)
+            if limits['power_cap'] > 0 and power_draw > limits['power_cap']:
+                return False
+            return True
+        def assign(device, algorithm, value):
+            old = decision.get(device, None)
+            if old is not None:
+                counts[old] -= 1
+                state['cpu'] -= cpu_heavy(old)
+                state['watts'] -= power(old)
+            decision[device] = algorithm
+            values[device] = value
+            counts[algorithm] += 1
+            state['cpu'] += cpu_heavy(algorithm)
+            state['watts'] += power(algorithm)
+
+        for value, _, device, algorithm in candidates:
+            if device not in decision and fits(algorithm):
+                assign(device, algorithm, value)
+
+        # Fold devices running an algorithm on their own into shared ones.
+        grouping = limits['grouping']
+        if grouping > 0.0:
+            lonely = sorted([device for device, algorithm in decision.items()
+                             if counts[algorithm] == 1],
+                            key=lambda device: values[device])
+            for device in lonely:
+                if counts[decision[device]] != 1:
+                    continue
+                revenues = btc_per_day_per_device[device]
+                shared = [(revenues[algorithm], algorithm)
+                          for algorithm in revenues
+                          if counts[algorithm] > 0
+                          and algorithm != decision[device]
+                          and fits(algorithm, old=decision[device])]
+                if len(shared) == 0:
+                    continue
+                revenue, algorithm = max(shared, key=lambda s: s[0])
+                if revenue >= (1.0 - grouping)*values[device]:
+                    assign(device, algorithm, revenue)
+
+        for device, algorithm in decision.items():
+            old = self.last_decision.get(device, None)
+            if old is None:
+                logging.info(f'Assigning {device} to {algorithm.name} '
+                             + f'({btc_per_day_per_device[device][algorithm]:.3f}'
+                             + ' mBTC/day)')
+            elif old != algorithm:
+                logging.info(f'Switching {device} from {old.name} '
+                             + f'to {algorithm.name}')
+        self.last_decision = decision
+        return decision
+
+
+def _parse_watts(text):
+    """Read "algorithm:watts, ..." into a dict of algorithm -> watts."""
+    watts = {}
+    for entry in text.split(','):
+        if entry.strip() == '':
+            continue
+        name, value = entry.split(':')
+        watts[name.strip().lower()] = float(value)
+    return watts
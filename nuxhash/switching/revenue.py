@@ -0,0 +1,77 @@
+from operator import itemgetter, mul
+
+
+class RevenueMatrix(object):
+    """Revenue of every algorithm on every device, for any payrates.
+
+    Speeds are laid out once, when mining starts: one flat row per device,
+    holding the speed of each algorithm's sub-algorithms in turn. Payrates are
+    gathered into a matching row once per interval, so each device's revenues
+    come from a single element-wise product, with no name lookups.
+    """
+
+    def __init__(self, devices, algorithms, benchmarks):
+        """
+        benchmarks -- dict of device -> algorithm name -> speeds
+        """
+        self.devices = list(devices)
+        self.algorithms = list(algorithms)
+        # dict of sub-algorithm name -> column in the payrate vector
+        self.columns = {}
+        # payrate vector column for each entry in a speed row
+        self._row_columns = []
+        # dict of algorithm -> position of its first entry in a speed row
+        self._starts = {}
+        # list of (first, other) positions of multi-algorithm entries
+        self._extra = []
+        for algorithm in self.algorithms:
+            self._starts[algorithm] = start = len(self._row_columns)
+            for i, sub_algo in enumerate(algorithm.algorithms):
+                column = self.columns.setdefault(sub_algo, len(self.columns))
+                self._row_columns.append(column)
+                if i > 0:
+                    self._extra.append((start, start + i))
+        starts = list(self._starts.values())
+        if len(starts) > 1:
+            self._first = itemgetter(*starts)
+        else:
+            # itemgetter() returns a bare item, not a tuple, for one index.
+            self._first = lambda products: [products[i] for i in starts]
+        # dict of device -> row of speeds
+        self._speeds = {device: [0.0]*len(self._row_columns)
+                        for device in self.devices}
+        for device in self.devices:
+            device_benchmarks = benchmarks.get(device, {})
+            for algorithm in self.algorithms:
+                if algorithm.name in device_benchmarks:
+                    self.set_speeds(device, algorithm,
+                                    device_benchmarks[algorithm.name])
+
+    def set_speeds(self, device, algorithm, speeds):
+        """Update the speeds of algorithm on device, e.g. after a benchmark."""
+        n = len(algorithm.algorithms)
+        speeds = list(speeds)[:n] + [0.0]*(n - len(speeds))
+        start = self._starts[algorithm]
+        self._speeds[device][start:start + n] = speeds
+
+    def payrate_vector(self, payrates):
+        """Turn dict of sub-algorithm -> payrate into a list by column."""
+        vector = [0.0]*len(self.columns)
+        for sub_algo, column in self.columns.items():
+            vector[column] = payrates.get(sub_algo, 0.0)
+        return vector
+
+    def revenues(self, payrates):
+        """Return dict of device -> algorithm -> BTC/day.
+
+        payrates -- dict of sub-algorithm name -> BTC/day per hash/second
+        """
+        vector = self.payrate_vector(payrates)
+        row_payrates = [vector[column] for column in self._row_columns]
+        revenues = {}
+        for device, speeds in self._speeds.items():
+            products = list(map(mul, speeds, row_payrates))
+            for first, other in self._extra:
+                products[first] += products[other]
+            revenues[device] = dict(zip(self.algorithms, self._first(products)))
+        return revenues
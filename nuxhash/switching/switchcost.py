@@ -0,0 +1,120 @@
+import logging
+import time
+from datetime import datetime
+
+from nuxhash.switching.switcher import ProfitSwitcher
+
+
+# weight of the newest observation in the running start latencies
+LATENCY_WEIGHT = 0.3
+
+
+class SwitchCostSwitcher(ProfitSwitcher):
+    """Switch only when it pays for the hashing time lost to the switch.
+
+    Switching a device costs the time for the miner to start the algorithm
+    plus its warmup, during which the device earns (almost) nothing. Warmups
+    come from the device's benchmarks where measured, and from the
+    algorithm's warmup_secs otherwise; start times are learned from the
+    switches carried out. A device stays on an algorithm for at least
+    switching.min_dwell seconds, so each switch is judged over that long (or
+    one interval, if longer): it has to earn more, net of downtime, than
+    staying put, by a factor of at least 1 + switching.threshold.
+    """
+
+    def __init__(self, settings, **kwargs):
+        super(SwitchCostSwitcher, self).__init__(settings, **kwargs)
+        self.reset()
+
+    def reset(self):
+        # dict of device -> algorithm
+        self.last_decision = {}
+        # dict of device -> time it started on its algorithm
+        self._since = {}
+        # dict of algorithm -> running average of seconds to start it
+        self._latencies = {}
+        # dict of device -> algorithm it was just switched to
+        self._switching = {}
+
+    def switch_cost(self, device, algorithm):
+        """Estimate seconds device spends not hashing when moved to algorithm."""
+        benchmark = self.benchmarks.get(device, {}).get(algorithm.name, None)
+        warmup = getattr(benchmark, 'warmup', None)
+        if warmup is None:
+            warmup = algorithm.warmup_secs
+        return self._latencies.get(algorithm, 0.0) + warmup
+
+    def decide(self, btc_per_day_per_device, timestamp):
+        now = _seconds(timestamp)
+        options = self.settings['switching']
+        horizon = max(options['interval'], options['min_dwell'])
+        min_factor = 1.0 + options['threshold']
+        def net(device, algorithm, revenue):
+            downtime = min(horizon, self.switch_cost(device, algorithm))
+            return revenue*(horizon - downtime)/horizon
+
+        decision = {}
+        self._switching = {}
+        for device, revenues in btc_per_day_per_device.items():
+            stay_algo = self.last_decision.get(device, None)
+            if stay_algo not in revenues:
+                stay_algo = None
+            switch_algo, switch_net = max(
+                [(algorithm, net(device, algorithm, revenue))
+                 for algorithm, revenue in revenues.items()
+                 if algorithm != stay_algo],
+                key=lambda p: p[1], default=(None, 0.0))
+
+            if stay_algo is None:
+                if switch_algo is None:
+                    continue
+                logging.info(f'Assigning {device} to {switch_algo.name} '
+                             + f'({revenues[switch_algo]:.3f} mBTC/day)')
+                decision[device] = switch_algo
+            elif switch_algo is None:
+                decision[device] = stay_algo
+            elif now - self._since[device] < options['min_dwell']:
+                decision[device] = stay_algo
+            else:
+                stay_revenue = revenues[stay_algo]
+                if stay_revenue == 0.0:
+                    should_switch = switch_net > 0.0
+                else:
+                    should_switch = switch_net/stay_revenue >= min_factor
+                if should_switch:
+                    logging.info(
+                        f'Switching {device} from {stay_algo.name} to '
+                        + f'{switch_algo.name} ({stay_revenue:.3f} -> '
+                        + f'{revenues[switch_algo]:.3f} mBTC/day, '
+                        + f'{self.switch_cost(device, switch_algo):.0f} s '
+                        + 'to switch)')
+                    decision[device] = switch_algo
+                else:
+                    decision[device] = stay_algo
+
+            if decision[device] != self.last_decision.get(device, None):
+                self._since[device] = now
+                self._switching[device] = decision[device]
+        self.last_decision = decision
+        return decision
+
+    def switched(self, started):
+        for device, secs in started.items():
+            algorithm = self._switching.get(device, None)
+            if algorithm is None:
+                continue
+            old = self._latencies.get(algorithm, None)
+            if old is None:
+                self._latencies[algorithm] = secs
+            else:
+                self._latencies[algorithm] = (LATENCY_WEIGHT*secs
+                                              + (1.0 - LATENCY_WEIGHT)*old)
+
+
+def _seconds(timestamp):
+    if timestamp is None:
+        return time.time()
+    elif isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    else:
+        return timestamp
@@ -1,8 +1,10 @@
 class ProfitSwitcher(object):
 
-    def __init__(self, settings):
+    def __init__(self, settings, benchmarks={}):
         # current state of settings
         self.settings = settings
+        # dict of device -> algorithm name -> speeds
+        self.benchmarks = benchmarks
 
     def reset(self):
         """(Re)initialize the profit-switching logic if necessary."""
@@ -14,3 +16,8 @@ class ProfitSwitcher(object):
         Return dict of device -> algorithm."""
         pass
 
+    def switched(self, started):
+        """Read dict of device -> seconds until its new algorithm started.
+
+        Called after each decision is carried out."""
+        pass
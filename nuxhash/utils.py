@@ -1,7 +1,10 @@
 import socket
+from collections import deque
 from contextlib import contextmanager
 from threading import Event
-from time import sleep
+from time import monotonic, sleep, time
+
+from nuxhash.benchmarking import is_steady, RunningStats, summarize
 
 
 def format_speed(s):
@@ -49,7 +52,10 @@ def format_balance(v, unit):
 
 def run_benchmark(
         algorithm, device, warmup_duration, sample_duration,
-        sample_callback=lambda sample, secs_remaining: None, abort_signal=Event()):
+        sample_callback=lambda sample, secs_remaining: None, abort_signal=Event(),
+        tolerance=None, max_duration=None, warmup_window=None,
+        warmup_drift=None, statistic='trimmed_mean', sample_interval=1,
+        series=None):
     """Run algorithm on device for duration seconds and report the average speed.
 
     Keyword arguments:
@@ -57,11 +63,36 @@ def run_benchmark(
                        secs_remaining < 0 indicates warmup period
     abort_signal -- signal to abort the benchmarking early;
                     will return average of already taken samples
+    tolerance -- if set, sample for at least sample_duration and then stop as
+                 soon as the 95% confidence interval of the average is within
+                 this fraction of it, or when max_duration is reached
+    max_duration -- upper bound on sampling time when tolerance is set
+    warmup_window -- if set, end warmup early once the last warmup_window
+                     seconds of samples are steady; warmup_duration is then
+                     only an upper bound
+    warmup_drift -- largest drift over the window, as a fraction of the
+                    average speed, that still counts as steady
+    statistic -- how to average the samples, see benchmarking.summarize()
+    sample_interval -- seconds between samples, may be fractional
+    series -- if set, a benchmarking.SampleSeries that every sample, warmup
+              included, is added to
+
+    Returns a Benchmark with the spread and error of the average, the time
+    spent warming up, and the miner and driver versions.
     """
-    SAMPLE_INTERVAL = 1
     BLANK = [0.0]*len(algorithm.algorithms)
     assert algorithm.accepts(device)
 
+    def n_samples(duration):
+        return round(duration/sample_interval)
+
+    # Wait against a fixed schedule, so slow speed queries do not stretch
+    # the interval.
+    schedule = [monotonic()]
+    def wait():
+        schedule[0] += sample_interval
+        abort_signal.wait(max(0.0, schedule[0] - monotonic()))
+
     @contextmanager
     def acquire(algorithm):
         algorithm.benchmarking = True
@@ -71,36 +102,59 @@ def run_benchmark(
         algorithm.benchmarking = False
     with acquire(algorithm) as running_algo:
         # Run warmup period.
+        if warmup_window is not None:
+            window = deque(maxlen=max(2, n_samples(warmup_window)))
+        schedule[0] = monotonic()
         i = 0
-        while i < warmup_duration//SAMPLE_INTERVAL and not abort_signal.is_set():
+        while i < n_samples(warmup_duration) and not abort_signal.is_set():
             if not running_algo.parent.is_running():
                 return BLANK
             sample = running_algo.current_speeds()
-            sample_callback(sample, i*SAMPLE_INTERVAL - warmup_duration)
-            abort_signal.wait(SAMPLE_INTERVAL)
+            if series is not None:
+                series.add(sample, warmup=True)
+            sample_callback(sample, i*sample_interval - warmup_duration)
             i += 1
+            if warmup_window is not None:
+                window.append(sample)
+                if (len(window) == window.maxlen
+                        and is_steady(window, warmup_drift)):
+                    break
+            wait()
+        warmup_secs = i*sample_interval
 
         # Perform actual sampling.
+        if tolerance is None:
+            total_duration = sample_duration
+        else:
+            total_duration = max(sample_duration, max_duration)
         samples = []
+        stats = RunningStats(len(algorithm.algorithms))
         i = 0
-        while i < sample_duration//SAMPLE_INTERVAL and not abort_signal.is_set():
+        while i < n_samples(total_duration) and not abort_signal.is_set():
             if not running_algo.parent.is_running():
                 return BLANK
             sample = running_algo.current_speeds()
+            if series is not None:
+                series.add(sample)
             samples.append(sample)
-            sample_callback(sample, sample_duration - i*SAMPLE_INTERVAL)
-            abort_signal.wait(SAMPLE_INTERVAL)
+            stats.add(sample)
+            sample_callback(sample, total_duration - i*sample_interval)
             i += 1
+            if (tolerance is not None
+                    and i >= n_samples(sample_duration)
+                    and stats.relative_error() <= tolerance):
+                break
+            wait()
+
+    if len(samples) == 0:
+        return BLANK
+    benchmark = summarize(samples, statistic)
+    benchmark.warmup = warmup_secs
+    benchmark.timestamp = int(time())
+    benchmark.miner_version = algorithm.parent.version
+    benchmark.driver_version = getattr(device, 'driver_version', None)
+    return benchmark
 
-    # Return average of all samples.
-    def sum_list_elements(lists):
-        sums = lists[0]
-        for l in lists[1:]:
-            for i, e in enumerate(l):
-                sums[i] += e
-        return sums
-    return (list(map(lambda total: total/len(samples), sum_list_elements(samples)))
-            if len(samples) > 0 else BLANK)
 
 def get_port():
     with socket.socket() as s:
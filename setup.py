@@ -134,7 +134,8 @@ setup(
     #
     #   py_modules=["my_module"],
     #
-    packages=find_packages(exclude=['contrib', 'docs', 'tests']) + [
+    packages=find_packages(exclude=['contrib', 'docs', 'tests', 'benchmarks',
+                                    'benchmarks.*']) + [
         'nuxhash/nhrest/python'
     ],  # Required
 
@@ -185,7 +186,8 @@ setup(
     entry_points={  # Optional
         'console_scripts': [
             'nuxhashd=nuxhash:nuxhashd',
-            'nuxhash-gui=nuxhash:nuxhash_gui'
+            'nuxhash-gui=nuxhash:nuxhash_gui',
+            'nuxhash-backtest=nuxhash:nuxhash_backtest'
         ],
     },
 
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Stand-in for NiceHash's excavator miner, for tests without a GPU.
+
+Implements the parts of excavator's JSON-RPC API that nuxhash uses: subscribe,
+unsubscribe, algorithm.add/remove/list, worker.add/free/list, device.list, info
+and quit. Unlike excavator's, info also reports the current subscription, so
+tests can check it from outside the process. FakeExcavator serves it from a
+background thread; run this file as a script to stand in for the excavator
+executable itself:
+
+    fake_excavator.py -i 127.0.0.1 -p 3456 --devices 8 --delay 0.001
+"""
+import argparse
+import itertools
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import Counter
+
+
+DEFAULT_SPEED = 1e6
+VERSION = '1.5.14a-fake'
+
+
+def fake_devices(n):
+    """Return (pci bus, uuid, name) for the n devices a FakeExcavator makes up."""
+    return [(i + 1, f'GPU-fake{i:04d}', 'Fake GPU') for i in range(n)]
+
+
+class FakeExcavator(object):
+
+    def __init__(self, devices=1, speeds={}, delay=0.0, address=('127.0.0.1', 0)):
+        """
+        devices -- number of devices to make up, or a list of (pci bus, uuid,
+                   name) or of objects with pci_bus, uuid and name attributes
+        speeds -- dict of algorithm name -> reported speed
+        delay -- seconds to wait before answering each command
+        address -- (ip, port) to listen on
+        """
+        if isinstance(devices, int):
+            devices = fake_devices(devices)
+        else:
+            devices = [d if isinstance(d, tuple) else (d.pci_bus, d.uuid, d.name)
+                       for d in devices]
+        self.devices = [{'device_id': i,
+                         'name': name,
+                         'gpgpu_type': 1,
+                         'details': {'bus_id': pci_bus, 'uuid': uuid}}
+                        for i, (pci_bus, uuid, name) in enumerate(devices)]
+        self.speeds = dict(speeds)
+        self.delay = delay
+        # (stratum, login) or None
+        self.subscription = None
+        # list of algorithm names, in the order they were added
+        self.algorithms = []
+        # dict of worker id -> (algorithm name, device id)
+        self.workers = {}
+        # count of commands received, by method
+        self.commands = Counter()
+        # set when a quit command is received
+        self.quit = threading.Event()
+        self._lock = threading.Lock()
+        self._worker_ids = itertools.count()
+        self._server = _Server(address, _Handler)
+        self._server.fake = self
+        self._methods = {
+            'info': self._info,
+            'quit': self._info,
+            'subscribe': self._subscribe,
+            'unsubscribe': self._unsubscribe,
+            'device.list': self._device_list,
+            'algorithm.add': self._algorithm_add,
+            'algorithm.remove': self._algorithm_remove,
+            'algorithm.list': self._algorithm_list,
+            'worker.add': self._worker_add,
+            'worker.free': self._worker_free,
+            'worker.list': self._worker_list
+            }
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def execute(self, command):
+        """Run a decoded command and return the response to send back."""
+        method = command['method']
+        response = {'id': command.get('id', None), 'error': None}
+        with self._lock:
+            self.commands[method] += 1
+            if method not in self._methods:
+                response['error'] = 'Method not found'
+                return response
+            try:
+                response.update(self._methods[method](*command['params']))
+            except (KeyError, ValueError, TypeError) as err:
+                response['error'] = str(err)
+        return response
+
+    def _info(self):
+        return {'version': VERSION, 'api_version': '0.1.8',
+                'subscription': self.subscription}
+
+    def _subscribe(self, stratum, login):
+        self.subscription = (stratum, login)
+        return {}
+
+    def _unsubscribe(self):
+        self.subscription = None
+        return {}
+
+    def _device_list(self):
+        return {'devices': self.devices}
+
+    def _algorithm_add(self, algorithm):
+        if algorithm in self.algorithms:
+            raise ValueError('Algorithm already added')
+        self.algorithms.append(algorithm)
+        return {'algorithm_id': self.algorithms.index(algorithm)}
+
+    def _algorithm_remove(self, algorithm):
+        if algorithm not in self.algorithms:
+            raise ValueError('Algorithm not found')
+        self.algorithms.remove(algorithm)
+        return {}
+
+    def _algorithm_list(self):
+        return {'algorithms': [{'algorithm_id': i, 'name': name}
+                               for i, name in enumerate(self.algorithms)]}
+
+    def _worker_add(self, algorithm, device_id):
+        device_id = int(device_id)
+        if device_id not in range(len(self.devices)):
+            raise ValueError('Device not found')
+        prefix, names = _split_algorithm(algorithm)
+        if any(prefix + name not in self.algorithms for name in names):
+            raise ValueError('Algorithm not found')
+        worker_id = next(self._worker_ids)
+        self.workers[worker_id] = (algorithm, device_id)
+        return {'worker_id': worker_id}
+
+    def _worker_free(self, worker_id):
+        self.workers.pop(int(worker_id))
+        return {}
+
+    def _worker_list(self):
+        workers = []
+        for worker_id, (algorithm, device_id) in sorted(self.workers.items()):
+            prefix, names = _split_algorithm(algorithm)
+            workers.append({
+                'worker_id': worker_id,
+                'device_id': device_id,
+                'device_uuid': self.devices[device_id]['details']['uuid'],
+                'algorithms': [{'id': self.algorithms.index(prefix + name),
+                                'name': name,
+                                'speed': self.speeds.get(name, DEFAULT_SPEED)}
+                               for name in names]
+                })
+        return {'workers': workers}
+
+
+class _Server(socketserver.ThreadingTCPServer):
+
+    # A restarted excavator binds to the same port as its crashed predecessor.
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    # Answers to pipelined commands go out one write at a time.
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        fake = self.server.fake
+        for line in self.rfile:
+            command = json.loads(line)
+            if fake.delay > 0:
+                time.sleep(fake.delay)
+            response = fake.execute(command)
+            self.wfile.write((json.dumps(response) + '\n').encode('ascii'))
+            if command['method'] == 'quit':
+                fake.quit.set()
+                return
+
+
+def _split_algorithm(algorithm):
+    prefix = 'benchmark-' if algorithm.startswith('benchmark-') else ''
+    return prefix, algorithm[len(prefix):].split('_')
+
+
+def main():
+    argp = argparse.ArgumentParser(description='Pretend to be excavator.')
+    argp.add_argument('-i', default='127.0.0.1', help='address to listen on')
+    argp.add_argument('-p', type=int, default=3456, help='port to listen on')
+    argp.add_argument('--devices', type=int, default=1,
+                      help='number of devices to make up')
+    argp.add_argument('--delay', type=float, default=0.0,
+                      help='seconds to wait before answering each command')
+    args = argp.parse_args()
+
+    devices = fake_devices(args.devices)
+    if 'CUDA_VISIBLE_DEVICES' in os.environ:
+        # Like CUDA, only show the listed devices, numbered from 0.
+        uuids = os.environ['CUDA_VISIBLE_DEVICES'].split(',')
+        devices = [device for device in devices if device[1] in uuids]
+    fake = FakeExcavator(devices=devices, delay=args.delay,
+                         address=(args.i, args.p))
+    fake.start()
+    print(f'fake excavator listening on {args.i}:{args.p}', flush=True)
+    fake.quit.wait()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
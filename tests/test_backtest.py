@@ -0,0 +1,127 @@
+from copy import deepcopy
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import main, TestCase
+
+import nuxhash.settings
+from nuxhash.backtest import (
+    backtest, parse_option, PayrateHistory, RecordedDevice, SECS_PER_DAY,
+    sweep)
+from nuxhash.benchmarking import Benchmark
+from nuxhash.miners.excavator import Excavator
+
+
+class TestPayrateHistory(TestCase):
+
+    def test_integrals(self):
+        history = PayrateHistory([(0, {'equihash': 1.0}),
+                                  (10, {'equihash': 3.0, 'neoscrypt': 2.0}),
+                                  (20, {})])
+        self.assertEqual(history.integrals(5), {'equihash': 5.0,
+                                                'neoscrypt': 0.0})
+        self.assertEqual(history.integrals(15), {'equihash': 25.0,
+                                                 'neoscrypt': 10.0})
+        self.assertEqual(history.payrates(19), {'equihash': 3.0,
+                                                'neoscrypt': 2.0})
+
+    def test_log(self):
+        testdir = Path(mkdtemp())
+        try:
+            nuxhash.settings.append_payrates(testdir, 60.0, {'equihash': 2.0})
+            nuxhash.settings.append_payrates(testdir, 0.0, {'equihash': 1.0})
+            with open(testdir/nuxhash.settings.PAYRATES_FILENAME, 'r') as fd:
+                records = nuxhash.settings.read_payrates(fd)
+        finally:
+            rmtree(testdir)
+        self.assertEqual(records, [(0.0, {'equihash': 1.0}),
+                                   (60.0, {'equihash': 2.0})])
+
+
+class TestBacktest(TestCase):
+
+    def setUp(self):
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['switching']['interval'] = 60
+        self.device = RecordedDevice('nvidia_GPU-test')
+        self.algorithms = [a for a in Excavator(Path('/')).algorithms
+                           if a.algorithms in [['equihash'], ['neoscrypt']]]
+        self.equihash, self.neoscrypt = sorted(self.algorithms,
+                                               key=lambda a: a.name)
+        self.benchmarks = {self.device: {
+            'excavator_equihash': Benchmark([100.0], warmup=19),
+            'excavator_neoscrypt': Benchmark([100.0], warmup=19)}}
+
+    def run_backtest(self, records, all_settings):
+        return backtest(PayrateHistory(records), self.benchmarks,
+                        [self.device], self.algorithms, all_settings,
+                        latency=1.0)
+
+    def test_steady(self):
+        records = [(0, {'equihash': 2.0, 'neoscrypt': 1.0}), (600, {})]
+        simulation, = self.run_backtest(records, [self.settings])
+        self.assertEqual(simulation.switches, 0)
+        self.assertEqual(simulation.idle_secs, 20)
+        self.assertAlmostEqual(simulation.revenue,
+                               100.0*2.0*(600 - 20)/SECS_PER_DAY)
+
+    def test_switch(self):
+        records = [(0, {'equihash': 2.0, 'neoscrypt': 1.0}),
+                   (300, {'equihash': 1.0, 'neoscrypt': 2.0}),
+                   (600, {})]
+        simulation, = self.run_backtest(records, [self.settings])
+        self.assertEqual(simulation.switches, 1)
+        self.assertEqual(simulation.idle_secs, 40)
+        self.assertAlmostEqual(simulation.revenue,
+                               100.0*2.0*(600 - 40)/SECS_PER_DAY)
+
+    def test_sweep(self):
+        option = parse_option('switching.threshold=0.5,2')
+        self.assertEqual(option, ('switching', 'threshold', [0.5, 2.0]))
+        self.assertEqual(parse_option('donate.optout=yes,no'),
+                         ('donate', 'optout', [True, False]))
+        with self.assertRaises(ValueError):
+            parse_option('switching.bogus=1')
+
+        combinations = sweep(self.settings, [option])
+        self.assertEqual([chosen for chosen, _ in combinations],
+                         [{'switching.threshold': 0.5},
+                          {'switching.threshold': 2.0}])
+        records = [(0, {'equihash': 2.0, 'neoscrypt': 1.0}),
+                   (300, {'equihash': 1.0, 'neoscrypt': 2.5}),
+                   (600, {})]
+        simulations = self.run_backtest(
+            records, [nx_settings for _, nx_settings in combinations])
+        self.assertEqual([s.switches for s in simulations], [1, 0])
+
+    def test_naive_batch(self):
+        other = RecordedDevice('nvidia_GPU-other')
+        self.benchmarks[other] = {
+            'excavator_equihash': Benchmark([150.0], warmup=30),
+            'excavator_neoscrypt': Benchmark([80.0])}
+        records = [(i*45, {'equihash': 1.0 + (i % 7)/5,
+                           'neoscrypt': 1.0 + (i % 5)/3})
+                   for i in range(200)]
+        all_settings = []
+        for threshold, interval in [(0.0, 60), (0.1, 60), (0.5, 60),
+                                    (2.0, 60), (0.1, 100), (0.3, 100)]:
+            nx_settings = deepcopy(self.settings)
+            nx_settings['switching']['threshold'] = threshold
+            nx_settings['switching']['interval'] = interval
+            all_settings.append(nx_settings)
+        history = PayrateHistory(records)
+        devices = [self.device, other]
+        batched = backtest(history, self.benchmarks, devices, self.algorithms,
+                           all_settings)
+        stepped = backtest(history, self.benchmarks, devices, self.algorithms,
+                           all_settings, batch_naive=False)
+        self.assertGreater(batched[0].switches, batched[3].switches)
+        for batch, step in zip(batched, stepped):
+            self.assertEqual(batch.switches, step.switches)
+            self.assertAlmostEqual(batch.revenue, step.revenue)
+            self.assertAlmostEqual(batch.idle_secs, step.idle_secs)
+            self.assertAlmostEqual(batch.total_secs, step.total_secs)
+
+
+if __name__ == '__main__':
+    main()
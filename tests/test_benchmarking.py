@@ -0,0 +1,500 @@
+import statistics
+import threading
+import time
+from copy import deepcopy
+from io import StringIO
+from unittest import main, TestCase
+from unittest.mock import patch
+
+import tests
+from nuxhash.benchmarking import (
+    Benchmark, estimate_secs, is_stale, is_steady, plan_benchmarks, record,
+    RunningStats, run_parallel, SampleSeries, summarize)
+from nuxhash.daemon import MiningSession
+from nuxhash.miners.miner import Miner
+from nuxhash.settings import DEFAULT_SETTINGS
+from nuxhash.switching.naive import NaiveSwitcher
+from nuxhash.switching.revenue import RevenueMatrix
+from nuxhash.utils import run_benchmark
+
+
+class FakeMiner(Miner):
+
+    def __init__(self, version=None):
+        Miner.__init__(self, None)
+        self._version = version
+
+    def is_running(self):
+        return True
+
+    @property
+    def version(self):
+        return self._version
+
+
+class FakeAlgorithm(object):
+
+    def __init__(self, name, speeds=[], miner=None, warmup_secs=30,
+                 algorithms=None):
+        self.name = name
+        self.algorithms = algorithms or name.split('_')
+        self.parent = miner or FakeMiner()
+        self.warmup_secs = warmup_secs
+        self.benchmarking = False
+        self._speeds = list(speeds)
+        self.samples = 0
+
+    def accepts(self, device):
+        return True
+
+    def set_devices(self, devices):
+        pass
+
+    def current_speeds(self):
+        speed = self._speeds[self.samples % len(self._speeds)]
+        self.samples += 1
+        return [speed]
+
+
+class TestRunParallel(TestCase):
+
+    def setUp(self):
+        self.devices = tests.get_test_devices()
+        self.algorithms = [FakeAlgorithm(name) for name
+                           in ['equihash', 'neoscrypt', 'lyra2rev2']]
+        self.targets = [(device, algorithm) for device in self.devices
+                        for algorithm in self.algorithms]
+        self.lock = threading.Lock()
+        self.running = []
+        self.overlaps = []
+
+    def run_target(self, device, algorithm):
+        with self.lock:
+            for other_device, other_algorithm in self.running:
+                if other_device == device or other_algorithm == algorithm:
+                    self.overlaps.append((device, algorithm))
+            self.running.append((device, algorithm))
+        time.sleep(0.05)
+        with self.lock:
+            self.running.remove((device, algorithm))
+        return [self.devices.index(device)]
+
+    def test_results(self):
+        benchmarks = run_parallel(self.targets, self.run_target)
+        self.assertEqual(dict(benchmarks), {
+            device: {algorithm.name: [self.devices.index(device)]
+                     for algorithm in self.algorithms}
+            for device in self.devices})
+
+    def test_no_conflicts(self):
+        run_parallel(self.targets, self.run_target)
+        self.assertEqual(self.overlaps, [])
+
+    def test_devices_in_parallel(self):
+        start = time.monotonic()
+        run_parallel(self.targets, self.run_target)
+        # Three rounds of three targets, rather than nine in a row.
+        self.assertLess(time.monotonic() - start, 0.05*6)
+
+    def test_abort(self):
+        abort = threading.Event()
+        def run_target(device, algorithm):
+            abort.set()
+            return [0.0]
+        benchmarks = run_parallel(self.targets, run_target, abort_signal=abort)
+        self.assertEqual(dict(benchmarks), {})
+
+    def test_error(self):
+        def run_target(device, algorithm):
+            raise ValueError
+        with self.assertRaises(ValueError):
+            run_parallel(self.targets, run_target)
+
+
+class TestPlan(TestCase):
+
+    def setUp(self):
+        self.devices = tests.get_test_devices()[:2]
+        self.algorithms = [FakeAlgorithm(name) for name in [
+            'daggerhashimoto_pascal', 'equihash', 'daggerhashimoto_decred',
+            'neoscrypt', 'daggerhashimoto']]
+        self.targets = [(device, algorithm) for device in self.devices
+                        for algorithm in self.algorithms]
+
+    def test_grouped(self):
+        plan = plan_benchmarks(self.targets)
+        self.assertCountEqual(plan, self.targets)
+        names = [algorithm.name for device, algorithm in plan
+                 if device == self.devices[0]]
+        self.assertEqual(names, ['daggerhashimoto', 'daggerhashimoto_decred',
+                                 'daggerhashimoto_pascal', 'equihash',
+                                 'neoscrypt'])
+
+    def test_staggered(self):
+        plan = plan_benchmarks(self.targets)
+        firsts = [next(algorithm for d, algorithm in plan if d == device)
+                  for device in self.devices]
+        self.assertNotEqual(firsts[0], firsts[1])
+
+    def test_estimate(self):
+        settings = deepcopy(DEFAULT_SETTINGS)
+        settings['benchmarking']['adaptive'] = False
+        plan = plan_benchmarks(self.targets)
+        self.assertEqual(estimate_secs(plan, settings), 5*(30 + 60))
+        benchmarks = {self.devices[0]: {
+            algorithm.name: Benchmark([1.0], warmup=10)
+            for algorithm in self.algorithms}}
+        # The other device has no recorded warmups and sets the pace.
+        self.assertEqual(estimate_secs(plan, settings, benchmarks), 5*(30 + 60))
+        benchmarks[self.devices[1]] = benchmarks[self.devices[0]]
+        self.assertEqual(estimate_secs(plan, settings, benchmarks), 5*(10 + 60))
+
+    def test_estimate_one_algorithm(self):
+        settings = deepcopy(DEFAULT_SETTINGS)
+        settings['benchmarking']['adaptive'] = False
+        plan = [(device, self.algorithms[0]) for device in self.devices]
+        # Only one device can measure the algorithm at a time.
+        self.assertEqual(estimate_secs(plan, settings), 2*(30 + 60))
+
+    def test_estimate_adaptive(self):
+        settings = deepcopy(DEFAULT_SETTINGS)
+        settings['benchmarking']['adaptive'] = True
+        plan = plan_benchmarks(self.targets)
+        self.assertEqual(estimate_secs(plan, settings), 5*(30 + 20))
+        self.assertEqual(estimate_secs(plan, settings, longest=True),
+                         5*(30 + 180))
+
+
+class TestRunningStats(TestCase):
+
+    def test_mean_variance(self):
+        samples = [[100.0, 5.0], [104.0, 5.0], [98.0, 5.0], [101.0, 5.0]]
+        stats = RunningStats(2)
+        for sample in samples:
+            stats.add(sample)
+        self.assertAlmostEqual(stats.mean[0],
+                               statistics.mean(s[0] for s in samples))
+        self.assertAlmostEqual(stats.variance[0],
+                               statistics.variance(s[0] for s in samples))
+        self.assertEqual(stats.variance[1], 0.0)
+
+    def test_relative_error(self):
+        stats = RunningStats(1)
+        stats.add([100.0])
+        self.assertEqual(stats.relative_error(), float('inf'))
+        stats.add([100.0])
+        self.assertEqual(stats.relative_error(), 0.0)
+        stats.add([130.0])
+        self.assertGreater(stats.relative_error(), 0.1)
+
+
+class TestSummarize(TestCase):
+
+    def setUp(self):
+        self.samples = [[100.0, 10.0], [102.0, 10.0], [0.0, 0.0], [98.0, 10.0],
+                        [101.0, 10.0], [99.0, 10.0]]
+
+    def test_outlier(self):
+        benchmark = summarize(self.samples, 'mean')
+        self.assertEqual(benchmark, [100.0, 10.0])
+        self.assertAlmostEqual(benchmark.stddev[0],
+                               statistics.stdev([100, 102, 98, 101, 99]))
+        self.assertEqual(benchmark.stddev[1], 0.0)
+        self.assertGreater(benchmark.error, 0.0)
+
+    def test_statistics(self):
+        samples = [[2.0], [4.0], [3.0], [50.0]] + [[3.0]]*6
+        self.assertEqual(summarize(samples, 'median'), [3.0])
+        self.assertEqual(summarize(samples, 'trimmed_mean'), [3.0])
+        with self.assertRaises(ValueError):
+            summarize(samples, 'mode')
+
+    def test_mostly_identical(self):
+        samples = [[100.0]]*6 + [[90.0], [95.0], [110.0], [120.0]]
+        benchmark = summarize(samples, 'mean')
+        kept = [100.0]*6 + [90.0, 95.0, 110.0]
+        self.assertAlmostEqual(benchmark[0], statistics.mean(kept))
+        self.assertAlmostEqual(benchmark.stddev[0], statistics.stdev(kept))
+        self.assertGreater(benchmark.error, 0.0)
+
+    def test_unchanged(self):
+        copy = [list(sample) for sample in self.samples]
+        summarize(self.samples)
+        self.assertEqual(self.samples, copy)
+
+    def test_single(self):
+        benchmark = summarize([[100.0]])
+        self.assertEqual(benchmark, [100.0])
+        self.assertIsNone(benchmark.stddev)
+
+
+class TestSteadyState(TestCase):
+
+    def test_flat(self):
+        self.assertTrue(is_steady([[100.0, 5.0]]*10, 0.01))
+
+    def test_rising(self):
+        samples = [[100.0 + i] for i in range(10)]
+        self.assertFalse(is_steady(samples, 0.01))
+        self.assertTrue(is_steady(samples, 0.1))
+
+    def test_noise(self):
+        samples = [[100.0], [101.0], [99.0], [100.5], [99.5], [100.0]]
+        self.assertTrue(is_steady(samples, 0.01))
+
+    def test_zeroes(self):
+        self.assertFalse(is_steady([[0.0]]*10, 0.01))
+        self.assertFalse(is_steady([[0.0]]*9 + [[100.0]], 0.01))
+        self.assertTrue(is_steady([[100.0, 0.0]]*10, 0.01))
+
+
+class TestAdaptiveBenchmark(TestCase):
+
+    def setUp(self):
+        self.device = tests.get_test_devices()[0]
+
+    def test_steady(self):
+        algorithm = FakeAlgorithm('equihash', [300.0])
+        benchmark = run_benchmark(algorithm, self.device, 0, 2,
+                                  tolerance=0.01, max_duration=10)
+        self.assertEqual(benchmark, [300.0])
+        self.assertEqual(benchmark.error, 0.0)
+        self.assertEqual(benchmark.stddev, [0.0])
+        self.assertEqual(algorithm.samples, 2)
+
+    def test_noisy(self):
+        algorithm = FakeAlgorithm('equihash', [100.0, 120.0, 90.0])
+        benchmark = run_benchmark(algorithm, self.device, 0, 2,
+                                  tolerance=0.01, max_duration=3)
+        self.assertEqual(algorithm.samples, 3)
+        self.assertGreater(benchmark.error, 0.01)
+
+    def test_warmup(self):
+        algorithm = FakeAlgorithm('daggerhashimoto', [0.0]*2 + [30.0]*100)
+        benchmark = run_benchmark(algorithm, self.device, 300, 1,
+                                  warmup_window=2, warmup_drift=0.01)
+        self.assertEqual(benchmark.warmup, 4)
+        self.assertEqual(benchmark, [30.0])
+
+    def test_details(self):
+        self.assertEqual(Benchmark([1.0], error=0.5).details, {'error': 0.5})
+        self.assertEqual(Benchmark([1.0]).details, {})
+        with self.assertRaises(TypeError):
+            Benchmark([1.0], bogus=True)
+
+
+class TestSampleSeries(TestCase):
+
+    def setUp(self):
+        self.device = tests.get_test_devices()[0]
+
+    def test_recorded(self):
+        algorithm = FakeAlgorithm('equihash', [0.0, 0.0, 300.0, 310.0])
+        series = SampleSeries(algorithm.algorithms)
+        run_benchmark(algorithm, self.device, 0.1, 0.2, sample_interval=0.05,
+                      series=series)
+        self.assertEqual(len(series), 6)
+        self.assertEqual(list(series.warmup), [1, 1, 0, 0, 0, 0])
+        self.assertEqual(list(series.speeds[0]),
+                         [0.0, 0.0, 300.0, 310.0, 0.0, 0.0])
+        self.assertEqual(series.times[0], 0.0)
+        self.assertTrue(all(later > earlier for earlier, later
+                            in zip(series.times, series.times[1:])))
+        self.assertAlmostEqual(series.times[-1], 0.25, delta=0.04)
+
+    def test_csv(self):
+        series = SampleSeries(['daggerhashimoto', 'pascal'])
+        series.add([10.0, 0.0], warmup=True, timestamp=100.0)
+        series.add([30.5, 1e9], timestamp=100.25)
+        fd = StringIO()
+        series.write_csv(fd)
+        fd.seek(0)
+        copy = SampleSeries.read_csv(fd)
+        self.assertEqual(copy.algorithms, ['daggerhashimoto', 'pascal'])
+        self.assertEqual(list(copy.times), [0.0, 0.25])
+        self.assertEqual(list(copy.warmup), [1, 0])
+        self.assertEqual([list(column) for column in copy.speeds],
+                         [[10.0, 30.5], [0.0, 1e9]])
+
+
+class TestVersionedBenchmarks(TestCase):
+
+    def setUp(self):
+        self.device = tests.get_test_devices()[0]
+        self.device.driver_version = '418.56'
+        self.algorithm = FakeAlgorithm('equihash', [300.0],
+                                       miner=FakeMiner('1.5.14a'))
+
+    def make_benchmark(self, **details):
+        stamp = dict(timestamp=time.time(), miner_version='1.5.14a',
+                     driver_version='418.56')
+        stamp.update(details)
+        return Benchmark([300.0], **stamp)
+
+    def test_stamped(self):
+        benchmark = run_benchmark(self.algorithm, self.device, 0, 1)
+        self.assertEqual(benchmark.miner_version, '1.5.14a')
+        self.assertEqual(benchmark.driver_version, '418.56')
+        self.assertFalse(is_stale(benchmark, self.algorithm, self.device))
+
+    def test_stale(self):
+        def stale(benchmark, max_age_days=0):
+            return is_stale(benchmark, self.algorithm, self.device, max_age_days)
+        self.assertTrue(stale([300.0]))
+        self.assertFalse(stale(self.make_benchmark()))
+        self.assertTrue(stale(self.make_benchmark(miner_version='1.5.13a')))
+        self.assertTrue(stale(self.make_benchmark(driver_version='410.78')))
+        old = self.make_benchmark(timestamp=time.time() - 40*24*60*60)
+        self.assertFalse(stale(old))
+        self.assertTrue(stale(old, max_age_days=30))
+
+    def test_history(self):
+        benchmarks = {'equihash': [250.0]}
+        for speed in [300.0, 310.0]:
+            record(benchmarks, 'equihash', Benchmark([speed], timestamp=speed))
+        self.assertEqual(benchmarks['equihash'], [310.0])
+        self.assertEqual(benchmarks['equihash'].history, [[300.0], [250.0]])
+        self.assertEqual(benchmarks['equihash'].history[0].timestamp, 300.0)
+        self.assertIsNone(benchmarks['equihash'].history[0].history)
+
+    def test_json(self):
+        benchmark = self.make_benchmark()
+        benchmark.history = [self.make_benchmark(timestamp=0)]
+        copy = Benchmark.from_json(benchmark.to_json())
+        self.assertEqual(copy.details.keys(), benchmark.details.keys())
+        self.assertEqual(copy.history[0].timestamp, 0)
+
+
+class TestBackgroundBenchmarks(TestCase):
+
+    def setUp(self):
+        self.devices = tests.get_test_devices()
+        def excavator_algorithm(name):
+            return FakeAlgorithm(f'excavator_{name}', algorithms=name.split('_'))
+        self.equihash = excavator_algorithm('equihash')
+        self.neoscrypt = excavator_algorithm('neoscrypt')
+        self.pascal = excavator_algorithm('daggerhashimoto_pascal')
+        benchmarks = tests.get_test_benchmarks()
+        for device in self.devices:
+            for name in benchmarks[device]:
+                benchmarks[device][name] = Benchmark(
+                    benchmarks[device][name], timestamp=time.time())
+        self.session = MiningSession([], DEFAULT_SETTINGS, benchmarks,
+                                     self.devices)
+        self.session._algorithms = [self.equihash, self.neoscrypt, self.pascal]
+        d0, d1, d2 = self.devices
+        self.session._assignments = {d0: self.equihash, d1: self.neoscrypt,
+                                     d2: self.equihash}
+        self.revenues = {d0: {self.equihash: 3.0, self.neoscrypt: 1.0,
+                              self.pascal: 0.0},
+                         d1: {self.equihash: 1.0, self.neoscrypt: 2.0,
+                              self.pascal: 0.0},
+                         d2: {self.equihash: 4.0, self.neoscrypt: 1.0,
+                              self.pascal: 0.0}}
+
+    def test_nothing_to_do(self):
+        self.assertIsNone(self.session._pick_benchmark(self.revenues))
+
+    def test_cheapest_device(self):
+        for device in self.devices:
+            del self.session._benchmarks[device]['excavator_daggerhashimoto_pascal']
+        self.assertEqual(self.session._pick_benchmark(self.revenues),
+                         (self.devices[1], self.pascal))
+
+    def test_busy_algorithm(self):
+        del self.session._benchmarks[self.devices[1]]['excavator_equihash']
+        del self.session._benchmarks[self.devices[2]][
+            'excavator_daggerhashimoto_pascal']
+        # equihash is mined elsewhere, so device 1 has to keep mining.
+        self.assertEqual(self.session._pick_benchmark(self.revenues),
+                         (self.devices[2], self.pascal))
+
+    def test_shared_sub_algorithm(self):
+        equihash_x = FakeAlgorithm('excavator_equihash_x',
+                                   algorithms=['equihash', 'x'])
+        self.session._algorithms.append(equihash_x)
+        self.assertIsNone(self.session._pick_benchmark(self.revenues))
+
+    def test_benchmark_keeps_shared_sub_algorithms_free(self):
+        dagger = FakeAlgorithm('excavator_daggerhashimoto',
+                               algorithms=['daggerhashimoto'])
+        algorithms = [self.equihash, self.neoscrypt, self.pascal, dagger]
+        settings = deepcopy(DEFAULT_SETTINGS)
+        settings['donate']['optout'] = True
+        session = self.session
+        session._settings = settings
+        session._algorithms = algorithms
+        for device in self.devices:
+            session._benchmarks[device]['excavator_daggerhashimoto'] = [1000.0]
+        session._revenue_matrix = RevenueMatrix(self.devices, algorithms,
+                                                session._benchmarks)
+        session._profit_switch = NaiveSwitcher(settings)
+        session._payrates = ({'equihash': 1.0, 'neoscrypt': 1.0,
+                              'daggerhashimoto': 10.0, 'pascal': 10.0}, None)
+        # Benchmark pascal on device 1 for the whole of the test.
+        done = threading.Event()
+        self.addCleanup(done.set)
+        session._benchmark_target = (self.devices[1], self.pascal)
+        session._benchmark_thread = threading.Thread(target=done.wait)
+        session._benchmark_thread.start()
+
+        with patch('nuxhash.daemon.nicehash.simplemultialgo_info',
+                   side_effect=OSError), \
+             patch('nuxhash.daemon.run_transition', return_value={}):
+            session._switch_algos()
+            session._switch_algos()
+        d0, d1, d2 = self.devices
+        self.assertEqual(session._assignments, {d0: self.neoscrypt,
+                                                d2: self.neoscrypt})
+
+    def test_idle_device(self):
+        for device in self.devices:
+            del self.session._benchmarks[device]['excavator_daggerhashimoto_pascal']
+        del self.session._assignments[self.devices[2]]
+        # Device 2 is not mining, but it would earn the most.
+        self.assertEqual(self.session._pick_benchmark(self.revenues),
+                         (self.devices[1], self.pascal))
+
+    def test_mines_after_benchmark(self):
+        settings = deepcopy(DEFAULT_SETTINGS)
+        settings['donate']['optout'] = True
+        settings['benchmarking']['background'] = True
+        session = self.session
+        session._settings = settings
+        for device in self.devices:
+            del session._benchmarks[device]['excavator_daggerhashimoto_pascal']
+        session._revenue_matrix = RevenueMatrix(
+            self.devices, session._algorithms, session._benchmarks)
+        session._profit_switch = NaiveSwitcher(settings)
+        session._payrates = ({'equihash': 1.0, 'neoscrypt': 1.0,
+                              'daggerhashimoto': 10.0, 'pascal': 10.0}, None)
+        done = threading.Event()
+        self.addCleanup(done.set)
+        session._benchmark_target = (self.devices[1], self.pascal)
+        session._benchmark_thread = threading.Thread(target=done.wait)
+        session._benchmark_thread.start()
+
+        d0, d1, d2 = self.devices
+        with patch('nuxhash.daemon.nicehash.simplemultialgo_info',
+                   side_effect=OSError), \
+             patch('nuxhash.daemon.run_transition', return_value={}), \
+             patch.object(session, '_start_benchmark'):
+            session._switch_algos()
+            self.assertNotIn(d1, session._assignments)
+            done.set()
+            session._benchmark_thread.join()
+            session._switch_algos()
+        # Device 1 goes back to mining instead of straight into a benchmark.
+        self.assertIn(d1, session._assignments)
+        self.assertNotEqual(session._benchmark_target[0], d1)
+
+    def test_missing_before_stale(self):
+        benchmarks = self.session._benchmarks[self.devices[1]]
+        benchmarks['excavator_neoscrypt'] = [500.0]
+        del benchmarks['excavator_daggerhashimoto_pascal']
+        self.assertEqual(self.session._pick_benchmark(self.revenues),
+                         (self.devices[1], self.pascal))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+from copy import deepcopy
+import os
 from pathlib import Path
 from shutil import rmtree
 from tempfile import mkdtemp
@@ -5,6 +7,7 @@ from unittest import main, TestCase
 
 import nuxhash.settings
 import tests
+from nuxhash.benchmarking import Benchmark, SampleSeries
 
 
 class TestUserData(TestCase):
@@ -26,6 +29,16 @@ class TestUserData(TestCase):
             read_settings = nuxhash.settings.read_settings_from_file(fd)
         self.assertEqual(self.settings, read_settings)
 
+    def test_fractional_timeouts(self):
+        testfile = self.testdir/'settings.conf'
+        settings = deepcopy(self.settings)
+        settings['excavator_miner']['idle_timeout'] = 0.5
+        with open(testfile, 'w') as fd:
+            nuxhash.settings.write_settings_to_file(fd, settings)
+        with open(testfile, 'r') as fd:
+            read_settings = nuxhash.settings.read_settings_from_file(fd)
+        self.assertEqual(read_settings['excavator_miner']['idle_timeout'], 0.5)
+
     def test_benchmarks(self):
         testfile = self.testdir/'benchmarks.json'
         with open(testfile, 'w') as fd:
@@ -36,6 +49,20 @@ class TestUserData(TestCase):
         device = self.devices[0]
         self.assertEqual(self.benchmarks, read_benchmarks)
 
+    def test_benchmark_details(self):
+        device = self.devices[0]
+        self.benchmarks[device]['excavator_equihash'] = Benchmark(
+            [300.0], error=0.005)
+        testfile = self.testdir/'benchmarks.json'
+        with open(testfile, 'w') as fd:
+            nuxhash.settings.write_benchmarks_to_file(fd, self.benchmarks)
+        with open(testfile, 'r') as fd:
+            read_benchmarks = nuxhash.settings.read_benchmarks_from_file(
+                fd, self.devices)
+        self.assertEqual(self.benchmarks, read_benchmarks)
+        self.assertEqual(
+            read_benchmarks[device]['excavator_equihash'].error, 0.005)
+
     def test_persistent_settings(self):
         nuxhash.settings.save_settings(self.testdir, self.settings)
         read_settings = nuxhash.settings.load_settings(self.testdir)
@@ -47,6 +74,64 @@ class TestUserData(TestCase):
             self.testdir, self.devices)
         self.assertEqual(self.benchmarks, read_benchmarks)
 
+    def test_journal(self):
+        device = self.devices[0]
+        nuxhash.settings.save_benchmarks(self.testdir, self.benchmarks)
+        nuxhash.settings.journal_benchmark(
+            self.testdir, device, 'excavator_equihash',
+            Benchmark([310.0], timestamp=1))
+        nuxhash.settings.journal_benchmark(
+            self.testdir, device, 'excavator_lyra2rev2', [20.0])
+        read_benchmarks = nuxhash.settings.load_benchmarks(
+            self.testdir, self.devices)
+        self.assertEqual(read_benchmarks[device]['excavator_equihash'], [310.0])
+        self.assertEqual(read_benchmarks[device]['excavator_equihash'].history,
+                         [[300]])
+        self.assertEqual(read_benchmarks[device]['excavator_lyra2rev2'], [20.0])
+
+    def test_torn_journal(self):
+        nuxhash.settings.journal_benchmark(
+            self.testdir, self.devices[0], 'excavator_equihash', [310.0])
+        with open(self.testdir/nuxhash.settings.JOURNAL_FILENAME, 'a') as fd:
+            fd.write('{"device": "test_GPU-aa')
+        journal = nuxhash.settings.read_journal(self.testdir, self.devices)
+        self.assertEqual(journal, [(self.devices[0], 'excavator_equihash',
+                                    [310.0])])
+
+    def test_save_clears_journal(self):
+        nuxhash.settings.journal_benchmark(
+            self.testdir, self.devices[0], 'excavator_equihash', [310.0])
+        nuxhash.settings.save_benchmarks(self.testdir, self.benchmarks)
+        self.assertEqual(
+            nuxhash.settings.read_journal(self.testdir, self.devices), [])
+        self.assertEqual(sorted(os.listdir(self.testdir)),
+                         [nuxhash.settings.BENCHMARKS_FILENAME])
+
+    def test_merged_once(self):
+        device = self.devices[0]
+        benchmark = Benchmark([310.0], timestamp=1)
+        nuxhash.settings.journal_benchmark(
+            self.testdir, device, 'excavator_equihash', benchmark)
+        # Crash after saving, but before the journal was removed.
+        self.benchmarks[device]['excavator_equihash'] = benchmark
+        with open(self.testdir/nuxhash.settings.BENCHMARKS_FILENAME, 'w') as fd:
+            nuxhash.settings.write_benchmarks_to_file(fd, self.benchmarks)
+        read_benchmarks = nuxhash.settings.load_benchmarks(
+            self.testdir, self.devices)
+        self.assertIsNone(read_benchmarks[device]['excavator_equihash'].history)
+
+    def test_samples(self):
+        series = SampleSeries(['equihash'])
+        series.add([300.0], timestamp=0.0)
+        series.add([310.0], timestamp=1.0)
+        path = nuxhash.settings.save_samples(
+            self.testdir, self.devices[0], 'excavator_equihash', series)
+        self.assertEqual(path.parent,
+                         self.testdir/'samples'/str(self.devices[0]))
+        with open(path, 'r', newline='') as fd:
+            read_series = SampleSeries.read_csv(fd)
+        self.assertEqual(list(read_series.speeds[0]), [300.0, 310.0])
+
 
 if __name__ == '__main__':
     main()
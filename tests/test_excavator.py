@@ -1,29 +1,35 @@
+import os
 import unittest
+from copy import deepcopy
+from pathlib import Path
+from shutil import rmtree
 from subprocess import call
+from tempfile import mkdtemp
 from time import sleep
+from unittest.mock import patch
 
 import nuxhash.settings
 from nuxhash.daemon import DONATE_ADDRESS
 from nuxhash.devices.nvidia import enumerate_devices as nvidia_devices
+from nuxhash.devices.nvidia import NvidiaDevice
 from nuxhash.download.downloads import make_miners
-from nuxhash.miners.excavator import Excavator
+from nuxhash.miners.excavator import Excavator, ExcavatorError, ExcavatorServer
 from tests import get_test_devices
+from tests.fake_excavator import DEFAULT_SPEED, fake_devices, FakeExcavator
 
 
 devices = nvidia_devices()
 
 
-@unittest.skipIf(len(devices) == 0, 'requires an nvidia graphics card')
-class TestExcavator(unittest.TestCase):
+class ExcavatorTests(object):
 
     def setUp(self):
-        self.configdir = nuxhash.settings.DEFAULT_CONFIGDIR
-        self.device = devices[0]
-
-        self.settings = nuxhash.settings.DEFAULT_SETTINGS
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
         self.settings['nicehash']['wallet'] = DONATE_ADDRESS
+        # Remove algorithms as soon as they are unused.
+        self.settings['excavator_miner']['idle_algorithms'] = 0
 
-        self.alt_settings = nuxhash.settings.DEFAULT_SETTINGS
+        self.alt_settings = deepcopy(self.settings)
         self.alt_settings['nicehash']['wallet'] = '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa'
         self.alt_settings['nicehash']['workername'] = 'nuxhashtest'
 
@@ -34,7 +40,6 @@ class TestExcavator(unittest.TestCase):
         self.neoscrypt = next(a for a in self.excavator.algorithms
                               if a.algorithms == ['neoscrypt'])
 
-        make_miners(self.configdir)
         self.excavator.load()
 
     def tearDown(self):
@@ -71,6 +76,9 @@ class TestExcavator(unittest.TestCase):
         self.equihash.set_devices([])
         self.assertEqual(self._get_algorithms(), [])
 
+    def test_version(self):
+        self.assertIsNotNone(self.excavator.version)
+
     def test_report_speed(self):
         self.equihash.set_devices([self.device])
         self.assertEqual(len(self.equihash.current_speeds()), 1)
@@ -163,12 +171,264 @@ class TestExcavator(unittest.TestCase):
         self.equihash.set_devices([self.device])
         status = (self._get_workers(), self._get_algorithms())
         sleep(1)
-        call(['killall', 'excavator'])
+        self._kill_excavator()
         sleep(1)
         self.equihash.current_speeds()
         self.assertEqual(status, (self._get_workers(), self._get_algorithms()))
 
 
+@unittest.skipIf(len(devices) == 0, 'requires an nvidia graphics card')
+class TestExcavator(ExcavatorTests, unittest.TestCase):
+
+    def setUp(self):
+        self.configdir = nuxhash.settings.DEFAULT_CONFIGDIR
+        self.device = devices[0]
+        make_miners(self.configdir)
+        ExcavatorTests.setUp(self)
+
+    def _kill_excavator(self):
+        call(['killall', 'excavator'])
+
+
+class TestFakeExcavator(ExcavatorTests, unittest.TestCase):
+
+    def setUp(self):
+        self.configdir = Path(mkdtemp())
+        os.mkdir(self.configdir/'excavator')
+        os.symlink(Path(__file__).parent.resolve()/'fake_excavator.py',
+                   self.configdir/'excavator'/'excavator')
+        pci_bus, uuid, name = fake_devices(1)[0]
+        self.device = NvidiaDevice(pci_bus, uuid, name)
+        ExcavatorTests.setUp(self)
+
+    def tearDown(self):
+        ExcavatorTests.tearDown(self)
+        rmtree(self.configdir)
+
+    def _kill_excavator(self):
+        self.excavator.server._process.kill()
+
+    def _wait_for_restart(self, timeout=5):
+        server = self.excavator.server
+        for _ in range(int(timeout/0.05)):
+            if len(server.restart_latencies) > 0:
+                return True
+            sleep(0.05)
+        return False
+
+    def test_supervisor_restart(self):
+        self.equihash.set_devices([self.device])
+        server = self.excavator.server
+        subscription = server.send_command('info', [])['subscription']
+        self.assertIsNotNone(subscription)
+        status = (self._get_workers(), self._get_algorithms(), subscription)
+        self._kill_excavator()
+        # Nothing touches an algorithm; the supervisor restarts excavator alone.
+        self.assertTrue(self._wait_for_restart())
+        self.assertTrue(server.is_running())
+        subscription = server.send_command('info', [])['subscription']
+        self.assertEqual(status, (self._get_workers(), self._get_algorithms(),
+                                  subscription))
+        self.assertEqual(len(server.restart_latencies), 1)
+
+    def test_stop_no_restart(self):
+        self.excavator.unload()
+        self.assertFalse(self._wait_for_restart(timeout=0.5))
+        self.assertFalse(self.excavator.is_running())
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.configdir = Path(mkdtemp())
+        os.mkdir(self.configdir/'excavator')
+        os.symlink(Path(__file__).parent.resolve()/'fake_excavator.py',
+                   self.configdir/'excavator'/'excavator')
+        self.devices = [NvidiaDevice(pci_bus, uuid, name)
+                        for pci_bus, uuid, name in fake_devices(4)]
+        patcher = patch('nuxhash.miners.excavator.nvidia_devices',
+                        return_value=self.devices)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['nicehash']['wallet'] = DONATE_ADDRESS
+        self.settings['excavator_miner']['args'] = '--devices 4'
+        self.settings['excavator_miner']['shard_size'] = 2
+        self.excavator = Excavator(self.configdir)
+        self.excavator.settings = self.settings
+        self.equihash = next(a for a in self.excavator.algorithms
+                             if a.algorithms == ['equihash'])
+        self.excavator.load()
+
+    def tearDown(self):
+        self.excavator.unload()
+        rmtree(self.configdir)
+
+    def _get_workers(self, server):
+        response = server.send_command('worker.list', [])
+        return sorted(w['device_uuid'] for w in response['workers'])
+
+    def test_shards(self):
+        servers = self.excavator.servers
+        self.assertEqual([server.devices for server in servers],
+                         [self.devices[:2], self.devices[2:]])
+        self.assertEqual(len(set(server._address for server in servers)), 2)
+        self.assertTrue(all(server.is_running() for server in servers))
+
+    def test_unknown_device(self):
+        device = NvidiaDevice(99, 'GPU-unknown', 'Unknown')
+        with self.assertRaises(ExcavatorError):
+            self.excavator.server_for(device)
+
+    def test_routing(self):
+        self.equihash.set_devices(self.devices)
+        self.assertEqual([self._get_workers(server)
+                          for server in self.excavator.servers],
+                         [[self.devices[0].uuid, self.devices[1].uuid],
+                          [self.devices[2].uuid, self.devices[3].uuid]])
+        self.assertEqual(self.equihash.current_speeds(), [4*DEFAULT_SPEED])
+        self.equihash.set_devices(self.devices[3:])
+        self.assertEqual([self._get_workers(server)
+                          for server in self.excavator.servers],
+                         [[], [self.devices[3].uuid]])
+        self.assertEqual(self.equihash.current_speeds(), [DEFAULT_SPEED])
+
+    def test_shard_size_change(self):
+        self.settings['excavator_miner']['shard_size'] = 0
+        self.excavator.settings = self.settings
+        self.assertEqual(len(self.excavator.servers), 2)
+        self.excavator.unload()
+        self.excavator.load()
+        self.assertEqual(self.excavator.servers, [self.excavator.server])
+        self.equihash.set_devices(self.devices)
+        self.assertEqual(len(self._get_workers(self.excavator.server)), 4)
+
+    def test_crash_one_shard(self):
+        self.equihash.set_devices(self.devices)
+        crashed, survivor = self.excavator.servers
+        crashed_process, survivor_process = crashed._process, survivor._process
+        crashed_process.kill()
+        crashed_process.wait()
+        self.assertIs(survivor._process, survivor_process)
+        self.assertTrue(survivor.is_running())
+        self.assertEqual(self._get_workers(survivor),
+                         [self.devices[2].uuid, self.devices[3].uuid])
+        # Let the supervisor bring the crashed shard back before tearing down.
+        for _ in range(100):
+            if len(crashed.restart_latencies) > 0:
+                break
+            sleep(0.05)
+        self.assertEqual(self._get_workers(crashed),
+                         [self.devices[0].uuid, self.devices[1].uuid])
+
+
+class FakeServerTests(object):
+    """ExcavatorServer talking to a FakeExcavator in this process, so tests can
+    count the commands it sends."""
+
+    def setUp(self):
+        self.fake = FakeExcavator(devices=2)
+        self.fake.start()
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['nicehash']['wallet'] = DONATE_ADDRESS
+        ip, port = self.fake.address
+        self.settings['excavator_miner']['listen'] = f'{ip}:{port}'
+        self.devices = [NvidiaDevice(pci_bus, uuid, name)
+                        for pci_bus, uuid, name in fake_devices(2)]
+
+        self.server = ExcavatorServer(None)
+        self.server.settings = self.settings
+        self.server._read_devices()
+
+    def tearDown(self):
+        self.server._connection.close()
+        self.server._pipeline.close()
+        self.fake.stop()
+
+
+class TestWorkerSpeeds(FakeServerTests, unittest.TestCase):
+
+    def setUp(self):
+        FakeServerTests.setUp(self)
+        self.settings['excavator_miner']['speeds_ttl'] = 60
+        self.server.settings = self.settings
+
+    def test_one_request_per_ttl(self):
+        self.server.apply_work(start=[('equihash', device)
+                                      for device in self.devices])
+        for _ in range(3):
+            for device in self.devices:
+                self.assertEqual(self.server.device_speeds(device),
+                                 {'equihash': DEFAULT_SPEED})
+        self.assertEqual(self.fake.commands['worker.list'], 1)
+
+    def test_ttl(self):
+        self.settings['excavator_miner']['speeds_ttl'] = 0.1
+        self.server.settings = self.settings
+        self.server.apply_work(start=[('equihash', self.devices[0])])
+        self.server.device_speeds(self.devices[0])
+        sleep(0.2)
+        self.server.device_speeds(self.devices[0])
+        self.assertEqual(self.fake.commands['worker.list'], 2)
+
+    def test_apply_work_invalidates(self):
+        self.server.apply_work(start=[('equihash', self.devices[0])])
+        self.assertEqual(self.server.device_speeds(self.devices[1]), {})
+        self.server.apply_work(start=[('neoscrypt', self.devices[1])])
+        self.assertEqual(self.server.device_speeds(self.devices[1]),
+                         {'neoscrypt': DEFAULT_SPEED})
+        self.assertEqual(self.fake.commands['worker.list'], 2)
+
+
+class TestKeepWarm(FakeServerTests, unittest.TestCase):
+
+    def switch(self, old, new, benchmarking=False):
+        device = self.devices[0]
+        self.server.apply_work(start=[(new, device)] if new else [],
+                               stop=[(old, device)] if old else [],
+                               benchmarking=benchmarking)
+
+    def test_ping_pong(self):
+        self.switch(None, 'equihash')
+        self.switch('equihash', 'neoscrypt')
+        self.switch('neoscrypt', 'equihash')
+        self.switch('equihash', 'neoscrypt')
+        self.assertEqual(self.fake.commands['algorithm.add'], 2)
+        self.assertEqual(self.fake.commands['algorithm.remove'], 0)
+
+    def test_idle_limit(self):
+        self.settings['excavator_miner']['idle_algorithms'] = 1
+        self.server.settings = self.settings
+        self.switch(None, 'equihash')
+        self.switch('equihash', 'neoscrypt')
+        self.switch('neoscrypt', 'equihash')
+        self.switch('equihash', 'keccak')
+        # neoscrypt went idle before equihash did.
+        self.assertEqual(self.fake.algorithms, ['equihash', 'keccak'])
+
+    def test_idle_timeout(self):
+        self.settings['excavator_miner']['idle_timeout'] = 0.1
+        self.server.settings = self.settings
+        self.switch(None, 'equihash')
+        self.switch('equihash', None)
+        self.assertEqual(self.fake.algorithms, ['equihash'])
+        sleep(0.2)
+        self.server.worker_speeds()
+        self.assertEqual(self.fake.algorithms, [])
+
+    def test_benchmark_mode(self):
+        self.switch(None, 'equihash')
+        self.switch('equihash', None)
+        self.switch(None, 'equihash', benchmarking=True)
+        self.assertEqual(self.fake.algorithms, ['benchmark-equihash'])
+        self.switch('equihash', None)
+        self.switch(None, 'equihash')
+        self.assertEqual(self.fake.algorithms, ['equihash'])
+        self.assertEqual(self.fake.commands['algorithm.add'], 3)
+        self.assertEqual(self.fake.commands['algorithm.remove'], 2)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,179 @@
+import json
+import socket
+import threading
+import time
+from unittest import main, TestCase
+
+from nuxhash.miners.excavator import ExcavatorConnection, ExcavatorPipeline
+
+
+class ServerTests(object):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        # set once the server has dropped a connection
+        self.dropped = threading.Event()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def _serve(self, respond, connections=1):
+        """Answer each command with the chunks respond() returns for it.
+
+        If respond() returns None, the server hangs up without answering. Like
+        excavator, it also hangs up after answering a quit command.
+        """
+        # list of the methods of all commands received
+        self.received = []
+        def serve():
+            for _ in range(connections):
+                client, _ = self.listener.accept()
+                with client, client.makefile('rb') as lines:
+                    for line in lines:
+                        command = json.loads(line)
+                        self.received.append(command['method'])
+                        chunks = respond(command)
+                        if chunks is None:
+                            break
+                        for chunk in chunks:
+                            client.sendall(chunk)
+                        if command['method'] == 'quit':
+                            break
+                self.dropped.set()
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+
+
+def _answer(command):
+    return [(json.dumps({'id': command['id'], 'error': None,
+                        'method': command['method']}) + '\n').encode('ascii')]
+
+
+class TestExcavatorConnection(ServerTests, TestCase):
+
+    def setUp(self):
+        ServerTests.setUp(self)
+        self.connection = ExcavatorConnection(self.listener.getsockname())
+
+    def tearDown(self):
+        self.connection.close()
+        ServerTests.tearDown(self)
+
+    def test_split_multibyte(self):
+        def respond(command):
+            data = json.dumps({'id': command['id'], 'error': None,
+                               'name': 'éé'}, ensure_ascii=False)
+            data = (data + '\n').encode('utf-8')
+            split = data.index('é'.encode('utf-8')) + 1
+            return [data[:split], data[split:]]
+        self._serve(respond)
+        response = self.connection.send('info', [])
+        self.assertEqual(response['name'], 'éé')
+
+    def test_stale_response(self):
+        def respond(command):
+            stale = {'id': 0, 'error': None, 'method': 'stale'}
+            fresh = {'id': command['id'], 'error': None,
+                     'method': command['method']}
+            return [(json.dumps(stale) + '\n' + json.dumps(fresh) + '\n'
+                     + json.dumps(stale)[:5]).encode('ascii')]
+        self._serve(respond)
+        self.assertEqual(self.connection.send('info', [])['method'], 'info')
+
+    def test_large_response(self):
+        workers = [{'device_id': i, 'algorithms': []} for i in range(10000)]
+        def respond(command):
+            data = json.dumps({'id': command['id'], 'error': None,
+                               'workers': workers})
+            return [(data + '\n').encode('ascii')]
+        self._serve(respond)
+        response = self.connection.send('worker.list', [])
+        self.assertEqual(response['workers'], workers)
+
+    def test_reconnect(self):
+        self._serve(_answer, connections=2)
+        self.connection.send('quit', [])
+        self.assertTrue(self.dropped.wait(1))
+        self.assertEqual(self.connection.send('info', [])['method'], 'info')
+
+    def test_no_resend(self):
+        def respond(command):
+            return None if command['method'] == 'worker.add' else _answer(command)
+        self._serve(respond, connections=2)
+        self.connection.send('info', [])
+        # Excavator may have added the worker before hanging up.
+        with self.assertRaises(ConnectionResetError):
+            self.connection.send('worker.add', ['equihash', 0])
+        self.assertTrue(self.dropped.wait(1))
+        self.assertEqual(self.connection.send('info', [])['method'], 'info')
+        self.assertEqual(self.received, ['info', 'worker.add', 'info'])
+
+
+class TestExcavatorPipeline(ServerTests, TestCase):
+
+    def setUp(self):
+        ServerTests.setUp(self)
+        self.pipeline = ExcavatorPipeline(self.listener.getsockname())
+
+    def tearDown(self):
+        self.pipeline.close()
+        ServerTests.tearDown(self)
+
+    def test_out_of_order(self):
+        held = []
+        def respond(command):
+            if len(held) == 0:
+                held.append(command)
+                return []
+            return _answer(command) + _answer(held.pop())
+        self._serve(respond)
+        responses = self.pipeline.send_commands([('info', []),
+                                                 ('worker.list', [])])
+        self.assertEqual([response['method'] for response in responses],
+                         ['info', 'worker.list'])
+
+    def test_timeout(self):
+        self.pipeline._connection.TIMEOUT = 0.1
+        self._serve(lambda command: [])
+        with self.assertRaises(socket.timeout):
+            self.pipeline.send_commands([('info', [])])
+
+    def test_reconnect(self):
+        self._serve(_answer, connections=2)
+        self.pipeline.send_commands([('quit', [])])
+        self.assertTrue(self.dropped.wait(1))
+        response, = self.pipeline.send_commands([('info', [])])
+        self.assertEqual(response['method'], 'info')
+
+    def test_no_resend(self):
+        def respond(command):
+            return None if command['method'] == 'worker.add' else _answer(command)
+        self._serve(respond, connections=2)
+        self.pipeline.send_commands([('info', [])])
+        with self.assertRaises(ConnectionResetError):
+            self.pipeline.send_commands([('worker.free', [0]),
+                                         ('worker.add', ['equihash', 0])])
+        self.assertTrue(self.dropped.wait(1))
+        response, = self.pipeline.send_commands([('info', [])])
+        self.assertEqual(response['method'], 'info')
+        self.assertEqual(self.received,
+                         ['info', 'worker.free', 'worker.add', 'info'])
+
+    def test_latencies(self):
+        def respond(command):
+            if command['method'] == 'worker.list':
+                time.sleep(0.1)
+            return _answer(command)
+        self._serve(respond)
+        latencies = []
+        self.pipeline.send_commands([('info', []), ('worker.list', [])],
+                                    latencies=latencies)
+        self.assertEqual(len(latencies), 2)
+        self.assertLess(latencies[0], 0.1)
+        self.assertGreaterEqual(latencies[1], 0.1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import statistics
+from copy import deepcopy
+from pathlib import Path
+from unittest import main, TestCase
+
+import nuxhash.settings
+import tests
+from nuxhash.miners.excavator import Excavator
+from nuxhash.switching import make_switcher
+from nuxhash.switching.forecast import RingBuffer
+from nuxhash.switching.naive import NaiveSwitcher
+
+
+class TestRingBuffer(TestCase):
+
+    def test_window(self):
+        buffer = RingBuffer(3)
+        self.assertEqual(buffer.mean(), 0.0)
+        for value in [1.0, 2.0, 3.0, 4.0, 5.0]:
+            buffer.append(value)
+        self.assertEqual(list(buffer), [3.0, 4.0, 5.0])
+        self.assertEqual(buffer.mean(), 4.0)
+        self.assertAlmostEqual(buffer.stddev(),
+                               statistics.pstdev([3.0, 4.0, 5.0]))
+
+    def test_long_run(self):
+        buffer = RingBuffer(4)
+        values = [i*0.1 % 1.7 for i in range(1000)]
+        for value in values:
+            buffer.append(value)
+        self.assertAlmostEqual(buffer.mean(), statistics.mean(values[-4:]))
+        self.assertAlmostEqual(buffer.stddev(), statistics.pstdev(values[-4:]))
+
+
+class TestForecastSwitcher(TestCase):
+
+    def setUp(self):
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['switching']['method'] = 'forecast'
+        self.settings['switching']['threshold'] = 0.1
+        self.settings['switching']['window'] = 5
+
+        self.device = tests.get_test_devices()[0]
+        self.miner = Excavator(Path('/'))
+        self.equihash = next(a for a in self.miner.algorithms
+                             if a.algorithms == ['equihash'])
+        self.neoscrypt = next(a for a in self.miner.algorithms
+                              if a.algorithms == ['neoscrypt'])
+
+        self.switcher = make_switcher(self.settings)
+        self.switcher.reset()
+
+    def decide(self, switcher, equihash, neoscrypt):
+        decision = switcher.decide(
+            {self.device: {self.equihash: equihash,
+                           self.neoscrypt: neoscrypt}}, None)
+        return decision[self.device]
+
+    def test_spike(self):
+        naive = NaiveSwitcher(self.settings)
+        for switcher in [naive, self.switcher]:
+            for i in range(5):
+                self.assertEqual(self.decide(switcher, 2.0, 1.0),
+                                 self.equihash)
+        self.assertEqual(self.decide(naive, 2.0, 5.0), self.neoscrypt)
+        self.assertEqual(self.decide(self.switcher, 2.0, 5.0), self.equihash)
+
+    def test_sustained(self):
+        for i in range(5):
+            self.decide(self.switcher, 2.0, 1.0)
+        decisions = [self.decide(self.switcher, 2.0, 5.0) for i in range(10)]
+        self.assertEqual(decisions[0], self.equihash)
+        self.assertEqual(decisions[-1], self.neoscrypt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from unittest import main, TestCase
+
+from nuxhash.miners.miner import (last_output, log_output, LogMultiplexer,
+                                  wait_for_output)
+
+
+class TestLogOutput(TestCase):
+
+    def _spawn(self, script):
+        process = subprocess.Popen(
+            [sys.executable, '-c', script],
+            stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE)
+        log_output(process)
+        process.wait()
+        self.assertTrue(wait_for_output(process, 5))
+        return process
+
+    def test_lines(self):
+        process = self._spawn("print('one'); print(); print('two', end='')")
+        self.assertEqual(last_output(process), ['one', 'two'])
+
+    def test_ring_buffer(self):
+        n = LogMultiplexer.HISTORY_LINES + 50
+        process = self._spawn(f'for i in range({n}): print(i)')
+        lines = last_output(process)
+        self.assertEqual(len(lines), LogMultiplexer.HISTORY_LINES)
+        self.assertEqual(lines[-1], str(n - 1))
+
+    def test_long_line(self):
+        n = LogMultiplexer.MAX_LINE
+        process = self._spawn(f"print('a'*{n} + 'b'*{n} + 'c', end='')")
+        self.assertEqual(last_output(process), ['a'*n, 'b'*n, 'c'])
+
+    def test_many_processes(self):
+        processes = [self._spawn(f"print('process {i}')") for i in range(5)]
+        self.assertEqual([last_output(p) for p in processes],
+                         [[f'process {i}'] for i in range(5)])
+
+
+if __name__ == '__main__':
+    main()
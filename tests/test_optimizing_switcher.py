@@ -0,0 +1,88 @@
+from copy import deepcopy
+from pathlib import Path
+from unittest import main, TestCase
+
+import nuxhash.settings
+import tests
+from nuxhash.miners.excavator import Excavator
+from nuxhash.switching import make_switcher
+
+
+class TestOptimizingSwitcher(TestCase):
+
+    def setUp(self):
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['switching']['method'] = 'optimizer'
+        self.settings['switching']['threshold'] = 0.1
+        self.limits = self.settings['constraints']
+
+        self.devices = tests.get_test_devices()
+        self.miner = Excavator(Path('/'))
+        def algorithm(name):
+            return next(a for a in self.miner.algorithms
+                        if a.name == f'excavator_{name}')
+        self.equihash = algorithm('equihash')
+        self.neoscrypt = algorithm('neoscrypt')
+        self.cryptonight = algorithm('cryptonightV7')
+
+        self.switcher = make_switcher(self.settings)
+        self.switcher.reset()
+
+    def decide(self, *rows):
+        """Decide on revenues for equihash, neoscrypt and cryptonight."""
+        revenues = {device: {self.equihash: equihash,
+                             self.neoscrypt: neoscrypt,
+                             self.cryptonight: cryptonight}
+                    for device, (equihash, neoscrypt, cryptonight)
+                    in zip(self.devices, rows)}
+        decision = self.switcher.decide(revenues, None)
+        return [decision.get(device, None) for device in self.devices]
+
+    def test_unconstrained(self):
+        self.assertEqual(self.decide((3.0, 2.0, 1.0), (1.0, 3.0, 2.0),
+                                     (1.0, 2.0, 3.0)),
+                         [self.equihash, self.neoscrypt, self.cryptonight])
+
+    def test_max_devices(self):
+        self.limits['max_devices_per_algorithm'] = 1
+        self.assertEqual(self.decide((3.0, 2.0, 1.0), (4.0, 1.0, 2.0),
+                                     (5.0, 1.0, 0.5)),
+                         [self.neoscrypt, self.cryptonight, self.equihash])
+
+    def test_cpu_budget(self):
+        self.limits['cpu_budget'] = 1
+        self.assertEqual(self.decide((1.0, 2.0, 3.0), (1.0, 2.0, 4.0),
+                                     (1.0, 2.0, 3.5)),
+                         [self.neoscrypt, self.cryptonight, self.neoscrypt])
+
+    def test_power_cap(self):
+        self.limits['device_watts'] = 100
+        self.limits['algorithm_watts'] = 'equihash: 200'
+        self.limits['power_cap'] = 500
+        self.assertEqual(self.decide((3.0, 2.0, 0.0), (4.0, 2.0, 0.0),
+                                     (5.0, 2.0, 0.0)),
+                         [self.neoscrypt, self.equihash, self.equihash])
+        self.limits['power_cap'] = 450
+        self.switcher.reset()
+        self.assertEqual(self.decide((3.0, 2.0, 0.0), (4.0, 2.0, 0.0),
+                                     (5.0, 2.0, 0.0)),
+                         [None, self.equihash, self.equihash])
+
+    def test_grouping(self):
+        rows = [(3.0, 1.0, 0.0), (2.9, 3.0, 0.0), (1.0, 2.0, 0.0)]
+        self.assertEqual(self.decide(*rows),
+                         [self.equihash, self.neoscrypt, self.neoscrypt])
+        self.limits['grouping'] = 0.1
+        self.switcher.reset()
+        rows = [(3.0, 1.0, 0.0), (2.9, 3.0, 0.0), (1.0, 1.0, 2.0)]
+        self.assertEqual(self.decide(*rows),
+                         [self.equihash, self.equihash, self.cryptonight])
+
+    def test_threshold(self):
+        self.decide((2.0, 1.0, 0.0))
+        self.assertEqual(self.decide((2.0, 2.1, 0.0))[0], self.equihash)
+        self.assertEqual(self.decide((2.0, 2.5, 0.0))[0], self.neoscrypt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+from pathlib import Path
+from unittest import main, TestCase
+
+import tests
+from nuxhash.miners.excavator import Excavator
+from nuxhash.switching.revenue import RevenueMatrix
+
+
+class TestRevenueMatrix(TestCase):
+
+    def setUp(self):
+        self.devices = tests.get_test_devices()
+        self.benchmarks = tests.get_test_benchmarks()
+        self.algorithms = Excavator(Path('/')).algorithms
+        self.pascal = next(a for a in self.algorithms
+                           if a.name == 'excavator_daggerhashimoto_pascal')
+        self.payrates = {'equihash': 4.0, 'daggerhashimoto': 3.0,
+                         'pascal': 2.0, 'neoscrypt': 1.0}
+        self.matrix = RevenueMatrix(self.devices, self.algorithms,
+                                    self.benchmarks)
+
+    def expected(self, device, algorithm):
+        speeds = self.benchmarks[device].get(algorithm.name, [])
+        return sum([self.payrates.get(sub_algo, 0.0)*speed
+                    for sub_algo, speed in zip(algorithm.algorithms, speeds)])
+
+    def test_revenues(self):
+        revenues = self.matrix.revenues(self.payrates)
+        for device in self.devices:
+            self.assertEqual(revenues[device],
+                             {algorithm: self.expected(device, algorithm)
+                              for algorithm in self.algorithms})
+        self.assertEqual(revenues[self.devices[0]][self.pascal],
+                         3.0*25 + 2.0*400)
+
+    def test_missing_payrate(self):
+        del self.payrates['pascal']
+        revenues = self.matrix.revenues(self.payrates)
+        self.assertEqual(revenues[self.devices[0]][self.pascal], 3.0*25)
+
+    def test_set_speeds(self):
+        device = self.devices[1]
+        self.matrix.set_speeds(device, self.pascal, [20, 300])
+        revenues = self.matrix.revenues(self.payrates)
+        self.assertEqual(revenues[device][self.pascal], 3.0*20 + 2.0*300)
+
+    def test_one_algorithm(self):
+        matrix = RevenueMatrix(self.devices, [self.pascal], self.benchmarks)
+        revenues = matrix.revenues(self.payrates)
+        self.assertEqual(revenues[self.devices[2]],
+                         {self.pascal: 3.0*30 + 2.0*500})
+
+
+if __name__ == '__main__':
+    main()
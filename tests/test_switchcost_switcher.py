@@ -0,0 +1,72 @@
+from copy import deepcopy
+from pathlib import Path
+from unittest import main, TestCase
+
+import nuxhash.settings
+import tests
+from nuxhash.benchmarking import Benchmark
+from nuxhash.miners.excavator import Excavator
+from nuxhash.switching import make_switcher
+from nuxhash.switching.switchcost import SwitchCostSwitcher
+
+
+class TestSwitchCostSwitcher(TestCase):
+
+    def setUp(self):
+        self.settings = deepcopy(nuxhash.settings.DEFAULT_SETTINGS)
+        self.settings['switching']['method'] = 'switchcost'
+        self.settings['switching']['threshold'] = 0.1
+        self.settings['switching']['min_dwell'] = 300
+
+        self.device = tests.get_test_devices()[0]
+        self.benchmarks = {self.device: {}}
+        self.miner = Excavator(Path('/'))
+        self.equihash = next(a for a in self.miner.algorithms
+                             if a.algorithms == ['equihash'])
+        self.neoscrypt = next(a for a in self.miner.algorithms
+                              if a.algorithms == ['neoscrypt'])
+
+        self.switcher = make_switcher(self.settings, self.benchmarks)
+
+    def decide(self, equihash, neoscrypt, timestamp):
+        decision = self.switcher.decide(
+            {self.device: {self.equihash: equihash,
+                           self.neoscrypt: neoscrypt}}, timestamp)
+        return decision[self.device]
+
+    def test_factory(self):
+        self.assertIsInstance(self.switcher, SwitchCostSwitcher)
+        self.settings['switching']['method'] = 'bogus'
+        with self.assertRaises(ValueError):
+            make_switcher(self.settings)
+
+    def test_net_of_switch(self):
+        self.assertEqual(self.decide(2.0, 1.0, 0), self.equihash)
+        # 2.5 over 300 s, less 30 s of warmup, beats 2.0 by 12.5%.
+        self.assertEqual(self.decide(2.0, 2.5, 300), self.neoscrypt)
+
+    def test_measured_warmup(self):
+        self.benchmarks[self.device]['excavator_neoscrypt'] = Benchmark(
+            [1.0], warmup=100)
+        self.assertEqual(self.decide(2.0, 1.0, 0), self.equihash)
+        self.assertEqual(self.decide(2.0, 2.5, 300), self.equihash)
+        self.assertEqual(self.decide(2.0, 3.5, 300), self.neoscrypt)
+
+    def test_min_dwell(self):
+        self.assertEqual(self.decide(2.0, 1.0, 0), self.equihash)
+        self.assertEqual(self.decide(2.0, 10.0, 299), self.equihash)
+        self.assertEqual(self.decide(2.0, 10.0, 300), self.neoscrypt)
+
+    def test_learned_latency(self):
+        self.assertEqual(self.switcher.switch_cost(self.device, self.neoscrypt),
+                         30)
+        self.decide(1.0, 2.0, 0)
+        self.switcher.switched({self.device: 10.0})
+        self.assertEqual(self.switcher.switch_cost(self.device, self.neoscrypt),
+                         40)
+        self.assertEqual(self.switcher.switch_cost(self.device, self.equihash),
+                         30)
+
+
+if __name__ == '__main__':
+    main()
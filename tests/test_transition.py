@@ -0,0 +1,70 @@
+from unittest import main, TestCase
+
+import tests
+from nuxhash.miners.miner import Algorithm, Miner, plan_transition, run_transition
+
+
+class FakeMiner(Miner):
+
+    def __init__(self):
+        Miner.__init__(self, None)
+        self.running = False
+        self.calls = []
+
+    def load(self):
+        self.running = True
+
+    def is_running(self):
+        return self.running
+
+
+class FakeAlgorithm(Algorithm):
+
+    def accepts(self, device):
+        return True
+
+    def set_devices(self, devices):
+        self.parent.calls.append((self.name, set(devices)))
+        self._devices = devices
+
+
+class TestTransition(TestCase):
+
+    def setUp(self):
+        self.devices = tests.get_test_devices()
+        self.miner = FakeMiner()
+        self.equihash = FakeAlgorithm(self.miner, 'equihash', ['equihash'])
+        self.neoscrypt = FakeAlgorithm(self.miner, 'neoscrypt', ['neoscrypt'])
+
+    def test_unchanged(self):
+        old = {device: self.equihash for device in self.devices}
+        self.assertEqual(plan_transition(old, dict(old)), [])
+
+    def test_plan_order(self):
+        d0, d1, d2 = self.devices
+        old = {d1: self.equihash, d2: self.neoscrypt}
+        new = {d0: self.equihash, d1: self.neoscrypt}
+        self.assertEqual(plan_transition(old, new),
+                         [(d0, None, self.equihash),
+                          (d1, self.equihash, self.neoscrypt),
+                          (d2, self.neoscrypt, None)])
+
+    def test_run_loads_miner(self):
+        run_transition({}, {self.devices[0]: self.equihash})
+        self.assertTrue(self.miner.running)
+
+    def test_run_touches_changed_only(self):
+        d0, d1, d2 = self.devices
+        old = {d0: self.equihash, d1: self.equihash, d2: self.neoscrypt}
+        self.equihash._devices = [d0, d1]
+        self.neoscrypt._devices = [d2]
+        self.miner.running = True
+        new = {d0: self.equihash, d1: self.neoscrypt, d2: self.neoscrypt}
+        started = run_transition(old, new)
+        self.assertEqual(self.miner.calls, [('equihash', {d0}),
+                                            ('neoscrypt', {d1, d2})])
+        self.assertEqual(set(started.keys()), {d1})
+
+
+if __name__ == '__main__':
+    main()